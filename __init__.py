@@ -1,4 +1,5 @@
 from .timestamped_value import TimestampedValue
+from .average import Average
 from .period import Period, to_datetime
 from .window import Window, max_window
 from .duration import Duration
@@ -1,5 +1,6 @@
 from ._types import Tuple
 from .list_ir import PartitionedListSchema
+import threading
 
 class AggregatedDataStore:
 	def __init__(self, ListStore, table):
@@ -22,7 +23,7 @@ class AggregatedDataStore:
 	def _schema(self, part_keys, kind):
 		PartID = Tuple(*(x.type for x in self._table_schema.partition_by if x.name in part_keys))
 		sort_by = self._table_schema.sort_by if kind == self._table_schema.kind else self._table_schema.group.sort_by
-		return PartitionedListSchema(PartID, self._table_schema.kinds[kind].AggregatedRow, sort_by)
+		return PartitionedListSchema(PartID, self._table_schema.kinds[kind].AggregatedRow, sort_by, self._table_schema.storage["parts"], self._table_schema.storage["compression"], self._table_schema.storage["partindex"])
 
 	def _liststore(self, period, part_keys, kind):
 		prefix = self._prefix(part_keys, kind, period)
@@ -37,12 +38,42 @@ class AggregatedDataStore:
 		part_id = [partition[k] for k in part_keys]
 		return self._liststore(period, part_keys, kind).list(part_id, sort, range)
 
+	def columns(self, period, partition, kind, sort, names=None):
+		part_keys = sorted(partition.keys())
+		part_id = [partition[k] for k in part_keys]
+		return self._liststore(period, part_keys, kind).columns(part_id, sort, names)
+
 	def save_single(self, period, part_keys, kind, partitions):
 		self._liststore(period, part_keys, kind).save(partitions)
 
-	def save(self, period, data):
-		for (part_keys, kind), partitions in data:
-			self.save_single(period, part_keys, kind, partitions)
+	def save(self, period, data, executor=None, max_in_flight=1):
+		"""Save every (part_keys, kind) of data.
+
+		With an executor, partitions are computed here, and serialized and uploaded in the executor meanwhile.
+		At most max_in_flight (part_keys, kind) are submitted at a time, and one more is computed meanwhile, so
+		that they don't pile up in memory when computing them is faster than uploading them."""
+		if executor is None:
+			for (part_keys, kind), partitions in data:
+				self.save_single(period, part_keys, kind, partitions)
+			return
+
+		in_flight = threading.BoundedSemaphore(max(max_in_flight, 1))
+		futures = []
+		try:
+			for (part_keys, kind), partitions in data:
+				partitions = [(part_id, list(rows)) for part_id, rows in partitions]
+				in_flight.acquire()
+				try:
+					future = executor.submit(self.save_single, period, part_keys, kind, partitions)
+				except:
+					in_flight.release()
+					raise
+				del partitions # Only the executor keeps them, until they are uploaded.
+				future.add_done_callback(lambda future: in_flight.release())
+				futures.append(future)
+		finally:
+			for future in futures:
+				future.result()
 
 if __name__ == "__main__":
 	from . import Period
@@ -63,6 +94,7 @@ if __name__ == "__main__":
 			partition_by = [game, lang]
 			sort_by      = [viewers_avg, viewers_max]
 			kind         = 'channel'
+			storage      = {"parts": "rows", "compression": None, "partindex": "hashtable"}
 
 	p = Period("2016-01-01T00:00:00Z", "2016-01-02T00:00:00Z")
 	fs = FakeFS()
@@ -2,6 +2,7 @@ from datetime import datetime, timedelta
 from .duration import Duration
 from .period import Period, to_datetime
 from .timestamped_value import TimestampedValue
+from .average import Average
 from collections import OrderedDict
 
 def to_json_ready(obj):
@@ -41,7 +42,7 @@ class AggregatedRowBase:
 			by_name[tag] = i
 			i += 1
 
-		for field in AggregatedRow.Fields.specs.values():
+		for field in AggregatedRow.AggregatedFields.specs.values():
 			if field.type[0] == "timestamped":
 				by_name[field.name] = i
 				i += 1
@@ -56,6 +57,10 @@ class AggregatedRowBase:
 				by_name[field.name] = i
 				i += 1
 
+		for f in AggregatedRow.averages:
+			by_name[AggregatedRow.AggregatedFields._fields[f] + ".dt"] = i
+			i += 1
+
 		return by_name
 
 	def serialize(self):
@@ -83,9 +88,15 @@ class AggregatedRowBase:
 					row.append(None)
 			elif field.type[0] == "duration":
 				row.append(val.total_seconds())
+			elif type(val) is Average:
+				row.append(float(val))
 			else:
 				row.append(val)
 
+		# After the fields, so that rows stored before don't have them.
+		for f in AggregatedRow.averages:
+			row.append(getattr(self.fields[f], "dt", None))
+
 		return to_json_ready(row)
 
 	@classmethod
@@ -112,8 +123,23 @@ class AggregatedRowBase:
 			fields[f] = val
 			f += 1
 
+		for f in AggregatedRow.averages:
+			if i < len(row) and row[i] is not None and fields[f] is not None:
+				fields[f] = Average(fields[f], row[i])
+			i += 1
+
 		return AggregatedRow(AggregatedRow.Tags(*tags), AggregatedRow.AggregatedFields(*fields))
 
+def _averages(AggregatedFields):
+	"""Indexes of the fields that are averages rolled up weighted by the duration they cover (see Average)."""
+	averages = []
+	for field in AggregatedFields.internal_fields.values():
+		if "avg" in field.ops:
+			spec = AggregatedFields.specs[field.name + "_avg"]
+			if not spec.expr:
+				averages.append(spec.col)
+	return averages
+
 def AggregatedRowForKind(kind_, Tags_, AggregatedFields_):
 	class AggregatedRow(AggregatedRowBase):
 		__name__ = "AggregatedRow:" + kind_
@@ -121,5 +147,6 @@ def AggregatedRowForKind(kind_, Tags_, AggregatedFields_):
 		kind = kind_
 		Tags = Tags_
 		AggregatedFields = AggregatedFields_
+		averages = _averages(AggregatedFields_)
 
 	return AggregatedRow
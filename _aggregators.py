@@ -1,5 +1,6 @@
+from .aggregation_engine import PartialResults, merge_all
 import itertools
-import operator
+import heapq
 
 """
 All mappings are single-pass, and iterate like dict.items().
@@ -25,9 +26,6 @@ data:
 		(DotA, en): channels
 """
 
-def partitioned(data, key):
-	return [(x, list(y)) for x, y in itertools.groupby(sorted(data, key=key), key=key)]
-
 def powerset(iterable):
 	"powerset([1,2,3]) --> () (1,) (2,) (3,) (1,2) (1,3) (2,3) (1,2,3)"
 	s = list(iterable)
@@ -39,47 +37,100 @@ class RawAggregator:
 		self.period = period
 
 	def rows(self, kind, rows):
-		for tags, fields in rows:
-			data = fields(self.period)
+		for tags, data in rows:
 			for val in data:
 				if val is None:
 					break
 			else:
 				yield self.table.schema.kinds[kind].AggregatedRow(tags, data)
 
-	def partitions(self, part_keys, kind):
-		partitioned_data = self.table.query_raw(self.period, {}, part_keys, kind = kind) # [(part_id), [Tags(), MagicResult()]]
-		for part_values, rows in partitioned_data:
-			print("PV", part_values)
+	def partitions(self, kind, partitions):
+		for part_values, rows in partitions:
 			yield part_values, self.rows(kind, rows)
 
 	def __iter__(self):
-		for part_keys in powerset(self.table.schema.group.by):
-			for kind in self.table.schema.kinds:
-				if not kind in part_keys:
-					yield (part_keys, kind), self.partitions(part_keys, kind)
+		# The raw data is read and transformed once, for all the partitionings and kinds.
+		sinks = [(part_keys, kind) for part_keys in powerset(self.table.schema.group.by) for kind in self.table.schema.kinds if not kind in part_keys]
+		for (part_keys, kind), partitions in self.table.query_fields_all(self.period, sinks):
+			yield (part_keys, kind), self.partitions(kind, partitions)
 
 class ReAggregator:
-	def __init__(self, table, source_periods):
+	def __init__(self, table, source_periods, cached=None):
 		self.table = table
 		self.source_periods = list(source_periods)
+		# {(start, end): {(part_keys, kind): [(part_id, rows)]}} of source periods that were just rolled up.
+		self.cached = cached or {}
+
+	def _source(self, subperiod, part_keys, kind):
+		try:
+			return iter(self.cached[(subperiod.start, subperiod.end)][(part_keys, kind)])
+		except KeyError:
+			return self.table.aggregated_data.list_all_parts(subperiod, part_keys, kind, self.table.schema.default_sort_by)
 
 	def partitions(self, part_keys, kind):
-		source_data = itertools.chain.from_iterable(
-			((subperiod, part_values, list(rows)) for part_values, rows in self.table.aggregated_data.list_all_parts(subperiod, part_keys, kind, self.table.schema.default_sort_by))
-			for subperiod in self.source_periods
-		)
+		# Parts are stored sorted by id, so the source periods are merged part by part,
+		# reading each of them once. (id, index of subperiod) keeps the rows of a part in time order.
+		sources = [
+			((part_values, i, subperiod, rows) for part_values, rows in self._source(subperiod, part_keys, kind))
+			for i, subperiod in enumerate(self.source_periods)
+		]
+		merged = heapq.merge(*sources, key=lambda x: (tuple(x[0]), x[1]))
 
-		for part_values, spr in partitioned(source_data, key=operator.itemgetter(1)):
-			print("PV", part_values)
+		for part_values, spr in itertools.groupby(merged, key=lambda x: tuple(x[0])):
 			big_rows = itertools.chain.from_iterable(
 				((subperiod, row) for row in rows)
-				for subperiod, _, rows in spr
+				for _, _, subperiod, rows in spr
 			)
-			yield part_values, self.table.aggregate_results(big_rows)
+			# Aggregated before moving on to the next part, which consumes this one's rows.
+			yield part_values, list(self.table.aggregate_results(big_rows))
+
+	def _partials(self, pool, subperiod, part_keys, kind):
+		"""[(part_id, PartialResults)] of a source period, sorted by part id - a future of [(part_id, PartialResults.plain())]
+		if they're computed in the pool."""
+		try:
+			partitions = self.cached[(subperiod.start, subperiod.end)][(part_keys, kind)]
+		except KeyError:
+			from ._parallel import partial_results
+			return pool.submit(partial_results, self.table.name, self.table._desc, self.table.db()._connection, subperiod, part_keys, kind)
+		return sorted(((tuple(part_values), PartialResults(rows)) for part_values, rows in partitions), key=lambda x: x[0])
+
+	def _merged(self, kind, partials):
+		"""Partitions of the partial results of every source period, merged part by part in time order."""
+		kindspec = self.table.schema.kinds[kind]
+
+		def parts(i, partitions):
+			if not isinstance(partitions, list):
+				partitions = partitions.result()
+			# Popped, so that the parts that were merged can be freed.
+			partitions.reverse()
+			while partitions:
+				part_values, partial = partitions.pop()
+				if not isinstance(partial, PartialResults):
+					partial = PartialResults.from_plain(partial, kindspec.AggregatedRow, kindspec.Tags, kindspec.AggregatedFields)
+				yield tuple(part_values), i, partial
+
+		# Like in partitions(), but the partial results of a part are merged as a tree (see merge_all()).
+		merged = heapq.merge(*(parts(i, x) for i, x in enumerate(partials)), key=lambda x: x[:2])
+		for part_values, part in itertools.groupby(merged, key=lambda x: x[0]):
+			merged_part = merge_all(partial for _, _, partial in part)
+			yield part_values, sorted(merged_part.rows(), key=lambda row: row.tags)
 
 	def __iter__(self):
-		for part_keys in powerset(self.table.schema.group.by):
-			for kind in self.table.schema.kinds:
-				if not kind in part_keys:
-					yield (part_keys, kind), self.partitions(part_keys, kind)
+		sinks = [(part_keys, kind) for part_keys in powerset(self.table.schema.group.by) for kind in self.table.schema.kinds if not kind in part_keys]
+
+		db = self.table.db()
+		pool = db.process_pool
+		if pool is None:
+			for part_keys, kind in sinks:
+				yield (part_keys, kind), self.partitions(part_keys, kind)
+			return
+
+		# Every source period of a (part_keys, kind) is aggregated in a worker, which reads its parts itself. The next
+		# (part_keys, kind) is submitted before this one is merged, so that the workers keep busy, but no more, so
+		# that the partial results of at most two of them are in memory.
+		submit = lambda part_keys, kind: [self._partials(pool, subperiod, part_keys, kind) for subperiod in self.source_periods]
+		following = submit(*sinks[0]) if sinks else None
+		for i, (part_keys, kind) in enumerate(sinks):
+			partials = following
+			following = submit(*sinks[i + 1]) if i + 1 < len(sinks) else None
+			yield (part_keys, kind), self._merged(kind, partials)
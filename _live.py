@@ -0,0 +1,64 @@
+from .period import Period
+from collections import OrderedDict
+from datetime import datetime
+import itertools
+import warnings
+
+class LiveQuery:
+	"""Table.get() of a period that's still being collected.
+
+	Every update() fetches only the raw rows collected since the previous one,
+	and appends them to the series (see query_engine.LiveSeries)."""
+
+	def __init__(self, table, where, since, fields=None):
+		self.table = table
+		self.where = where
+		self.kind = table._kind_of(where)
+		self.fields = fields
+
+		self.merged = self.kind != table.schema.kind
+		self.series = OrderedDict()
+
+		required = table.query_engine.required_period(Period(since, since), fields, group=self.merged)
+		self.fetched = required.start
+
+	def update(self, until=None):
+		"""Fetch and append the rows collected until the given time (or now)."""
+		if until is None:
+			until = datetime.utcnow()
+
+		rows = self.table.raw_data.query(Period(self.fetched, until), self.where)
+		rows = sorted(rows, key=lambda row: (self.table._tags_func(row), row.time))
+		self.fetched = until
+
+		with warnings.catch_warnings():
+			warnings.simplefilter("ignore", UserWarning) # Ignore scipy.interpolate warning about not good-enough interpolation.
+
+			for tags, series_rows in itertools.groupby(rows, key=self.table._tags_func):
+				try:
+					series = self.series[tags]
+				except KeyError:
+					series = self.series[tags] = self.table.query_engine.live_series((), tags)
+				series.append(series_rows)
+
+	@property
+	def result(self):
+		engine = self.table.query_engine
+		if self.merged:
+			return engine.merge((tags, series.fields) for tags, series in self.series.items())
+		for series in self.series.values():
+			return series.fields
+		return engine.empty_result
+
+	def get(self, period, granularity = None):
+		if granularity is None:
+			granularity = period.duration
+
+		tags = self.table.schema.kinds[self.kind].Tags(**self.where)
+		AggregatedRow = self.table.schema.kinds[self.kind].AggregatedRow
+
+		with warnings.catch_warnings():
+			warnings.simplefilter("ignore", UserWarning)
+
+			for subperiod, data in self.result(period, granularity, self.fields):
+				yield subperiod, AggregatedRow(tags, data)
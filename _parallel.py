@@ -0,0 +1,105 @@
+"""
+Series transformation and re-aggregation in worker processes.
+
+Series are shipped as (tags, time, {field: array}) - see RawSeries.columns() -
+in chunks of at most chunk_size series, and the workers send back plain
+tuples of the aggregated field values, or of the states of partial
+aggregations (see PartialResults.plain()). Everything that can't be pickled
+(the namedtuple types generated from the schema) stays in the calling process.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from .schema import parse_table_schema, RawTableSchema
+from .query_engine import QueryEngine
+from .query_engine.column import RawSeries
+from .query_engine.spline_cache import SplineCache
+from .aggregation_engine import PartialResults
+import multiprocessing
+import warnings
+
+_engines = {}
+
+def _query_engine(table_name, table_desc):
+	try:
+		return _engines[table_name]
+	except KeyError:
+		schema = parse_table_schema(RawTableSchema(**table_desc))
+		engine = _engines[table_name] = QueryEngine(schema, table_name, SplineCache.from_env())
+		return engine
+
+def _plain(result):
+	if isinstance(result, list):
+		return [(period, tuple(fields)) for period, fields in result]
+	return tuple(result)
+
+def _transform(engine, series):
+	tags, time, columns = series
+	return engine.transform_datapoints(RawSeries.from_columns(time, columns, engine.series_key(tags), engine.spline_cache))
+
+def evaluate_chunk(table_name, table_desc, merged, period, granularity, fields, units):
+	"""Aggregated fields of every unit - a series, or a list of series to merge if merged."""
+	engine = _query_engine(table_name, table_desc)
+
+	with warnings.catch_warnings():
+		warnings.simplefilter("ignore", UserWarning) # Ignore scipy.interpolate warning about not good-enough interpolation.
+
+		results = []
+		for unit in units:
+			if merged:
+				result = engine.merge((series[0], _transform(engine, series)) for series in unit)
+			else:
+				result = _transform(engine, unit)
+			results.append(_plain(result(period, granularity, fields)))
+		return results
+
+_database = None
+
+def _table(table_name, table_desc, connection):
+	"""Table of a database connected like the one of the calling process."""
+	global _database
+	if _database is None:
+		from .database import Database
+		_database = Database(workers=0)
+		_database.connect(**connection)
+
+	try:
+		return _database.tables[table_name]
+	except KeyError:
+		from .table import Table
+		table = _database.tables[table_name] = Table(_database, table_name, **table_desc)
+		return table
+
+def partial_results(table_name, table_desc, connection, subperiod, part_keys, kind):
+	"""PartialResults of every stored part of part_keys and kind in subperiod, as [(part_id, PartialResults.plain())]."""
+	table = _table(table_name, table_desc, connection)
+	return [
+		(tuple(part_id), PartialResults(rows).plain())
+		for part_id, rows in table.aggregated_data.list_all_parts(subperiod, part_keys, kind, table.schema.default_sort_by)
+	]
+
+def chunked(units, chunk_size, size=lambda unit: 1):
+	"""Split units into lists of at most chunk_size series. Units are never split."""
+	chunk = []
+	chunk_series = 0
+	for unit in units:
+		n = size(unit)
+		if chunk and chunk_series + n > chunk_size:
+			yield chunk
+			chunk = []
+			chunk_series = 0
+		chunk.append(unit)
+		chunk_series += n
+	if chunk:
+		yield chunk
+
+def process_pool(workers):
+	# fork keeps the start cheap, and the workers inherit the already imported scipy.
+	try:
+		context = multiprocessing.get_context("fork")
+	except ValueError:
+		context = None
+	pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+	# The workers are forked at the first submit - do it now, while the caller knows which threads are running.
+	pool.submit(int).result()
+	return pool
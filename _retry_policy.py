@@ -0,0 +1,17 @@
+from cassandra.policies import RetryPolicy
+
+class LoggingAutoRetryPolicy(RetryPolicy):
+	def __init__(self, logger):
+		self.logger = logger
+
+	def on_read_timeout(self, query, consistency, required_responses, received_responses, data_retrieved, retry_num):
+		self.logger.warning("*Read Timeout*. *Retrying.*")
+		return self.RETRY, consistency
+
+	def on_write_timeout(self, query, consistency, write_type, required_responses, received_responses, retry_num):
+		self.logger.warning("*Write Timeout*. *Retrying.*")
+		return self.RETRY, consistency
+
+	def on_unavailable(self, query, consistency, required_replicas, alive_replicas, retry_num):
+		self.logger.warning("*Server Unavailable*. *Retrying.*")
+		return self.RETRY, consistency
@@ -1,31 +1,96 @@
 import logging
+from .period import Period
 from ._aggregators import RawAggregator, ReAggregator
 
-def rollup(table, period):
+def rollup(table, period, cascade=False, all_done=None):
+	"""Roll up period. With cascade, also the longer periods that are due at its end, if all_done(periods)
+	says that their other source periods are rolled up - see _cascade().
+
+	Returns the rolled up periods."""
 	logger = logging.getLogger("redflood.rollup")
 
 	logger.info("Rollup: %s %s starting.", table.name, period)
 
 	try:
-		_rollup(table, period, logger)
+		if cascade:
+			periods = _cascade(table, period, logger, all_done)
+		else:
+			_rollup(table, period, logger)
+			periods = [period]
 	except Exception as e:
 		logger.exception("Rollup: %s %s failed.", table.name, period)
 		raise
 
 	logger.info("Rollup: %s %s done.", table.name, period)
+	return periods
 
-def _rollup(table, period, logger):
+def _base_granularity(table, period):
+	"""The longest granularity that period consists of, or 0 if it's rolled up from the raw data."""
 	smaller_granularity = 0
 	for gran in table.granularities:
 		if gran < period.duration:
 			if (period.duration % gran).total_seconds() == 0:
-				smaller_granularity = gran
+				if smaller_granularity == 0 or gran > smaller_granularity:
+					smaller_granularity = gran
+	return smaller_granularity
+
+def source_periods(table, period):
+	"""Rolled up periods that period is rolled up from - none if it's rolled up from the raw data."""
+	smaller_granularity = _base_granularity(table, period)
+	if smaller_granularity == 0:
+		return []
+	return [p for p in period.subperiods(smaller_granularity) if table.wants_rollup(p)]
+
+def _aggregator(table, period, logger, cached=None):
+	smaller_granularity = _base_granularity(table, period)
 
 	logger.info("Using base granularity: %s", smaller_granularity)
 
 	if smaller_granularity == 0:
-		data = RawAggregator(table, period)
+		return RawAggregator(table, period)
 	else:
-		data = ReAggregator(table, period.subperiods(smaller_granularity))
+		return ReAggregator(table, period.subperiods(smaller_granularity), cached)
+
+def _rollup(table, period, logger):
+	data = _aggregator(table, period, logger)
+	db = table.db()
+	table.aggregated_data.save(period, data, db.io_pool, db.io_threads)
+
+def _cascade(table, period, logger, all_done=None):
+	"""Roll up period, and then the longer periods that are due at its end, from the shorter ones.
+
+	A longer period is rolled up only if all its source periods are - by this
+	cascade, or as all_done(periods) says (e.g. the job queue). Otherwise it's
+	left to its own job, which runs when they are. The aggregated partitions
+	of a period are kept in memory only while a longer period is yet to read
+	them, so that it doesn't read them back from the store."""
+	periods = [period] + [p for p in table.wanted_rollups(period.end) if p.duration > period.duration]
+	sources = [[(s.start, s.end) for s in source_periods(table, p)] for p in periods]
+
+	rolled_up = []
+	cached = {}
+	for i, p in enumerate(periods):
+		if i > 0:
+			done = set((r.start, r.end) for r in rolled_up)
+			others = [Period(start, end) for start, end in sources[i] if (start, end) not in done]
+			if others and (all_done is None or not all_done(others)):
+				logger.info("Rollup: %s %s left to the queue, not all its source periods are done.", table.name, p)
+				continue
+
+		logger.info("Rollup: %s %s (cascade).", table.name, p)
+		data = _aggregator(table, p, logger, cached)
+
+		needed = set(key for later in sources[i + 1:] for key in later)
+		if (p.start, p.end) in needed:
+			data = [(sink, [(part_id, list(rows)) for part_id, rows in partitions]) for sink, partitions in data]
+			cached[(p.start, p.end)] = dict(data)
+
+		db = table.db()
+		table.aggregated_data.save(p, data, db.io_pool, db.io_threads)
+		rolled_up.append(p)
+
+		for key in list(cached):
+			if key not in needed:
+				del cached[key]
 
-	table.aggregated_data.save(period, data)
+	return rolled_up
@@ -36,6 +36,8 @@ def ByteArray(N):
 	return ByteArray
 
 def Text(N, encoding='utf-8'):
+	Padded = ByteArray(N)
+
 	class Text(str):
 		__qualname__ = "Text({}, '{}')".format(N, encoding)
 		SIZE = N
@@ -44,7 +46,7 @@ def Text(N, encoding='utf-8'):
 			assert(isinstance(arg, str))
 
 		def __bytes__(self):
-			return bytes(ByteArray(N)(self.encode(encoding)))
+			return bytes(Padded(self.encode(encoding)))
 
 		@classmethod
 		def from_bytes(cls, val):
@@ -56,6 +58,7 @@ def Text(N, encoding='utf-8'):
 def Array(Type, N):
 	class Array(tuple):
 		SIZE = Type.SIZE * N
+		LENGTH = N
 		__slots__ = ()
 
 		def __new__(cls, *args):
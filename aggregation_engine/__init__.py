@@ -1 +1 @@
-from .engine import aggregate_results
+from .engine import aggregate_results, PartialResults, merge_all
@@ -1,33 +1,19 @@
 from collections import namedtuple, OrderedDict
-from itertools import groupby
 from ..timestamped_value import TimestampedValue
+from ..average import Average
+import tempfile
 import operator
-
-class Column:
-	def __init__(self, results, field):
-		self.results = results
-		self.field = field
-
-	def __len__(self):
-		return len(self.results)
-
-	def __getitem__(self, index):
-		if isinstance(index, slice):
-			return Column(self.results[index], self.field)
-		return self.results[index][self.field]
-
-	def __iter__(self):
-		for row in self.results:
-			yield row[self.field]
-
-	def __reversed__(self):
-		for row in reversed(self.results):
-			yield row[self.field]
+import heapq
+import pickle
+import shutil
+import os
 
 class Ops:
 	def avg(data):
-		# NOTE: Assumes the function is defined on the whole period of each row.
-		return Ops.sum(data) / len(data)
+		state = _avg_start(data[0])
+		for val in data[1:]:
+			state = _avg_merge(state, _avg_start(val))
+		return _avg_result(state)
 
 	def at_start(data):
 		return data[0]
@@ -81,72 +67,398 @@ class Ops:
 				found = val
 		return found
 
+def _sum_step(total, val):
+	if val is None:
+		return total
+	if total is None:
+		return val
+	return Ops._add(total, val)
+
+def _min_step(found, val):
+	if found is None or (val is not None and val < found):
+		return val
+	return found
+
+def _max_step(found, val):
+	if found is None or (val is not None and val > found):
+		return val
+	return found
+
+def _identity(state):
+	return state
+
+# Ops as running states: state = start(first value), state = step(state, value),
+# result(state). merge(a, b) is the state of the values of a followed by the
+# values of b, so states of consecutive rows can be merged in any grouping.
+Fold = namedtuple("Fold", "start step result merge")
+
+def _fold(start, step, result=_identity, merge=None):
+	return Fold(start, step, result, merge or step)
+
+# avg is (integral, covered duration) of Averages - see Average - and (sum, count) too, for the values
+# that don't know the duration they cover, e.g. stored before they did. Then every row counts the same,
+# as if its function was defined on its whole period.
+def _avg_start(val):
+	if val is None:
+		return (None, 1, 0.0, 0.0)
+	dt = getattr(val, "dt", None)
+	if dt is None:
+		return (val, 1, None, None)
+	return (val, 1, val * dt, dt)
+
+def _add_known(a, b):
+	if a is None or b is None:
+		return None
+	return a + b
+
+def _avg_merge(a, b):
+	return (_sum_step(a[0], b[0]), a[1] + b[1], _add_known(a[2], b[2]), _add_known(a[3], b[3]))
+
+def _avg_result(state):
+	total, count, integral, covered = state
+	if covered:
+		return Average(integral / covered, covered)
+	if total is None:
+		return None
+	return total / count
+
+FOLDS = {
+	"avg": _fold(_avg_start, lambda state, val: _avg_merge(state, _avg_start(val)), _avg_result, _avg_merge),
+	"at_start": _fold(_identity, lambda state, val: state),
+	"at_end": _fold(_identity, lambda state, val: val),
+	"earliest": _fold(_identity, lambda state, val: val if state is None else state),
+	"latest": _fold(_identity, lambda state, val: state if val is None else val),
+	"sum": _fold(_identity, _sum_step),
+	"union": _fold(_identity, _sum_step),
+	"min": _fold(_identity, _min_step),
+	"max": _fold(_identity, _max_step),
+}
+
+BINARY_OPS = OrderedDict([
+	("+", operator.add),
+	("-", operator.sub),
+	("*", operator.mul),
+	("//", operator.floordiv),
+	("/", operator.truediv),
+])
+
+def _compile_expr(expr, specs):
+	"""Function computing a derived field (e.g. "time_watched / time_streamed") from the other aggregated values."""
+	for binop, func in BINARY_OPS.items():
+		if binop in expr:
+			break
+
+	a_name, b_name = (x.strip() for x in expr.split(binop))
+	a_col = specs[a_name].col
+	b_col = specs[b_name].col
+
+	def derived(results):
+		a = results[a_col]
+		b = results[b_col]
+		if isinstance(a, TimestampedValue):
+			a = a.value
+		if isinstance(b, TimestampedValue):
+			b = b.value
+		try:
+			return func(a, b)
+		except (ZeroDivisionError, TypeError):
+			return None
+
+	return derived
+
+class Aggregator:
+	"""aggregate() for one AggregatedFields type, with the schema already resolved.
+
+	reductions are (column, Ops function) pairs, folds are the same as
+	(column, Fold) pairs, derived are (column, function of the reduced values)
+	pairs."""
+
+	def __init__(self, AggregatedFields):
+		self.AggregatedFields = AggregatedFields
+		self.reductions = []
+		self.folds = []
+		self.derived = []
+
+		col = 0
+		for field in AggregatedFields.internal_fields.values():
+			ops = field.ops
+			if ops is None:
+				ops = [None]
+
+			for op in ops:
+				full_name = field.name + ("_" + op if op else "")
+				spec = AggregatedFields.specs[full_name]
+
+				# Derived fields are calculated from the others later.
+				if not spec.expr:
+					self.reductions.append((col, getattr(Ops, op or "sum")))
+					self.folds.append((col, FOLDS[op or "sum"]))
+
+				col += 1
+
+		self.width = col
+
+		for col, (name, spec) in enumerate(AggregatedFields.specs.items()):
+			if spec.expr:
+				self.derived.append((col, _compile_expr(spec.expr, AggregatedFields.specs)))
+
+	def __call__(self, input_data):
+		if len(input_data) == 1:
+			return input_data[0]
+
+		columns = list(zip(*input_data))
+
+		results = [None] * self.width
+		for col, reduce in self.reductions:
+			results[col] = reduce(columns[col])
+		for col, derived in self.derived:
+			results[col] = derived(results)
+
+		return self.AggregatedFields(*results)
+
+	def start(self, fields):
+		"""Running state of a group, starting with a row."""
+		return [1, fields, [fold.start(fields[col]) for col, fold in self.folds]]
+
+	def add(self, state, fields):
+		state[0] += 1
+		values = state[2]
+		for i, (col, fold) in enumerate(self.folds):
+			values[i] = fold.step(values[i], fields[col])
+
+	def merge(self, a, b):
+		"""State of the rows of a followed by the rows of b."""
+		return [a[0] + b[0], a[1], [fold.merge(x, y) for (col, fold), x, y in zip(self.folds, a[2], b[2])]]
+
+	def finish(self, state):
+		count, first, values = state
+		if count == 1:
+			return first
+
+		results = [None] * self.width
+		for (col, fold), value in zip(self.folds, values):
+			results[col] = fold.result(value)
+		for col, derived in self.derived:
+			results[col] = derived(results)
+
+		return self.AggregatedFields(*results)
+
+_aggregators = {}
+
+def aggregator(AggregatedFields):
+	try:
+		return _aggregators[AggregatedFields]
+	except KeyError:
+		compiled = _aggregators[AggregatedFields] = Aggregator(AggregatedFields)
+		return compiled
+
 def aggregate(input_data): # input_data is a list of AggregatedFields.
 	if len(input_data) == 1:
-		# This is a feature, not only an optimization.
-		# We can't usually sum averages, but we can do it if there is only one row!
 		return input_data[0]
 
-	AggregatedFields = type(input_data[0])
+	return aggregator(type(input_data[0]))(input_data)
 
-	results = []
+class PartialResults:
+	"""Running states of aggregate_results(), per tags.
 
-	col = 0
-	for field in AggregatedFields.internal_fields.values():
-		ops = field.ops
-		if ops is None:
-			ops = [None]
+	Partial results of consecutive parts of the rows (e.g. of the days of a
+	week) can be merged in any grouping - see merge_all(). plain() and
+	from_plain() convert them to tuples that can be sent to other processes."""
 
-		for op in ops:
-			full_name = field.name + ("_" + op if op else "")
-			spec = AggregatedFields.specs[full_name]
+	def __init__(self, rows=()):
+		self.groups = {} # tags: (AggregatedRow, aggregator, state)
+		for row in rows:
+			self.add(row)
 
-			if not op:
-				op = "sum"
+	def __len__(self):
+		return len(self.groups)
 
-			if spec.expr:
-				# Calculated later.
-				res = None
-			else:
-				res = getattr(Ops, op)(Column(input_data, col))
-
-			results.append(res)
-			col += 1
-
-	for col, (name, spec) in enumerate(AggregatedFields.specs.items()):
-		if spec.expr:
-			binary_ops = {
-				"+": operator.add,
-				"-": operator.sub,
-				"*": operator.mul,
-				"//": operator.floordiv,
-				"/": operator.truediv,
-			}
-
-			for binop in binary_ops:
-				if binop in spec.expr:
-					op = binop
-					break
-
-			a_name, b_name = (x.strip() for x in spec.expr.split(op))
-			a = results[AggregatedFields.specs[a_name].col]
-			b = results[AggregatedFields.specs[b_name].col]
-			if isinstance(a, TimestampedValue):
-				a = a.value
-			if isinstance(b, TimestampedValue):
-				b = b.value
+	def __contains__(self, tags):
+		return tags in self.groups
+
+	def add(self, row):
+		try:
+			AggregatedRow, compiled, state = self.groups[row.tags]
+		except KeyError:
+			compiled = aggregator(type(row.fields))
+			self.groups[row.tags] = (type(row), compiled, compiled.start(row.fields))
+		else:
+			compiled.add(state, row.fields)
+
+	def merge(self, other):
+		"""Merge in the results of rows following ours. other must not be used afterwards."""
+		for tags, group in other.groups.items():
 			try:
-				results[col] = binary_ops[op](a, b)
-			except (ZeroDivisionError, TypeError):
-				results[col] = None
-
-	return AggregatedFields(*results)
-
-def aggregate_results(iterable):
-	# iterable: period, AggregatedRow
-	key = lambda x: x[1].tags
-	for tags, rows in groupby(sorted(iterable, key=key), key):
-		rows = list(rows)
-		AggregatedRow = type(rows[0][1])
-		result = aggregate([data.fields for p, data in rows])
-		yield AggregatedRow(tags, result)
+				AggregatedRow, compiled, state = self.groups[tags]
+			except KeyError:
+				self.groups[tags] = group
+			else:
+				self.groups[tags] = (AggregatedRow, compiled, compiled.merge(state, group[2]))
+		return self
+
+	def rows(self):
+		"""Aggregated rows, in no particular order."""
+		for tags, (AggregatedRow, compiled, state) in self.groups.items():
+			yield AggregatedRow(tags, compiled.finish(state))
+
+	def plain(self):
+		return [(tuple(tags), state[0], tuple(state[1]), state[2]) for tags, (_, _, state) in self.groups.items()]
+
+	@classmethod
+	def from_plain(cls, plain, AggregatedRow, Tags, AggregatedFields):
+		partial = cls()
+		compiled = aggregator(AggregatedFields)
+		for tags, count, first, values in plain:
+			partial.groups[Tags(*tags)] = (AggregatedRow, compiled, [count, AggregatedFields(*first), list(values)])
+		return partial
+
+def merge_all(partials):
+	"""Merge a list of consecutive PartialResults pairwise, as a balanced tree."""
+	partials = list(partials)
+	if not partials:
+		return PartialResults()
+
+	while len(partials) > 1:
+		merged = [a.merge(b) for a, b in zip(partials[::2], partials[1::2])]
+		if len(partials) % 2:
+			merged.append(partials[-1])
+		partials = merged
+	return partials[0]
+
+class _Spill:
+	"""Rows of the groups that didn't fit in memory, hash partitioned into files.
+
+	Rows are pickled as plain tuples - the namedtuple types generated from the
+	schema can't be pickled - and rebuilt with the types of the first row."""
+
+	PARTITIONS = 16
+
+	def __init__(self, directory, level):
+		self.directory = tempfile.mkdtemp(prefix="redflood-aggregate-", dir=directory)
+		self.level = level
+		self.files = [None] * self.PARTITIONS
+		self.types = None
+
+	def write(self, row):
+		if self.types is None:
+			self.types = (type(row), type(row.tags), type(row.fields))
+
+		# The level salts the hash, so that a partition that doesn't fit either is split differently.
+		tags = tuple(row.tags)
+		i = hash((self.level, tags)) % self.PARTITIONS
+		if self.files[i] is None:
+			self.files[i] = open(os.path.join(self.directory, str(i)), "w+b")
+		pickle.dump((tags, tuple(row.fields)), self.files[i], pickle.HIGHEST_PROTOCOL)
+
+	def partitions(self):
+		for f in self.files:
+			if f is None:
+				continue
+			f.seek(0)
+			yield _read_rows(f, self.types)
+
+	def close(self):
+		_close(self.files, self.directory)
+
+class _Runs:
+	"""Runs of aggregated rows sorted by tags, in files, to be merged. Pickled like in _Spill."""
+
+	def __init__(self, directory):
+		self.directory = tempfile.mkdtemp(prefix="redflood-runs-", dir=directory)
+		self.files = []
+		self.types = None
+
+	def write(self, rows):
+		f = open(os.path.join(self.directory, str(len(self.files))), "w+b")
+		self.files.append(f)
+		for row in rows:
+			if self.types is None:
+				self.types = (type(row), type(row.tags), type(row.fields))
+			pickle.dump((tuple(row.tags), tuple(row.fields)), f, pickle.HIGHEST_PROTOCOL)
+
+	def runs(self):
+		for f in self.files:
+			f.seek(0)
+			yield _read_rows(f, self.types)
+
+	def close(self):
+		_close(self.files, self.directory)
+
+def _read_rows(f, types):
+	AggregatedRow, Tags, AggregatedFields = types
+	while True:
+		try:
+			tags, fields = pickle.load(f)
+		except EOFError:
+			return
+		yield AggregatedRow(Tags(*tags), AggregatedFields(*fields))
+
+def _close(files, directory):
+	for f in files:
+		if f is not None:
+			f.close()
+	shutil.rmtree(directory, ignore_errors=True)
+
+def _tags(row):
+	return row.tags
+
+def _sorted_runs(rows, max_groups, spill_dir, level=0):
+	"""Aggregated rows of groups of rows with the same tags, as runs sorted by tags - the groups that fit in
+	memory, and then the runs of every spilled partition. Every group is in exactly one run."""
+	groups = PartialResults()
+	spill = None
+	try:
+		for row in rows:
+			if len(groups) >= max_groups and row.tags not in groups:
+				if spill is None:
+					spill = _Spill(spill_dir, level)
+				spill.write(row)
+			else:
+				groups.add(row)
+
+		run = sorted(groups.rows(), key=_tags)
+		groups = None
+		yield run
+		run = None
+
+		if spill is not None:
+			for partition in spill.partitions():
+				yield from _sorted_runs(partition, max_groups, spill_dir, level + 1)
+	finally:
+		if spill is not None:
+			spill.close()
+
+def aggregate_results(iterable, max_groups=None, spill_dir=None):
+	"""Aggregate (period, AggregatedRow) pairs with the same tags, and yield the aggregated rows sorted by tags.
+
+	Rows are folded into a running state per tags as they come, so only one
+	state per group is kept, not the rows. If there are more than max_groups
+	groups (REDFLOOD_AGGREGATE_MAX_GROUPS, default 1000000), rows of the groups
+	that don't fit are spilled to files in spill_dir (REDFLOOD_SPILL_DIR, or
+	the default temporary directory), and aggregated afterwards, a partition at
+	a time. The aggregated rows of every partition are written back sorted, and
+	merged with the groups that fit, so at most twice max_groups groups are in
+	memory."""
+	if max_groups is None:
+		max_groups = int(os.environ.get("REDFLOOD_AGGREGATE_MAX_GROUPS", 1000000))
+	if spill_dir is None:
+		spill_dir = os.environ.get("REDFLOOD_SPILL_DIR") or None
+
+	runs = _sorted_runs((data for p, data in iterable), max(max_groups, 1), spill_dir)
+	first = next(runs)
+	stored = None
+	try:
+		for run in runs:
+			if run:
+				if stored is None:
+					stored = _Runs(spill_dir)
+				stored.write(run)
+			run = None
+
+		if stored is None:
+			yield from first
+		else:
+			yield from heapq.merge(first, *stored.runs(), key=_tags)
+	finally:
+		if stored is not None:
+			stored.close()
@@ -0,0 +1,193 @@
+from .engine import aggregate_results, aggregate, PartialResults, merge_all
+from .. import TimestampedValue, Duration, Period, to_datetime
+from ..average import Average
+from ..schema import parse_table_schema, load_yaml
+from ..query_engine import QueryEngine
+from collections import namedtuple
+from datetime import timedelta
+from itertools import groupby
+import tempfile
+import random
+import os
+
+schema_yaml = """
+since: 2016-01-01T00:00:00Z
+raw_table_name: raw_channels
+kind: channel
+
+tags:
+	channel: text
+
+raw_fields:
+	viewers:     bigint
+	total_views: bigint
+
+fields:
+	viewers:      [interpolate_nonnegative(viewers over 10m), [avg, max]]
+	total_views:  [smooth(total_views over 1h), [earliest, latest]]
+	is_streaming: [exists(viewers), [at_start, at_end]]
+
+	time_streamed: is_streaming dt
+	time_watched:  viewers dt
+	new_views:     d total_views
+
+aggregated_fields:
+	viewers_avg: double
+	viewers_max: timestamped bigint
+	total_views_earliest: timestamped bigint
+	total_views_latest: timestamped bigint
+	is_streaming_at_start: int
+	is_streaming_at_end: int
+	time_streamed: duration
+	time_watched: duration
+	new_views: bigint
+
+group:
+	by: []
+	fields: {}
+	aggregated_fields: {}
+
+partition_by: []
+sort_by: [viewers_max]
+default_sort_by: viewers_max
+charts: {}
+leaderboards: {}
+rollups: {}
+"""
+
+desc = load_yaml(schema_yaml)
+desc["since"] = to_datetime(desc["since"])
+schema = parse_table_schema(desc)
+AggregatedRow = schema.kinds["channel"].AggregatedRow
+
+def generate(seed, n, groups):
+	"""(hour, AggregatedRow) of n rows of the given number of groups, in time order."""
+	r = random.Random(seed)
+	base = to_datetime("2016-01-01T00:00:00Z")
+	rows = []
+	for i in range(n):
+		hour = base + timedelta(hours=i * 24 // n)
+		timestamped = lambda: TimestampedValue(r.randint(0, 1000), hour + timedelta(minutes=r.randint(0, 59))) if r.random() > 0.1 else None
+		tags = AggregatedRow.Tags("c%i" % r.randrange(groups))
+		fields = AggregatedRow.AggregatedFields(
+			Average(r.uniform(0, 1000), r.uniform(1, 3600)), timestamped(), timestamped(), timestamped(),
+			r.randint(0, 1), r.randint(0, 1), Duration(seconds=r.randint(0, 3600)), Duration(seconds=r.randint(0, 10**6)), r.choice([None, r.randint(0, 50)])
+		)
+		rows.append((hour, AggregatedRow(tags, fields)))
+	return rows
+
+def plain(rows):
+	return [(tuple(row.tags), tuple(row.fields)) for row in rows]
+
+def close(a, b):
+	if isinstance(a, float) or isinstance(b, float):
+		return a is not None and b is not None and abs(a - b) <= 1e-9 * max(1, abs(a), abs(b))
+	if isinstance(a, (tuple, list)):
+		return len(a) == len(b) and all(close(x, y) for x, y in zip(a, b))
+	return a == b
+
+rows = generate(1, 5000, 500)
+expected = plain(aggregate_results(rows))
+assert(len(expected) == 500)
+assert([tags for tags, fields in expected] == sorted(tags for tags, fields in expected))
+
+# Groups that don't fit are spilled, and aggregated the same, even when a spilled partition doesn't fit either.
+spill_dir = tempfile.mkdtemp()
+for max_groups in (1, 10, 100, 500, 10**6):
+	assert(plain(aggregate_results(iter(rows), max_groups=max_groups, spill_dir=spill_dir)) == expected)
+	assert(os.listdir(spill_dir) == [])
+
+# Stopping early removes the spilled rows too.
+results = aggregate_results(iter(rows), max_groups=10, spill_dir=spill_dir)
+next(results)
+assert(os.listdir(spill_dir) != [])
+results.close()
+assert(os.listdir(spill_dir) == [])
+
+# The threshold can be set in the environment.
+os.environ["REDFLOOD_AGGREGATE_MAX_GROUPS"] = "100"
+os.environ["REDFLOOD_SPILL_DIR"] = spill_dir
+results = aggregate_results(iter(rows))
+next(results)
+assert(os.listdir(spill_dir) != [])
+assert(plain(results) == expected[1:])
+assert(os.listdir(spill_dir) == [])
+del os.environ["REDFLOOD_AGGREGATE_MAX_GROUPS"], os.environ["REDFLOOD_SPILL_DIR"]
+
+os.rmdir(spill_dir)
+
+# Partial results of consecutive hours merge to the same results, however they're grouped.
+def partials():
+	return [PartialResults(row for hour, row in hour_rows) for hour, hour_rows in groupby(rows, key=lambda row: row[0])]
+
+def results(partial):
+	return sorted(plain(partial.rows()))
+
+def left(partials):
+	merged = partials[0]
+	for partial in partials[1:]:
+		merged = merged.merge(partial)
+	return merged
+
+def right(partials):
+	merged = partials[-1]
+	for partial in reversed(partials[:-1]):
+		merged = partial.merge(merged)
+	return merged
+
+def random_tree(partials, r):
+	while len(partials) > 1:
+		i = r.randrange(len(partials) - 1)
+		partials[i:i + 2] = [partials[i].merge(partials[i + 1])]
+	return partials[0]
+
+assert(len(partials()) == 24)
+assert(close(results(merge_all(partials())), expected))
+assert(close(results(left(partials())), expected))
+assert(close(results(right(partials())), expected))
+assert(close(results(merge_all(left(chunk) for chunk in zip(*[iter(partials())] * 6))), expected))
+for seed in range(5):
+	assert(close(results(random_tree(partials(), random.Random(seed))), expected))
+
+# Also when sent to another process.
+plains = [partial.plain() for partial in partials()]
+assert(close(results(merge_all(PartialResults.from_plain(p, AggregatedRow, AggregatedRow.Tags, AggregatedRow.AggregatedFields) for p in plains)), expected))
+
+# Averages are weighted by the duration they cover, and cover the sum of them.
+Fields = AggregatedRow.AggregatedFields
+def fields(avg):
+	return Fields(avg, None, None, None, 1, 1, Duration(seconds=0), Duration(seconds=0), None)
+
+result = aggregate([fields(Average(1000.0, 300)), fields(None), fields(Average(10.0, 3600))])
+assert(close(result.viewers_avg, (1000 * 300 + 10 * 3600) / 3900) and result.viewers_avg.dt == 3900)
+
+# Averages stored before they knew the duration they cover count the same.
+result = aggregate([fields(Average(1000.0, 300)), fields(10.0)])
+assert(result.viewers_avg == 505.0 and not isinstance(result.viewers_avg, Average))
+
+# The duration is stored with the average.
+at = TimestampedValue(5, to_datetime("2016-01-01T00:00:00Z"))
+row = AggregatedRow(AggregatedRow.Tags("c"), fields(Average(10.0, 3600))._replace(viewers_max=at, total_views_earliest=at, total_views_latest=at))
+stored = row.serialize()
+assert(stored[-1] == 3600 and type(stored[1]) is float)
+assert(AggregatedRow.unserialize(stored).fields.viewers_avg.dt == 3600)
+assert(AggregatedRow.unserialize(stored[:-1]).fields.viewers_avg == 10.0)
+
+# Averages of hours roll up to the average of the day, even where the series has gaps.
+RawRow = namedtuple("RawRow", "channel time viewers total_views")
+r = random.Random(2)
+time = to_datetime("2016-01-01T00:00:00Z")
+viewers = 1000
+raw = []
+for i in range(1000):
+	time += timedelta(minutes=r.choice([1, 1, 1, 2, 45]))
+	viewers = max(0, viewers + r.randint(-300, 300))
+	raw.append(RawRow("c", time, viewers, 1000 + i))
+
+day = Period("2016-01-01T00:00:00Z", "2016-01-02T00:00:00Z")
+series = QueryEngine(schema).transform_datapoints(raw)
+hours = [hour_fields for hour, hour_fields in series(day, Duration("1h")) if hour_fields.viewers_avg is not None]
+assert(close(aggregate(hours).viewers_avg, series(day).viewers_avg))
+assert(close(aggregate(hours).viewers_avg.dt, series(day).time_streamed.total_seconds()))
+
+print("OK")
@@ -14,6 +14,17 @@ CREATE TABLE IF NOT EXISTS rollups
 	PRIMARY KEY (what, end, start, status, priority)
 ) WITH CLUSTERING ORDER BY (end desc);
 
+CREATE TABLE IF NOT EXISTS rollup_claims
+(
+	what text,
+	start timestamp,
+	end timestamp,
+	owner text,
+	lease_until timestamp,
+	attempts int,
+	PRIMARY KEY ((what, start, end))
+);
+
 CREATE MATERIALIZED VIEW IF NOT EXISTS rollups_prio AS
 	SELECT * FROM rollups
 	WHERE what IS NOT NULL AND start IS NOT NULL AND end IS NOT NULL AND status IS NOT NULL AND priority IS NOT NULL
@@ -0,0 +1,147 @@
+"""
+Pool of long-lived worker processes.
+
+Workers are forked from the parent, so they start with everything it has
+already imported. Each calls init() once - e.g. to connect to the database -
+and then run(state, job) for every job it gets, and sends back its result. A worker that crashes, or
+doesn't finish a job within the timeout, is killed and replaced, and only
+its job fails.
+
+Workers aren't daemonic, so that jobs can use process pools of their own
+(db.process_pool). Each worker leads a process group, and killing it kills
+the processes it started too.
+"""
+
+from multiprocessing.connection import wait
+from time import monotonic, sleep
+import multiprocessing
+import logging
+import atexit
+import signal
+import os
+
+def _serve(conn, init, run):
+	os.setpgid(0, 0)
+	logger = logging.getLogger(__name__)
+	state = init()
+	while True:
+		try:
+			job = conn.recv()
+		except EOFError:
+			return
+
+		try:
+			result = run(state, job)
+		except Exception:
+			logger.exception("Job %s failed.", job)
+			conn.send((False, None))
+		else:
+			conn.send((True, result))
+
+class Worker:
+	def __init__(self, context, init, run):
+		self.conn, child = context.Pipe()
+		self.process = context.Process(target=_serve, args=(child, init, run))
+		self.process.start()
+		child.close()
+		try:
+			os.setpgid(self.process.pid, self.process.pid) # Also done by the worker - whichever runs first.
+		except OSError:
+			pass
+
+		self.job = None
+		self.deadline = None
+
+	def kill(self):
+		try:
+			os.killpg(self.process.pid, signal.SIGKILL)
+		except OSError:
+			self.process.kill()
+		self.process.join()
+		self.conn.close()
+
+class WorkerPool:
+	def __init__(self, workers, init, run, timeout=None):
+		try:
+			self._context = multiprocessing.get_context("fork")
+		except ValueError:
+			self._context = multiprocessing.get_context()
+
+		self._init = init
+		self._run = run
+		self.timeout = timeout
+		self.workers = [self._start() for _ in range(workers)]
+		# Before multiprocessing joins the workers at exit, which would wait forever for them to get EOF.
+		atexit.register(self.close)
+
+	def _start(self):
+		return Worker(self._context, self._init, self._run)
+
+	@property
+	def idle(self):
+		return sum(1 for worker in self.workers if worker.job is None)
+
+	@property
+	def running(self):
+		return set(worker.job for worker in self.workers if worker.job is not None)
+
+	def submit(self, job):
+		for worker in self.workers:
+			if worker.job is None:
+				break
+		else:
+			raise RuntimeError("No idle worker.")
+
+		worker.conn.send(job)
+		worker.job = job
+		worker.deadline = monotonic() + self.timeout if self.timeout else None
+
+	def wait(self, timeout):
+		"""[(job, succeeded, result)] of the jobs that finished, crashed or timed out within timeout seconds."""
+		busy = [worker for worker in self.workers if worker.job is not None]
+		if not busy:
+			sleep(timeout)
+			return []
+
+		deadlines = [worker.deadline for worker in busy if worker.deadline is not None]
+		if deadlines:
+			timeout = max(0, min([timeout] + [deadline - monotonic() for deadline in deadlines]))
+
+		ready = wait([worker.conn for worker in busy] + [worker.process.sentinel for worker in busy], timeout)
+
+		logger = logging.getLogger(__name__)
+		finished = []
+		for i, worker in enumerate(self.workers):
+			if worker.job is None:
+				continue
+
+			crashed = False
+			if worker.conn in ready:
+				try:
+					finished.append((worker.job,) + worker.conn.recv())
+					worker.job = None
+					continue
+				except EOFError:
+					crashed = True
+
+			if crashed or worker.process.sentinel in ready or not worker.process.is_alive():
+				worker.kill()
+				logger.error("Worker crashed (exit code %s) running %s. *Restarting it.*", worker.process.exitcode, worker.job)
+			elif worker.deadline is not None and monotonic() >= worker.deadline:
+				worker.kill()
+				logger.error("Job %s timed out. *Restarting the worker.*", worker.job)
+			else:
+				continue
+
+			finished.append((worker.job, False, None))
+			self.workers[i] = self._start()
+
+		return finished
+
+	def close(self):
+		for worker in self.workers:
+			worker.conn.close()
+		for worker in self.workers:
+			worker.process.join(timeout=1)
+			if worker.process.is_alive():
+				worker.kill()
@@ -0,0 +1,206 @@
+"""
+Queue of rollup jobs, which can be shared by many workers.
+
+A worker claims jobs atomically, which gives it a lease on them for
+lease_time. It has to renew the lease with heartbeat() while it runs the
+job, and a job whose lease expired (e.g. its worker died) can be claimed
+again. A failed job is retried after retry_delay, and after max_attempts
+claims it's marked 'failed'.
+
+If dependencies(what, start, end) is given, a job can be claimed only when
+the jobs of all the (start, end) it returns are done - e.g. a day when all
+its hours are rolled up.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+import sqlite3
+import socket
+import logging
+import os
+
+Job = namedtuple("Job", "what start end attempts")
+
+class JobQueue:
+	def __init__(self, owner=None, lease_time=timedelta(seconds=60), retry_delay=timedelta(seconds=10), max_attempts=5, dependencies=None):
+		self.owner = owner or "{}:{}".format(socket.gethostname(), os.getpid())
+		self.lease_time = lease_time
+		self.retry_delay = retry_delay
+		self.max_attempts = max_attempts
+		self.dependencies = dependencies
+
+	def _ready(self, what, start, end):
+		if self.dependencies is None:
+			return True
+		return self.all_done(what, self.dependencies(what, start, end))
+
+	def all_done(self, what, periods):
+		"""Whether the jobs of all the (start, end) periods are done."""
+		if not periods:
+			return True
+
+		done = self._done(what, min(s for s, e in periods), max(e for s, e in periods))
+		return all((s, e) in done for s, e in periods)
+
+	def _done(self, what, start, end):
+		"""{(start, end)} of the done jobs within start and end."""
+		raise NotImplementedError
+
+	def schedule(self, what, start, end, priority):
+		raise NotImplementedError
+
+	def claim(self, limit=1):
+		"""Claimed jobs - at most limit of the 'todo' jobs of the highest priority."""
+		raise NotImplementedError
+
+	def heartbeat(self, job):
+		"""Renew the lease of a claimed job. False if it was lost."""
+		raise NotImplementedError
+
+	def done(self, job):
+		raise NotImplementedError
+
+	def fail(self, job):
+		raise NotImplementedError
+
+class CassandraJobQueue(JobQueue):
+	"""Jobs in the rollups table, claimed with lightweight transactions on rollup_claims."""
+
+	def __init__(self, session, **kwargs):
+		super().__init__(**kwargs)
+		self.session = session
+
+	def schedule(self, what, start, end, priority):
+		self.session.execute("INSERT INTO rollups (what, start, end, status, priority) VALUES (%s, %s, %s, 'todo', %s)", (what, start, end, priority))
+
+	def claim(self, limit=1):
+		claimed = []
+		# Some of the jobs at the top are probably claimed by others.
+		for row in self.session.execute("SELECT * FROM rollups_prio WHERE status = 'todo' LIMIT %s", (limit * 10,)):
+			if not self._ready(row.what, row.start, row.end):
+				continue
+
+			job = self._claim((row.what, row.start, row.end))
+			if job is not None:
+				claimed.append(job)
+				if len(claimed) == limit:
+					break
+		return claimed
+
+	def _claim(self, key):
+		now = datetime.utcnow()
+		claims = list(self.session.execute("SELECT lease_until, attempts FROM rollup_claims WHERE what = %s AND start = %s AND end = %s", key))
+
+		if not claims:
+			attempts = 1
+			res = self.session.execute("INSERT INTO rollup_claims (what, start, end, owner, lease_until, attempts) VALUES (%s, %s, %s, %s, %s, %s) IF NOT EXISTS", key + (self.owner, now + self.lease_time, attempts))
+		else:
+			claim = claims[0]
+			if claim.lease_until > now:
+				return None
+
+			if claim.attempts >= self.max_attempts:
+				self._give_up(key)
+				return None
+
+			attempts = claim.attempts + 1
+			# Nobody else renewed or claimed it since we've read it.
+			res = self.session.execute("UPDATE rollup_claims SET owner = %s, lease_until = %s, attempts = %s WHERE what = %s AND start = %s AND end = %s IF lease_until = %s", (self.owner, now + self.lease_time, attempts) + key + (claim.lease_until,))
+
+		if not res.was_applied:
+			return None
+		return Job(*key, attempts)
+
+	def _give_up(self, key):
+		logging.getLogger(__name__).error("Rollup: %s %s - %s failed too many times. *Giving up.*", *key)
+		self.session.execute("INSERT INTO rollups (what, start, end, status, priority) VALUES (%s, %s, %s, 'failed', 0)", key)
+		self.session.execute("DELETE FROM rollups WHERE what = %s AND start = %s AND end = %s AND status = 'todo'", key)
+
+	def _done(self, what, start, end):
+		rows = self.session.execute("SELECT start, end, status FROM rollups WHERE what = %s AND end > %s AND end <= %s", (what, start, end))
+		return set((row.start, row.end) for row in rows if row.status == 'done' and row.start >= start)
+
+	def heartbeat(self, job):
+		res = self.session.execute("UPDATE rollup_claims SET lease_until = %s WHERE what = %s AND start = %s AND end = %s IF owner = %s", (datetime.utcnow() + self.lease_time, job.what, job.start, job.end, self.owner))
+		return res.was_applied
+
+	def done(self, job):
+		key = (job.what, job.start, job.end)
+		self.session.execute("INSERT INTO rollups (what, start, end, status, priority) VALUES (%s, %s, %s, 'done', 0)", key)
+		self.session.execute("DELETE FROM rollups WHERE what = %s AND start = %s AND end = %s AND status = 'todo'", key)
+		self.session.execute("DELETE FROM rollup_claims WHERE what = %s AND start = %s AND end = %s", key)
+
+	def fail(self, job):
+		# Released, but nobody can claim it before retry_delay.
+		self.session.execute("UPDATE rollup_claims SET owner = null, lease_until = %s WHERE what = %s AND start = %s AND end = %s IF owner = %s", (datetime.utcnow() + self.retry_delay, job.what, job.start, job.end, self.owner))
+
+class SQLiteJobQueue(JobQueue):
+	"""The same in an SQLite database, for local runs and tests."""
+
+	def __init__(self, path, **kwargs):
+		super().__init__(**kwargs)
+		self.conn = sqlite3.connect(path, isolation_level=None, timeout=60)
+		self.conn.execute("""CREATE TABLE IF NOT EXISTS rollups (
+			what text, start timestamp, end timestamp, status text, priority int,
+			owner text, lease_until timestamp, attempts int DEFAULT 0,
+			PRIMARY KEY (what, start, end)
+		)""")
+
+	def schedule(self, what, start, end, priority):
+		self.conn.execute("INSERT OR IGNORE INTO rollups (what, start, end, status, priority) VALUES (?, ?, ?, 'todo', ?)", (what, start.isoformat(), end.isoformat(), priority))
+
+	def claim(self, limit=1):
+		now = datetime.utcnow()
+		claimed = []
+
+		self.conn.execute("BEGIN IMMEDIATE")
+		try:
+			rows = self.conn.execute("SELECT what, start, end, attempts FROM rollups WHERE status = 'todo' AND (lease_until IS NULL OR lease_until <= ?) ORDER BY priority DESC", (now.isoformat(),)).fetchall()
+			for what, start, end, attempts in rows:
+				if len(claimed) == limit:
+					break
+
+				if not self._ready(what, datetime.fromisoformat(start), datetime.fromisoformat(end)):
+					continue
+
+				if attempts >= self.max_attempts:
+					logging.getLogger(__name__).error("Rollup: %s %s - %s failed too many times. *Giving up.*", what, start, end)
+					self.conn.execute("UPDATE rollups SET status = 'failed' WHERE what = ? AND start = ? AND end = ?", (what, start, end))
+					continue
+
+				self.conn.execute("UPDATE rollups SET owner = ?, lease_until = ?, attempts = ? WHERE what = ? AND start = ? AND end = ?", (self.owner, (now + self.lease_time).isoformat(), attempts + 1, what, start, end))
+				claimed.append(Job(what, datetime.fromisoformat(start), datetime.fromisoformat(end), attempts + 1))
+		except:
+			self.conn.execute("ROLLBACK")
+			raise
+		self.conn.execute("COMMIT")
+
+		return claimed
+
+	def _done(self, what, start, end):
+		rows = self.conn.execute("SELECT start, end FROM rollups WHERE what = ? AND status = 'done' AND start >= ? AND end <= ?", (what, start.isoformat(), end.isoformat()))
+		return set((datetime.fromisoformat(s), datetime.fromisoformat(e)) for s, e in rows)
+
+	def _update(self, sql, args, job):
+		return self.conn.execute(sql + " WHERE what = ? AND start = ? AND end = ? AND owner = ?", args + (job.what, job.start.isoformat(), job.end.isoformat(), self.owner)).rowcount > 0
+
+	def heartbeat(self, job):
+		return self._update("UPDATE rollups SET lease_until = ?", ((datetime.utcnow() + self.lease_time).isoformat(),), job)
+
+	def done(self, job):
+		self.conn.execute("UPDATE rollups SET status = 'done', owner = null, lease_until = null WHERE what = ? AND start = ? AND end = ?", (job.what, job.start.isoformat(), job.end.isoformat()))
+
+	def fail(self, job):
+		self._update("UPDATE rollups SET owner = null, lease_until = ?", ((datetime.utcnow() + self.retry_delay).isoformat(),), job)
+
+def job_queue(db, **kwargs):
+	"""Queue at REDFLOOD_ROLLUP_QUEUE_URL (sqlite:///path), or in the autorollup status database."""
+	url = os.getenv("REDFLOOD_ROLLUP_QUEUE_URL")
+	if url:
+		url = urlparse(url)
+		if url.scheme != "sqlite":
+			raise ValueError("Unsupported rollup queue: " + url.geturl())
+		return SQLiteJobQueue(url.path, **kwargs)
+
+	return CassandraJobQueue(db._autorollup_status_db, **kwargs)
@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from math import gcd
 from time import sleep
 from .initdb import init_db
+from .queue import job_queue
 import logging
 import os
 
@@ -12,6 +13,7 @@ db = connect()
 autorollup_db = db._autorollup_status_db
 
 init_db(autorollup_db)
+queue = job_queue(db)
 
 states = {}
 
@@ -49,7 +51,7 @@ while True:
 			shall_update = True
 
 			logger.info("Scheduling rollup: %s %s", table.name, period)
-			autorollup_db.execute("INSERT INTO rollups (what, start, end, status, priority) VALUES (%s, %s, %s, 'todo', %s)", (table.name, period.start, period.end, -int(period.duration.total_seconds())))
+			queue.schedule(table.name, period.start, period.end, -int(period.duration.total_seconds()))
 
 		if shall_update:
 			autorollup_db.execute("INSERT INTO scheduler_state (what, state) VALUES (%s, %s)", (table.name, tstate))
@@ -61,6 +63,6 @@ while True:
 		# And we will have anything to interpolate.
 
 		# Why loop? So that we handle clock changes, and everything.
-		# Waking up every minute is not a problem.
-		sleep(60)
+		# Sleeps until the next step is due, but wakes up at least every minute.
+		sleep(min(60, max(1, (common_state - (datetime.utcnow() - timedelta(minutes=5))).total_seconds())))
 
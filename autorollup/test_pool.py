@@ -0,0 +1,108 @@
+from .pool import WorkerPool
+from .._parallel import process_pool
+from time import monotonic, sleep
+import logging
+import os
+
+logging.disable(logging.CRITICAL) # The pool logs the failures this test causes.
+
+def init():
+	return {"pid": os.getpid(), "jobs": 0}
+
+def run(state, job):
+	state["jobs"] += 1
+	if job == "crash":
+		os._exit(3)
+	if job == "hang":
+		sleep(60)
+	if job == "fail":
+		raise ValueError(job)
+	if job in ("pool", "hang in pool"):
+		pool = state.setdefault("pool", process_pool(2))
+		if job == "hang in pool":
+			pool.submit(sleep, 60)
+			sleep(60)
+		return sorted(set(pool.map(getpid_after, [0.1]*4)))
+	return (job, state["pid"], state["jobs"])
+
+def getpid_after(seconds):
+	sleep(seconds)
+	return os.getpid()
+
+def running_in_group(pgid):
+	"""Pids of the processes of the group that are still running, not zombies."""
+	pids = []
+	for pid in os.listdir("/proc"):
+		try:
+			with open("/proc/%s/stat" % pid) as f:
+				fields = f.read().rsplit(")", 1)[1].split()
+		except (OSError, IndexError):
+			continue
+		if int(fields[2]) == pgid and fields[0] != "Z":
+			pids.append(int(pid))
+	return pids
+
+def finish(pool, timeout=10):
+	"""{job: (succeeded, result)} of all the running jobs."""
+	finished = {}
+	deadline = monotonic() + timeout
+	while pool.running:
+		assert(monotonic() < deadline)
+		for job, succeeded, result in pool.wait(1):
+			finished[job] = (succeeded, result)
+	return finished
+
+pool = WorkerPool(1, init, run, timeout=1)
+pid = pool.workers[0].process.pid
+
+# Workers keep their state between jobs.
+pool.submit("a")
+assert(finish(pool) == {"a": (True, ("a", pid, 1))})
+pool.submit("b")
+assert(finish(pool) == {"b": (True, ("b", pid, 2))})
+
+# A job that raises fails, and the worker goes on.
+pool.submit("fail")
+assert(finish(pool) == {"fail": (False, None)})
+assert(pool.workers[0].process.pid == pid)
+
+# A worker that crashes is replaced, and only its job fails.
+pool.submit("crash")
+assert(finish(pool) == {"crash": (False, None)})
+assert(pool.workers[0].process.pid != pid)
+pid = pool.workers[0].process.pid
+
+pool.submit("c")
+assert(finish(pool) == {"c": (True, ("c", pid, 1))})
+
+# A job that doesn't finish within the timeout fails, and its worker is replaced.
+start = monotonic()
+pool.submit("hang")
+assert(pool.idle == 0)
+try:
+	pool.submit("d")
+	assert(False)
+except RuntimeError:
+	pass
+assert(finish(pool) == {"hang": (False, None)})
+assert(1 <= monotonic() - start < 5)
+assert(pool.workers[0].process.pid != pid)
+assert(pool.idle == 1)
+
+pool.submit("d")
+assert(finish(pool)["d"][0])
+
+# Jobs can use process pools.
+pid = pool.workers[0].process.pid
+pool.submit("pool")
+succeeded, pids = finish(pool)["pool"]
+assert(succeeded and len(pids) == 2 and pid not in pids)
+
+# Killing a worker kills the processes it started too.
+pool.submit("hang in pool")
+assert(finish(pool) == {"hang in pool": (False, None)})
+assert(running_in_group(pid) == [])
+
+pool.close()
+
+print("OK")
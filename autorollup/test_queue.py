@@ -0,0 +1,101 @@
+from .queue import SQLiteJobQueue
+from datetime import datetime, timedelta
+from time import sleep
+import multiprocessing
+import tempfile
+import logging
+import shutil
+import os
+
+logging.disable(logging.CRITICAL) # The queue logs the jobs it gives up on.
+
+directory = tempfile.mkdtemp()
+path = os.path.join(directory, "queue.sqlite")
+
+base = datetime(2016, 1, 1)
+hours = [(base + timedelta(hours=i), base + timedelta(hours=i + 1)) for i in range(100)]
+
+queue = SQLiteJobQueue(path)
+for start, end in hours:
+	queue.schedule("t", start, end, 0)
+queue.schedule("t", hours[0][0], hours[0][1], 5) # Already scheduled.
+
+# Every job is claimed by exactly one of the workers claiming at the same time.
+def claim_all(owner, results):
+	queue = SQLiteJobQueue(path, owner=owner)
+	claimed = []
+	while True:
+		jobs = queue.claim(3)
+		if not jobs:
+			break
+		for job in jobs:
+			claimed.append((job.start, job.end))
+			queue.done(job)
+	results.put(claimed)
+
+context = multiprocessing.get_context("fork")
+results = context.Queue()
+workers = [context.Process(target=claim_all, args=("w%i" % i, results)) for i in range(4)]
+for worker in workers:
+	worker.start()
+claimed = [job for _ in workers for job in results.get()]
+for worker in workers:
+	worker.join()
+
+assert(sorted(claimed) == hours)
+assert(queue.claim() == [])
+
+# A job whose lease expired can be claimed again, and its first owner loses it.
+day = (base, base + timedelta(days=1))
+a = SQLiteJobQueue(path, owner="a", lease_time=timedelta(seconds=0.3), retry_delay=timedelta(seconds=0.3), max_attempts=3)
+b = SQLiteJobQueue(path, owner="b", lease_time=timedelta(seconds=0.3), retry_delay=timedelta(seconds=0.3), max_attempts=3)
+a.schedule("u", day[0], day[1], 0)
+
+job, = a.claim()
+assert(job.attempts == 1)
+assert(b.claim() == [])
+assert(a.heartbeat(job))
+
+sleep(0.4)
+job, = b.claim()
+assert(job.attempts == 2)
+assert(not a.heartbeat(job))
+
+# A failed job can't be claimed again before retry_delay.
+b.fail(job)
+assert(b.claim() == [])
+sleep(0.4)
+job, = b.claim()
+assert(job.attempts == 3)
+
+# After max_attempts claims, it's marked 'failed'.
+b.fail(job)
+sleep(0.4)
+assert(b.claim() == [])
+assert(b.conn.execute("SELECT status, attempts FROM rollups WHERE what = 'u'").fetchall() == [("failed", 3)])
+
+# With dependencies, a job can be claimed only when they're done.
+def dependencies(what, start, end):
+	if end - start == timedelta(days=1):
+		return [(start + timedelta(hours=i), start + timedelta(hours=i + 1)) for i in range(24)]
+	return []
+
+dependent = SQLiteJobQueue(path, dependencies=dependencies)
+dependent.schedule("v", day[0], day[1], 0)
+for start, end in hours[:23]:
+	dependent.schedule("v", start, end, 1)
+for job in dependent.claim(100):
+	dependent.done(job)
+assert(dependent.claim() == [])
+assert(not dependent.all_done("v", hours[:24]))
+
+dependent.schedule("v", hours[23][0], hours[23][1], 1)
+job, = dependent.claim()
+dependent.done(job)
+assert(dependent.all_done("v", hours[:24]))
+job, = dependent.claim()
+assert((job.start, job.end) == day)
+
+shutil.rmtree(directory)
+
+print("OK")
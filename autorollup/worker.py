@@ -1,40 +1,61 @@
-from .. import connect, Period
-from time import sleep
+from .. import connect, Period, rollup, get_rate_limited_logger, start_rate_limited_logger
+from .._rollup import source_periods
+from .._retry_policy import LoggingAutoRetryPolicy
+from .pool import WorkerPool
+from .queue import job_queue
 import logging
-import subprocess
 import os
 
 logger = logging.getLogger(__spec__.name)
 
+# Rollups run in a pool of warm worker processes, each with its own connection.
+workers = int(os.getenv("REDFLOOD_ROLLUP_WORKERS", 1))
+timeout = float(os.getenv("REDFLOOD_ROLLUP_TIMEOUT", 0)) or None # seconds
+# Also roll up the longer periods due at the end of a rollup, from its results.
+cascade = bool(int(os.getenv("REDFLOOD_ROLLUP_CASCADE", 0)))
+
+def init():
+	# Note: this timeout is client-side. AutoRetryPolicy will retry until 10 minutes have passed, and retries did not help.
+	db = connect(default_retry_policy = LoggingAutoRetryPolicy(get_rate_limited_logger(__spec__.name)), default_timeout = 600)
+	start_rate_limited_logger()
+	# Cascaded rollups check that their other source periods are done in the queue.
+	return db, job_queue(db)
+
+def run(state, job):
+	db, queue = state
+	what, start, end, attempts = job
+	all_done = lambda periods: queue.all_done(what, [(p.start, p.end) for p in periods])
+	return [(p.start, p.end) for p in rollup(db[what], Period(start, end), cascade, all_done)]
+
+# Forked before connecting, the workers don't inherit the connection.
+pool = WorkerPool(workers, init, run, timeout)
+
 db = connect()
 db.init_aggregated()
 
-autorollup_db = db._autorollup_status_db
+def dependencies(what, start, end):
+	return [(p.start, p.end) for p in source_periods(db[what], Period(start, end))]
+
+# A rollup is claimed only when the rollups it's made of are done.
+queue = job_queue(db, dependencies=dependencies)
 
 while True:
-	res = autorollup_db.execute("SELECT * FROM rollups_prio WHERE status = 'todo' limit 1")
-	try:
-		row = next(iter(res))
-	except:
-		sleep(10)
-		continue
-
-	cmdline = ["python3", "-m", "preconfigure", "-m", "redflood.rollup", "-s", row.start.isoformat() + "Z", "-e", row.end.isoformat() + "Z", row.what]
-	logger.info(" ".join(cmdline))
-	p = subprocess.run(cmdline)
-
-	if p.returncode == 0:
-		logger.info("Rollup: %s %s done.", row.what, Period(row.start, row.end))
-
-		autorollup_db.execute("INSERT INTO rollups (what, start, end, status, priority) VALUES (%s, %s, %s, 'done', 0)", (row.what, row.start, row.end))
-		autorollup_db.execute("DELETE FROM rollups WHERE what = %s AND start = %s AND end = %s AND status = 'todo'", (row.what, row.start, row.end))
-
-		print()
-		print()
-		sleep(1)
-	else:
-		logger.error("Rollup: %s %s failed. *Restarting.*", row.what, Period(row.start, row.end))
-
-		print()
-		print()
-		sleep(10)
+	idle = pool.idle
+	if idle:
+		for job in queue.claim(idle):
+			logger.info("Rollup: %s %s starting (attempt %i).", job.what, Period(job.start, job.end), job.attempts)
+			pool.submit(job)
+
+	# Returns as soon as a rollup finishes, so the rollups that were waiting for it are claimed right away.
+	for job, succeeded, periods in pool.wait(10):
+		if succeeded:
+			for start, end in periods:
+				logger.info("Rollup: %s %s done.", job.what, Period(start, end))
+				queue.done(job._replace(start=start, end=end))
+		else:
+			logger.error("Rollup: %s %s failed. *Retrying later.*", job.what, Period(job.start, job.end))
+			queue.fail(job)
+
+	for job in pool.running:
+		if not queue.heartbeat(job):
+			logger.warning("Rollup: %s %s - lost the lease, somebody else may run it too.", job.what, Period(job.start, job.end))
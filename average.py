@@ -0,0 +1,15 @@
+class Average(float):
+	"""Average of a function over a period, and the duration (in seconds) it's defined in that period.
+
+	Averages of consecutive periods are averaged weighted by these durations,
+	i.e. as the integral of the function over the covered duration."""
+
+	__slots__ = ("dt",)
+
+	def __new__(cls, value, dt):
+		average = float.__new__(cls, value)
+		average.dt = dt
+		return average
+
+	def __reduce__(self):
+		return (Average, (float(self), self.dt))
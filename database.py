@@ -7,6 +7,9 @@ from .table import Table
 from .schema import load_yaml
 from .period import Period
 from .duration import Duration
+from .query_engine.spline_cache import SplineCache
+from ._parallel import process_pool
+from concurrent.futures import ThreadPoolExecutor
 
 def _connect(url, **default_options):
 	url = urlparse(url)
@@ -15,8 +18,18 @@ def _connect(url, **default_options):
 
 class Database:
 
-	def __init__(self, schema_files=[]):
+	def __init__(self, schema_files=[], spline_cache=None, workers=None, chunk_size=None, io_threads=None):
 		self.tables = {}
+		self.spline_cache = spline_cache if spline_cache is not None else SplineCache.from_env()
+
+		# Series are transformed in a pool of worker processes if workers > 1.
+		self.workers = workers if workers is not None else int(os.getenv("REDFLOOD_WORKERS", 0))
+		self.chunk_size = chunk_size if chunk_size is not None else int(os.getenv("REDFLOOD_CHUNK_SIZE", 64))
+		self._pool = None
+
+		# Rollups are saved (serialized and uploaded) in a pool of io_threads threads, if any.
+		self.io_threads = io_threads if io_threads is not None else int(os.getenv("REDFLOOD_IO_THREADS", 0))
+		self._io_pool = None
 
 		for schema in schema_files:
 			with open(schema) as f:
@@ -41,6 +54,24 @@ class Database:
 	def init_aggregated(self):
 		pass
 
+	@property
+	def process_pool(self):
+		if self.workers <= 1:
+			return None
+
+		if self._pool is None:
+			self._pool = process_pool(self.workers)
+		return self._pool
+
+	@property
+	def io_pool(self):
+		if self.io_threads < 1:
+			return None
+
+		if self._io_pool is None:
+			self._io_pool = ThreadPoolExecutor(max_workers=self.io_threads, thread_name_prefix="redflood-io")
+		return self._io_pool
+
 	def RawDataStore(self, table):
 		return self._raw_data_db.RawDataStore(table)
 
@@ -92,12 +123,26 @@ class Database:
 			if not autorollup_status_db_url:
 				raise Exception("Set the REDFLOOD_AUTOROLLUP_STATUS_DB_URL environment variable.")
 
+		# Worker processes connect the same way.
+		self._connection = dict(default_options, raw_db_url=raw_db_url, aggregated_db_url=aggregated_db_url, autorollup_status_db_url=autorollup_status_db_url)
+
 		self._rawdb_url = raw_db_url
 		self._aggdb_url = aggregated_db_url
 		self._roldb_url = autorollup_status_db_url
 		self._dbopt = default_options
 
+		# Fork the worker processes before the drivers start threads, whose locks the forks would inherit.
+		self.process_pool
+
 	def close(self):
+		if self._pool:
+			self._pool.shutdown()
+			self._pool = None
+
+		if self._io_pool:
+			self._io_pool.shutdown()
+			self._io_pool = None
+
 		if self._rawdb:
 			self._rawdb.cluster.shutdown()
 			self._rawdb = None
@@ -34,6 +34,9 @@ class Duration(timedelta):
 	def __add__(self, other):
 		return Duration(super().__add__(other))
 
+	def __reduce__(self):
+		return (Duration, (timedelta(self.days, self.seconds, self.microseconds),))
+
 	@property
 	def amount_unit(self):
 		if self.days and self.seconds:
@@ -0,0 +1,120 @@
+"""
+Database with the raw data in memory, and the aggregated data in a FakeFS, for tests.
+
+SCHEMA has a `channels` table, grouped by game and language, and channels()
+generates its raw data.
+"""
+
+from .database import Database
+from .fs.fakefs import FakeFS
+from .fs.liststore import ListStore
+from collections import namedtuple
+from datetime import timedelta
+import random
+
+SCHEMA = """
+channels:
+	since: 2016-01-01 00:00:00
+	raw_table_name: raw_channels
+	kind: channel
+
+	tags:
+		channel: text
+
+	raw_fields:
+		viewers:     bigint
+		total_views: bigint
+
+	fields:
+		viewers:      [interpolate_nonnegative(viewers over 10m), [avg, max]]
+		total_views:  [smooth(total_views over 1h), [earliest, latest]]
+		is_streaming: [exists(viewers), [at_start, at_end]]
+
+		time_streamed: is_streaming dt
+		time_watched:  viewers dt
+		new_views:     d total_views
+
+	aggregated_fields:
+		viewers_avg: double
+		viewers_max: timestamped bigint
+		total_views_earliest: timestamped bigint
+		total_views_latest: timestamped bigint
+		is_streaming_at_start: int
+		is_streaming_at_end: int
+		time_streamed: duration
+		time_watched: duration
+		new_views: bigint
+
+	group:
+		by: [game, lang]
+		fields:
+			viewers:       [sum(viewers), [avg, max]]
+			channels:      [sum(is_streaming), [avg, max]]
+			time_streamed: channels dt
+			time_watched:  viewers dt
+			new_views:     sum(new_views)
+		aggregated_fields:
+			viewers_avg: double
+			viewers_max: timestamped bigint
+			channels_avg: double
+			channels_max: timestamped bigint
+			time_streamed: duration
+			time_watched: duration
+			new_views: bigint
+
+	partition_by: [[game, [text, 40, utf-8]], [lang, [text, 5, utf-8]]]
+	sort_by: [viewers_max, viewers_avg]
+	default_sort_by: viewers_max
+	charts: {}
+	leaderboards: {}
+	rollups: {1h: [1h], 1d: [1d]}
+	storage: {parts: columnar}
+"""
+
+RawRow = namedtuple("RawRow", "channel game lang time viewers total_views")
+
+def channels(seed, n, start, duration, offline=()):
+	"""Raw rows of n channels streaming from start for duration, about every minute.
+
+	Some of them switch games, or stop streaming for a while. No channel
+	streams in the periods in offline."""
+	r = random.Random(seed)
+	rows = []
+	for i in range(n):
+		time = start + timedelta(seconds=r.randint(0, 600))
+		game = r.choice(["LoL", "DotA", "CS"])
+		lang = "en" if i % 3 else "de"
+		viewers, total_views = r.randint(10, 5000), r.randint(1000, 100000)
+		while time < start + duration:
+			if r.random() < 0.005:
+				game = r.choice(["LoL", "DotA", "CS"])
+			if not any(time in period for period in offline):
+				rows.append(RawRow("c%i" % i, game, lang, time, viewers, total_views))
+			time += timedelta(seconds=r.randint(50, 70)) + (timedelta(minutes=40) if r.random() < 0.003 else timedelta(0))
+			viewers = max(0, viewers + r.randint(-300, 300))
+			total_views += r.randint(0, 100)
+	return rows
+
+class RawDataStore:
+	def __init__(self, rows):
+		self.rows = rows
+
+	def query(self, period, where):
+		return [row for row in self.rows if row.time in period and all(getattr(row, tag) == value for tag, value in where.items())]
+
+class FakeDatabase(Database):
+	"""Database of the tables of schema_yaml, with the raw rows in rows ({table name: rows})."""
+
+	def __init__(self, rows, schema_yaml=SCHEMA, **options):
+		super().__init__(**options)
+		self.load_schema(schema_yaml)
+		self.rows = rows
+		self.fs = FakeFS()
+		self._rawdb = self._aggdb = self._roldb = None # Never connected, but can be closed.
+
+	def RawDataStore(self, table):
+		return RawDataStore(self.rows[table.name])
+
+	@property
+	def ListStore(self):
+		return lambda prefix, schema: ListStore(self.fs, prefix, schema)
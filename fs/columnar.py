@@ -0,0 +1,131 @@
+"""
+Columnar encoding of the rows of a part:
+
+	MAGIC, header length (uint32), header, column data
+
+MAGIC starts with 0xc1, which is never used by msgpack, so a columnar part
+can't be mistaken for msgpack rows. The header is msgpack
+[number of rows, [[name, encoding, offset, length, nulls length], ...]],
+with offsets from the end of the header. Columns are the values of
+AggregatedRow.serialize(), encoded as:
+
+	i8       int64 array
+	f8       float64 array
+	dict     uint32 codes, followed by a msgpack list of the distinct values
+	msgpack  msgpack list of the values
+
+i8 and f8 columns with Nones are followed by a bitmap of them (numpy.packbits).
+"""
+
+import msgpack
+import numpy as np
+import struct
+
+MAGIC = b"\xc1\x01"
+
+_HEADER_LENGTH = struct.Struct("<I")
+
+def is_columnar(data):
+	return data[:len(MAGIC)] == MAGIC
+
+def _encode_column(values):
+	"""(encoding, data, nulls)"""
+	present = [val for val in values if val is not None]
+	nulls = b""
+	if len(present) < len(values):
+		nulls = np.packbits(np.array([val is None for val in values], dtype=bool)).tobytes()
+
+	if all(type(val) is int and -2**63 <= val < 2**63 for val in present):
+		return "i8", np.array([0 if val is None else val for val in values], dtype="<i8").tobytes(), nulls
+
+	if all(type(val) is float for val in present):
+		return "f8", np.array([0.0 if val is None else val for val in values], dtype="<f8").tobytes(), nulls
+
+	if all(type(val) is str for val in present):
+		codes = {}
+		for val in values:
+			codes.setdefault(val, len(codes))
+		return "dict", np.array([codes[val] for val in values], dtype="<u4").tobytes() + msgpack.packb(list(codes), use_bin_type=True), b""
+
+	return "msgpack", msgpack.packb(values, use_bin_type=True), b""
+
+def encode(names, rows):
+	"""Encode rows (lists of serialized values) with columns of the given names."""
+	columns = list(zip(*rows)) if rows else [() for name in names]
+
+	descriptions = []
+	data = []
+	offset = 0
+	for name, values in zip(names, columns):
+		encoding, column, nulls = _encode_column(list(values))
+		descriptions.append([name, encoding, offset, len(column), len(nulls)])
+		data += [column, nulls]
+		offset += len(column) + len(nulls)
+
+	header = msgpack.packb([len(rows), descriptions], use_bin_type=True)
+	return MAGIC + _HEADER_LENGTH.pack(len(header)) + header + b"".join(data)
+
+def _header(data):
+	start = len(MAGIC) + _HEADER_LENGTH.size
+	length, = _HEADER_LENGTH.unpack_from(data, len(MAGIC))
+	n, descriptions = msgpack.unpackb(data[start:start + length], raw=False)
+	return n, descriptions, start + length
+
+def _decode_column(data, n, encoding, length, nulls_length):
+	"""(numpy array, null mask or None)"""
+	column = data[:length]
+	nulls = None
+	if nulls_length:
+		nulls = np.unpackbits(np.frombuffer(data[length:length + nulls_length], dtype=np.uint8), count=n).astype(bool)
+
+	if encoding in ("i8", "f8"):
+		return np.frombuffer(column, dtype="<" + encoding), nulls
+
+	if encoding == "dict":
+		codes = np.frombuffer(column[:4 * n], dtype="<u4")
+		return _objects(msgpack.unpackb(column[4 * n:], raw=False))[codes], None
+
+	return _objects(msgpack.unpackb(column, raw=False)), None
+
+def _objects(values):
+	# np.array() would make a 2D array of lists of the same length.
+	array = np.empty(len(values), dtype=object)
+	array[:] = values
+	return array
+
+def columns(data, names=None):
+	"""{name: array} of the given columns (all if None). Columns with Nones are numpy.ma masked arrays.
+
+	Only the requested columns are decoded."""
+	n, descriptions, start = _header(data)
+	data = memoryview(data)[start:]
+
+	result = {}
+	for name, encoding, offset, length, nulls_length in descriptions:
+		if names is not None and name not in names:
+			continue
+
+		values, nulls = _decode_column(data[offset:offset + length + nulls_length], n, encoding, length, nulls_length)
+		result[name] = np.ma.masked_array(values, nulls) if nulls is not None else values
+
+	if names is not None:
+		unknown = set(names) - set(result)
+		if unknown:
+			raise KeyError("Unknown columns: " + ", ".join(sorted(unknown)))
+
+	return result
+
+def rows(data):
+	"""The rows as lists of serialized values, like they were encoded."""
+	n, descriptions, start = _header(data)
+	data = memoryview(data)[start:]
+
+	columns = []
+	for name, encoding, offset, length, nulls_length in descriptions:
+		values, nulls = _decode_column(data[offset:offset + length + nulls_length], n, encoding, length, nulls_length)
+		values = values.tolist()
+		if nulls is not None:
+			values = [None if null else val for val, null in zip(values, nulls)]
+		columns.append(values)
+
+	return [list(row) for row in zip(*columns)] if columns else [[] for i in range(n)]
@@ -0,0 +1,51 @@
+"""
+Compression of the blocks (data of parts) of .parts files.
+
+A compressed block is
+
+	MAGIC, length of the codec name (uint8), codec name, compressed data
+
+so every block can be decompressed on its own - e.g. a part read with a
+ranged GET - and the codec of a table can be changed without rewriting old
+data. Like columnar.MAGIC, it starts with 0xc1, which is never used by
+msgpack, so uncompressed blocks are read as they are.
+"""
+
+import zlib
+import lzma
+
+MAGIC = b"\xc1\x02"
+
+_codecs = {}
+
+def register(name, compress, decompress):
+	"""Add a codec - compress(bytes) and decompress(bytes) functions."""
+	assert(0 < len(name.encode("ascii")) < 256)
+	_codecs[name] = (compress, decompress)
+
+register("zlib", zlib.compress, zlib.decompress)
+register("lzma", lzma.compress, lzma.decompress)
+
+def codecs():
+	return set(_codecs)
+
+def compress(data, codec):
+	if codec is None:
+		return data
+
+	compress, _ = _codecs[codec]
+	name = codec.encode("ascii")
+	return MAGIC + bytes([len(name)]) + name + compress(bytes(data))
+
+def decompress(data):
+	if data[:len(MAGIC)] != MAGIC:
+		return data
+
+	start = len(MAGIC) + 1
+	end = start + data[len(MAGIC)]
+	codec = bytes(data[start:end]).decode("ascii")
+	try:
+		_, decompress = _codecs[codec]
+	except KeyError:
+		raise ValueError("Unknown codec: " + codec)
+	return decompress(bytes(data[end:]))
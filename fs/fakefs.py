@@ -13,5 +13,9 @@ class FakeFS:
 			data = data[path.range[0]:path.range[1]]
 		return data
 
+	def get_head(self, path, length):
+		data = self.data[path.path]
+		return data[:length], len(data)
+
 	def get(self, path):
 		return BytesIO(self.get_cached(path))
@@ -1,5 +1,19 @@
+"""
+Open addressing hash table of fixed size keys and values, stored as rows of
+[key, value]. Empty rows have a key of zeros.
+
+Keys are placed with linear probing and Robin Hood displacement: a key never
+stays in front of a key that is further from its home row. All keys are then
+sorted by home row within runs of full rows, which keeps probe lengths short
+and even, and the table can still be read with plain linear probing.
+"""
+
+from collections import namedtuple
 import logging
 import mmh3
+import numpy as np
+
+ProbeReport = namedtuple("ProbeReport", "keys mean max histogram") # histogram: {probe length: number of keys}
 
 def next_power_of_2(x):
 	return 1<<(x-1).bit_length()
@@ -11,18 +25,20 @@ def HashTableType(key_type, val_type, hash_func = mmh3.hash, capacity_factor = 1
 		VAL_TYPE = val_type
 		VAL_SIZE = VAL_TYPE.SIZE
 		ROW_SIZE = KEY_SIZE + VAL_SIZE
+		ROW = np.dtype([("key", np.uint8, (KEY_SIZE,)), ("val", np.uint8, (VAL_SIZE,))])
 		EMPTY_KEY = b'\x00' * KEY_SIZE
 		CAPACITY_FACTOR = capacity_factor
+		PROBE_ROWS = 4 # read at once by lookup_ranged()
 
 		HASH = hash_func
 
 		def __init__(self, capacity=None, _data=None):
-			if not _data:
+			if _data is None:
 				assert(isinstance(capacity, int))
 
 			self.capacity = capacity
 
-			if _data:
+			if _data is not None:
 				self.data = bytearray(_data)
 			else:
 				if capacity == 0:
@@ -42,48 +58,182 @@ def HashTableType(key_type, val_type, hash_func = mmh3.hash, capacity_factor = 1
 		def from_bytes(cls, data):
 			return cls(_data=data)
 
+		@classmethod
+		def build(cls, items):
+			"""Table of (key, value) pairs, inserted at once."""
+			items = list(items)
+			table = cls(capacity=len(items))
+			table.update(items)
+			return table
+
+		@property
+		def rows(self):
+			"""Structured array of the rows, sharing memory with data."""
+			return np.frombuffer(self.data, dtype=self.ROW)
+
 		def hash(self, key):
 			return (self.HASH(bytes(key)) & self.hash_mask) * self.ROW_SIZE
 
-		def _find(self, i, key, _log_collision_key=None):
-			myhash = self.hash(key)
-			collision_num = 0
-			while key == self.EMPTY_KEY or bytes(self.data[i : i + self.KEY_SIZE]) != self.EMPTY_KEY:
+		def _homes(self, keys):
+			"""Home row numbers of serialized keys."""
+			return np.fromiter((self.HASH(key) & self.hash_mask for key in keys), dtype=np.int64, count=len(keys))
+
+		def _array(self, values, size):
+			return np.frombuffer(b"".join(values), dtype=np.uint8).reshape(len(values), size)
+
+		def _find(self, i, key):
+			# A full table has no empty row to stop at, so a missing key is looked for in every row once.
+			for _ in range(len(self.data) // self.ROW_SIZE):
+				if key != self.EMPTY_KEY and bytes(self.data[i : i + self.KEY_SIZE]) == self.EMPTY_KEY:
+					break
 				if self.data[i : i + self.KEY_SIZE] == key:
 					return i
 
-				collision_num += 1
-				if _log_collision_key is not None and collision_num > 50:
-					self._logger.warning("Collision #%s: %s vs %s", collision_num, _log_collision_key.rstrip(b"\x00"), bytes(self.data[i : i + self.KEY_SIZE].rstrip(b"\x00")))
-
-				i += self.KEY_SIZE + self.VAL_TYPE.SIZE
+				i += self.ROW_SIZE
 				if i == len(self.data):
 					i = 0
 			raise KeyError
 
 		def find(self, key):
 			key = bytes(self.KEY_TYPE(key))
+			if not self.data:
+				raise KeyError
 			i = self.hash(key)
 			return self._find(i, key)
 
 		def __setitem__(self, key, val):
-			if self.size >= self.capacity:
-				raise MemoryError("You're over hash table's capacity.")
-
 			key = bytes(self.KEY_TYPE(key))
+			row = key + bytes(self.VAL_TYPE(val))
+			assert(len(row) == self.ROW_SIZE)
+
 			i = self.hash(key)
-			i = self._find(i, self.EMPTY_KEY, _log_collision_key=key)
+			distance = 0
+			while True:
+				found = bytes(self.data[i : i + self.KEY_SIZE])
+				if found == key:
+					break
+				if found == self.EMPTY_KEY:
+					if self.size >= self.capacity:
+						raise MemoryError("You're over hash table's capacity.")
+					self.size += 1
+					break
+
+				# Robin Hood: a key closer to its home row gives its row up, and goes on instead.
+				found_distance = (i - self.hash(found)) % len(self.data) // self.ROW_SIZE
+				if found_distance < distance:
+					self.data[i : i + self.ROW_SIZE], row = row, bytes(self.data[i : i + self.ROW_SIZE])
+					key, distance = found, found_distance
+
+				i += self.ROW_SIZE
+				if i == len(self.data):
+					i = 0
+				distance += 1
 
-			self.size += 1
-			self.data[i : i + self.KEY_SIZE] = key
-			sval = bytes(self.VAL_TYPE(val))
-			assert(len(sval) == self.VAL_TYPE.SIZE)
-			self.data[i + self.KEY_SIZE : i + self.ROW_SIZE] = sval
+			self.data[i : i + self.ROW_SIZE] = row
 
 		def __getitem__(self, key):
 			i = self.find(key)
 			return self.VAL_TYPE.from_bytes(self.data[i + self.KEY_SIZE : i + self.ROW_SIZE])
 
+		@classmethod
+		def lookup_ranged(cls, key, size, read):
+			"""Value of key in a table of size bytes, of which only the probed rows are read, with read(start, end)."""
+			rows = size // cls.ROW_SIZE
+			key = bytes(cls.KEY_TYPE(key))
+			i = cls.HASH(key) & (rows - 1) if rows else 0
+
+			probed = 0
+			while probed < rows:
+				count = min(cls.PROBE_ROWS, rows - i, rows - probed)
+				data = read(i * cls.ROW_SIZE, (i + count) * cls.ROW_SIZE)
+				for row in range(0, count * cls.ROW_SIZE, cls.ROW_SIZE):
+					found = data[row : row + cls.KEY_SIZE]
+					if found == key:
+						return cls.VAL_TYPE.from_bytes(data[row + cls.KEY_SIZE : row + cls.ROW_SIZE])
+					if found == cls.EMPTY_KEY:
+						raise KeyError
+
+				probed += count
+				i = (i + count) % rows
+			raise KeyError
+
+		def _place(self, homes):
+			"""Row numbers of keys with the given home rows, as Robin Hood would insert them."""
+			n = self.hash_mask + 1
+			if not len(homes):
+				return homes
+
+			# Start at the row after which the most rows are free, so that no run of full rows wraps around the end.
+			excess = np.cumsum(np.bincount(homes, minlength=n) - 1)
+			start = (int(np.argmin(excess)) + 1) % n
+
+			rotated = (homes - start) % n
+			order = np.argsort(rotated, kind="stable")
+			steps = np.arange(len(homes))
+			# Each key goes to its home row, or right after the previous key if that's further.
+			positions = np.empty(len(homes), dtype=np.int64)
+			positions[order] = np.maximum.accumulate(rotated[order] - steps) + steps
+			assert(positions.max() < n)
+			return (positions + start) % n
+
+		def update(self, items):
+			"""Insert (key, value) pairs at once. All keys are placed again, vectorized."""
+			rows = self.rows
+			occupied = rows["key"].any(axis=1)
+			entries = dict(zip((bytes(x) for x in rows["key"][occupied]), (bytes(x) for x in rows["val"][occupied])))
+			for key, val in items:
+				entries[bytes(self.KEY_TYPE(key))] = bytes(self.VAL_TYPE(val))
+
+			if len(entries) > self.capacity:
+				raise MemoryError("You're over hash table's capacity.")
+
+			keys = list(entries)
+			placed = np.zeros(self.hash_mask + 1, dtype=self.ROW)
+			slots = self._place(self._homes(keys))
+			placed["key"][slots] = self._array(keys, self.KEY_SIZE)
+			placed["val"][slots] = self._array(list(entries.values()), self.VAL_SIZE)
+
+			self.data[:] = placed.tobytes()
+			self.size = len(keys)
+
+		def get_many(self, keys, default=None):
+			"""Values of many keys (default for the missing ones), probed for all of them at once."""
+			keys = [bytes(self.KEY_TYPE(key)) for key in keys]
+			if not len(self.data):
+				return [default] * len(keys)
+
+			wanted = self._array(keys, self.KEY_SIZE)
+			rows = self.rows
+			positions = self._homes(keys)
+			found = np.full(len(keys), -1, dtype=np.int64)
+
+			pending = np.arange(len(keys))
+			for _ in range(len(rows)):
+				if not len(pending):
+					break
+				probed = rows["key"][positions[pending]]
+				hit = (probed == wanted[pending]).all(axis=1)
+				found[pending[hit]] = positions[pending[hit]]
+
+				pending = pending[~hit & probed.any(axis=1)]
+				positions[pending] = (positions[pending] + 1) & self.hash_mask
+
+			return [self.VAL_TYPE.from_bytes(bytes(rows["val"][i])) if i >= 0 else default for i in found]
+
+		def probe_lengths(self):
+			"""Number of rows probed to find each key."""
+			rows = self.rows
+			slots = np.flatnonzero(rows["key"].any(axis=1))
+			homes = self._homes([bytes(x) for x in rows["key"][slots]])
+			return (slots - homes) % len(rows) + 1
+
+		def probe_report(self):
+			lengths = self.probe_lengths()
+			if not len(lengths):
+				return ProbeReport(0, 0.0, 0, {})
+			counts = np.bincount(lengths)
+			return ProbeReport(len(lengths), float(lengths.mean()), int(lengths.max()), {length: int(count) for length, count in enumerate(counts) if count})
+
 	return HashTable
 
 if __name__ == "__main__":
@@ -117,6 +267,10 @@ if __name__ == "__main__":
 	except MemoryError:
 		pass
 
+	h2 = HashTable.build([(b"LoL", 500), (b"Dota", 600), (b"SC", 700), (b"Counter-Strike: Global Offensive", 800), (b"D", 800)])
+	assert(h2.get_many([b"SC", b"Lorem Ipsum", b"LoL"]) == [700, None, 500])
+	assert(h2[b"D"] == 800)
+
 	print("OK")
 
 if __name__ == "__main__":
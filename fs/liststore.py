@@ -2,12 +2,15 @@ import itertools
 import functools
 import operator
 import logging
+import os
 from io import BytesIO
 
 from .hashtable import HashTableType
+from .perfecthash import PerfectHashType, is_perfect_hash, HEADER_SIZE as PERFECT_HASH_HEADER_SIZE
 from .serialization import SerializationMixin
 from .path import PartPath
 from .parts import Part, PartHeader, PartsReader
+from . import columnar, compression
 
 from ..list_ir import PartitionedListSchema
 
@@ -18,7 +21,7 @@ class PartPaths:
 		self.data = data
 
 class ListStore(SerializationMixin):
-	def __init__(self, fs, prefix, schema):
+	def __init__(self, fs, prefix, schema, partindex_lookup=None):
 		assert(isinstance(prefix, str))
 		assert(isinstance(schema, PartitionedListSchema))
 
@@ -26,6 +29,10 @@ class ListStore(SerializationMixin):
 		self._prefix = prefix
 		self._schema = schema
 
+		# "download" the whole partindex (and cache it), or read only the "ranged" parts of it a lookup needs.
+		self._partindex_lookup = partindex_lookup or os.getenv("REDFLOOD_PARTINDEX_LOOKUP", "download")
+		assert(self._partindex_lookup in ("download", "ranged"))
+
 	def _put(self, path, data):
 		try:
 			if path.range:
@@ -62,6 +69,27 @@ class ListStore(SerializationMixin):
 	def _PartIndex_HashTable(self):
 		return HashTableType(self._schema.PartID, PartHeader)
 
+	@property
+	def _PartIndex_PerfectHash(self):
+		return PerfectHashType(self._schema.PartID, PartHeader)
+
+	def _partindex(self, data):
+		# Partindexes of both formats can be read, whatever the schema says.
+		if is_perfect_hash(data):
+			return self._PartIndex_PerfectHash.from_bytes(data)
+		return self._PartIndex_HashTable.from_bytes(data)
+
+	def _lookup_ranged(self, partindex, part_id):
+		"""Part header of part_id, found with ranged reads of the partindex: its head (and size), and the rows probed."""
+		logger = logging.getLogger(__name__)
+		logger.info("GET %s (head)", partindex)
+		head, size = self._fs.get_head(PartPath(partindex), PERFECT_HASH_HEADER_SIZE)
+		read = lambda start, end: self._get(PartPath(partindex, (start, end))).read()
+
+		if is_perfect_hash(head):
+			return self._PartIndex_PerfectHash.lookup_ranged(part_id, head, read)
+		return self._PartIndex_HashTable.lookup_ranged(part_id, size, read)
+
 	def _urls(self, part_id, sort):
 		logger = logging.getLogger(__name__)
 
@@ -70,11 +98,13 @@ class ListStore(SerializationMixin):
 		partindex = base + ".partindex"
 		parts = base + ".parts"
 
-		partindex_data = self._get_cached(partindex)
-		logger.info("Partindex loaded.")
+		if self._partindex_lookup == "ranged":
+			part = self._lookup_ranged(partindex, part_id)
+		else:
+			partindex_data = self._get_cached(partindex)
+			logger.info("Partindex loaded.")
 
-		ht = self._PartIndex_HashTable.from_bytes(partindex_data)
-		part = ht[part_id]
+			part = self._partindex(partindex_data)[part_id]
 		return PartPaths(
 			sortindex = PartPath(parts, (part.sortindex_start, part.sortindex_end)),
 			data = PartPath(parts, (part.data_start, part.data_end)),
@@ -87,6 +117,18 @@ class ListStore(SerializationMixin):
 		with self._get(base + ".parts") as f:
 			yield from ((p.id, self._unserialize(BytesIO(p.data))) for p in PartsReader(f))
 
+	def columns(self, part_id, sort, names=None):
+		"""{column: numpy array} of the given columns of a part (see AggregatedRow.serialized_column_indexes()).
+
+		Only these columns are decoded, if the part is columnar."""
+		assert(sort in (x.name for x in self._schema.sort_by))
+
+		data = compression.decompress(self._get(self._urls(part_id, sort).data).read())
+		if not columnar.is_columnar(data):
+			rows = [row.serialize() for row in self._unserialize(BytesIO(data))]
+			data = columnar.encode(self._column_names, rows)
+		return columnar.columns(data, names)
+
 	def list(self, part_id, sort, range=None):
 		assert(self._schema.PartID(part_id) or True)
 		assert(sort in (x.name for x in self._schema.sort_by))
@@ -110,11 +152,12 @@ class ListStore(SerializationMixin):
 	def save(self, partitions):
 		# assert(partitions matches SinglePassPartitionedList concept)
 
-		partitions = [(part_id, list(rows)) for part_id, rows in partitions]
+		# Sorted by id, so that list_all_parts() of several lists can be merged (see ReAggregator).
+		partitions = sorted(((part_id, list(rows)) for part_id, rows in partitions), key=lambda x: tuple(x[0]))
 
 		for sort_key in self._schema.sort_by:
 			parts = bytearray()
-			partindex = self._PartIndex_HashTable(capacity=len(partitions))
+			headers = []
 
 			for part_id, rows in partitions:
 				if len(rows) < 1:
@@ -124,11 +167,20 @@ class ListStore(SerializationMixin):
 				p.sortindex, p.data = self._sort_serialize_rows(rows, sort_key)
 
 				parts += bytes(p)
-				partindex[part_id] = p.header
+				headers.append((part_id, p.header))
 
 			base = self._base_url(sort_key.name)
+
+			if self._schema.partindex == "perfect":
+				partindex = self._PartIndex_PerfectHash.build(headers)
+			else:
+				partindex = self._PartIndex_HashTable(capacity=len(partitions))
+				partindex.update(headers)
+
+				report = partindex.probe_report()
+				logging.getLogger(__name__).log(logging.WARNING if report.max > 50 else logging.DEBUG, "%s.partindex: %s parts, probe length mean %.2f, max %s, histogram %s", base, report.keys, report.mean, report.max, report.histogram)
 			self._put(base + ".parts", parts)
-			self._put(base + ".partindex", partindex.data)
+			self._put(base + ".partindex", bytes(partindex))
 
 if __name__ == "__main__":
 	from .. import Period
@@ -11,6 +11,13 @@ class PartPath:
 			# Subrange
 			raise NotImplementedError
 
+	# Paths are keys of the caches of FS.get_cached() and FS.get_head().
+	def __eq__(self, other):
+		return isinstance(other, PartPath) and (self.path, self.range) == (other.path, other.range)
+
+	def __hash__(self):
+		return hash((self.path, self.range))
+
 	def __repr__(self):
 		if not self.range:
 			return self.path
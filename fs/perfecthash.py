@@ -0,0 +1,174 @@
+"""
+Minimal perfect hash table: n keys in n rows, found with a single probe.
+
+	MAGIC, header, seeds, rows
+
+The header is (number of keys, number of buckets, values per row) as
+uint32s. Each key hashes into a bucket, and each bucket has a seed (uint32)
+which hashes all its keys to different rows - or, with DIRECT set, the
+row of its only key. Rows are (fingerprint (uint32), values (int64s)): keys
+aren't stored, only a hash of them, which tells missing keys apart from
+the key of the row they land in (but for one in 2^32 of them).
+
+Values are tuples of ints, like PartHeader.
+
+Like the other magics in fs, MAGIC starts with 0xc1, which UTF-8 never
+uses, so it can't be mistaken for the first key of a HashTable.
+"""
+
+from collections import defaultdict
+import itertools
+import struct
+import mmh3
+import numpy as np
+
+MAGIC = b"\xc1\x03"
+
+_HEADER = struct.Struct("<III")
+HEADER_SIZE = len(MAGIC) + _HEADER.size
+
+_SEED = struct.Struct("<I")
+
+DIRECT = 0x80000000
+FINGERPRINT_SEED = 0x9747b28c
+KEYS_PER_BUCKET = 2
+
+def is_perfect_hash(data):
+	return data[:len(MAGIC)] == MAGIC
+
+def _hash(key, seed):
+	return mmh3.hash(key, seed) & 0xffffffff
+
+def PerfectHashType(key_type, val_type):
+	class PerfectHash:
+		KEY_TYPE = key_type
+		VAL_TYPE = val_type
+		VAL_LENGTH = VAL_TYPE.LENGTH
+		ROW = np.dtype([("fingerprint", "<u4"), ("val", "<i8", (VAL_LENGTH,))])
+
+		def __init__(self, data):
+			assert(is_perfect_hash(data))
+			self.data = bytes(data)
+
+			self.size, self.buckets = self._header(self.data)
+			self.seeds = np.frombuffer(self.data, dtype="<u4", count=self.buckets, offset=HEADER_SIZE)
+			self.rows = np.frombuffer(self.data, dtype=self.ROW, count=self.size, offset=HEADER_SIZE + _SEED.size * self.buckets)
+
+		@classmethod
+		def _header(cls, data):
+			size, buckets, length = _HEADER.unpack_from(data, len(MAGIC))
+			assert(length == cls.VAL_LENGTH)
+			return size, buckets
+
+		def __bytes__(self):
+			return self.data
+
+		@classmethod
+		def from_bytes(cls, data):
+			return cls(data)
+
+		@classmethod
+		def build(cls, items):
+			"""Table of (key, value) pairs."""
+			entries = {bytes(cls.KEY_TYPE(key)): tuple(cls.VAL_TYPE(val)) for key, val in items}
+			keys = list(entries)
+			n = len(keys)
+			buckets = max(1, -(-n // KEYS_PER_BUCKET))
+
+			members = defaultdict(list)
+			for i, key in enumerate(keys):
+				members[_hash(key, 0) % buckets].append(i)
+
+			seeds = np.zeros(buckets, dtype="<u4")
+			slots = np.empty(n, dtype=np.int64)
+			free = [True] * n
+
+			# The biggest buckets first, while there are many free rows. Buckets of one key take any of the rows left.
+			for bucket, indexes in sorted(members.items(), key=lambda x: -len(x[1])):
+				if len(indexes) == 1:
+					break
+				for seed in itertools.count(1):
+					candidates = [_hash(keys[i], seed) % n for i in indexes]
+					if len(set(candidates)) == len(candidates) and all(free[slot] for slot in candidates):
+						break
+				seeds[bucket] = seed
+				slots[indexes] = candidates
+				for slot in candidates:
+					free[slot] = False
+
+			singles = [(bucket, indexes[0]) for bucket, indexes in members.items() if len(indexes) == 1]
+			for (bucket, i), slot in zip(singles, (slot for slot, empty in enumerate(free) if empty)):
+				seeds[bucket] = DIRECT | slot
+				slots[i] = slot
+
+			rows = np.zeros(n, dtype=cls.ROW)
+			rows["fingerprint"][slots] = [_hash(key, FINGERPRINT_SEED) for key in keys]
+			rows["val"][slots] = np.array([entries[key] for key in keys], dtype=np.int64).reshape(n, cls.VAL_LENGTH)
+
+			return cls(MAGIC + _HEADER.pack(n, buckets, cls.VAL_LENGTH) + seeds.tobytes() + rows.tobytes())
+
+		@staticmethod
+		def _slot(key, seed, size):
+			if seed & DIRECT:
+				return seed & ~DIRECT
+			return _hash(key, seed) % size
+
+		@classmethod
+		def _value(cls, key, row):
+			if row["fingerprint"] != _hash(key, FINGERPRINT_SEED):
+				raise KeyError
+			return cls.VAL_TYPE(row["val"].tolist())
+
+		def __getitem__(self, key):
+			key = bytes(self.KEY_TYPE(key))
+			if not self.size:
+				raise KeyError
+
+			seed = int(self.seeds[_hash(key, 0) % self.buckets])
+			return self._value(key, self.rows[self._slot(key, seed, self.size)])
+
+		@classmethod
+		def lookup_ranged(cls, key, head, read):
+			"""Value of key, given the first HEADER_SIZE bytes of the table, reading only its seed and row with read(start, end)."""
+			size, buckets = cls._header(head)
+			key = bytes(cls.KEY_TYPE(key))
+			if not size:
+				raise KeyError
+
+			seed_start = HEADER_SIZE + _SEED.size * (_hash(key, 0) % buckets)
+			seed, = _SEED.unpack(read(seed_start, seed_start + _SEED.size))
+
+			row_start = HEADER_SIZE + _SEED.size * buckets + cls.ROW.itemsize * cls._slot(key, seed, size)
+			return cls._value(key, np.frombuffer(read(row_start, row_start + cls.ROW.itemsize), dtype=cls.ROW)[0])
+
+		def get_many(self, keys, default=None):
+			ret = []
+			for key in keys:
+				try:
+					ret.append(self[key])
+				except KeyError:
+					ret.append(default)
+			return ret
+
+	return PerfectHash
+
+if __name__ == "__main__":
+	from .._types import Tuple, Text
+	from .parts import PartHeader
+
+	PerfectHash = PerfectHashType(Tuple(Text(40)), PartHeader)
+
+	h = PerfectHash.build([(("LoL",), PartHeader(0, 10, 20)), (("Dota",), PartHeader(20, 30, 40)), (("SC",), PartHeader(40, 50, 60))])
+	h = PerfectHash.from_bytes(bytes(h))
+
+	assert(h[("LoL",)] == (0, 10, 20))
+	assert(h[("Dota",)] == (20, 30, 40))
+	assert(h[("SC",)] == (40, 50, 60))
+
+	try:
+		h[("Lorem Ipsum",)]
+		assert(False)
+	except KeyError:
+		pass
+
+	print("OK")
@@ -1,8 +1,23 @@
 import msgpack
+from io import BytesIO
+from . import columnar, compression
 
 class SerializationMixin:
 	def _serialize(self, rows):
-		return b"".join(msgpack.packb(row.serialize()) for row in rows)
+		if self._schema.format == "columnar":
+			data = columnar.encode(self._column_names, [row.serialize() for row in rows])
+		else:
+			data = b"".join(msgpack.packb(row.serialize()) for row in rows)
+		return compression.compress(data, self._schema.compression)
 
 	def _unserialize(self, stream):
-		return (self._schema.Row.unserialize(x) for x in msgpack.Unpacker(stream, encoding='utf-8'))
+		# Parts of both formats, compressed or not, can be read, whatever the schema says.
+		data = compression.decompress(stream.read())
+		if columnar.is_columnar(data):
+			return (self._schema.Row.unserialize(x) for x in columnar.rows(data))
+		return (self._schema.Row.unserialize(x) for x in msgpack.Unpacker(BytesIO(data), encoding='utf-8'))
+
+	@property
+	def _column_names(self):
+		indexes = self._schema.Row.serialized_column_indexes()
+		return sorted(indexes, key=indexes.get)
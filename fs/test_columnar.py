@@ -0,0 +1,61 @@
+from . import columnar
+import numpy as np
+import msgpack
+
+names = ["channel", "games", "viewers", "avg", "followers", "lang", "mixed"]
+rows = [
+	["imaqtpie", ["LoL", "DotA"], 1000, 10.5, 3000, "en", 1],
+	["dendi", ["DotA"], 2000, None, None, "ru", "x"],
+	["faker", None, 3000, 7.25, 1000, "ko", 2.5],
+	["dendi", [], -2**63, 0.0, 2**63 - 1, "ru", None],
+]
+
+data = columnar.encode(names, rows)
+assert(columnar.is_columnar(data))
+assert(not columnar.is_columnar(msgpack.packb(rows[0], use_bin_type=True)))
+
+# Rows come back as they were encoded.
+assert(columnar.rows(data) == rows)
+
+_, descriptions, _ = columnar._header(data)
+encodings = {name: encoding for name, encoding, offset, length, nulls_length in descriptions}
+assert(encodings == {"channel": "dict", "games": "msgpack", "viewers": "i8", "avg": "f8", "followers": "i8", "lang": "dict", "mixed": "msgpack"})
+
+# Only the requested columns are decoded.
+columns = columnar.columns(data, ["viewers", "avg", "followers", "channel"])
+assert(set(columns) == {"viewers", "avg", "followers", "channel"})
+
+# Numbers without Nones are plain arrays.
+assert(columns["viewers"].dtype == np.int64 and not np.ma.isMaskedArray(columns["viewers"]))
+assert(columns["viewers"].tolist() == [1000, 2000, 3000, -2**63])
+
+# Nones are masked.
+assert(np.ma.isMaskedArray(columns["avg"]) and columns["avg"].dtype == np.float64)
+assert(columns["avg"].mask.tolist() == [False, True, False, False])
+assert(columns["avg"].tolist() == [10.5, None, 7.25, 0.0])
+assert(columns["followers"].tolist() == [3000, None, 1000, 2**63 - 1])
+
+# Dictionary encoded strings are decoded as object arrays.
+assert(columns["channel"].dtype == object)
+assert(columns["channel"].tolist() == ["imaqtpie", "dendi", "faker", "dendi"])
+
+# Anything else is stored as msgpack, including lists of equal length.
+games = columnar.columns(data, ["games"])["games"]
+assert(games.shape == (4,) and games.tolist() == [["LoL", "DotA"], ["DotA"], None, []])
+assert(columnar.columns(data, ["mixed"])["mixed"].tolist() == [1, "x", 2.5, None])
+
+# Ints that don't fit in int64 fall back to msgpack too.
+assert(columnar.rows(columnar.encode(["big"], [[2**63], [1]])) == [[2**63], [1]])
+
+try:
+	columnar.columns(data, ["viewers", "unknown"])
+	assert(False)
+except KeyError:
+	pass
+
+# No rows.
+empty = columnar.encode(names, [])
+assert(columnar.rows(empty) == [])
+assert(len(columnar.columns(empty)["viewers"]) == 0)
+
+print("OK")
@@ -0,0 +1,39 @@
+from . import compression
+from . import columnar
+import msgpack
+
+data = msgpack.packb([["imaqtpie", 1000, 3000]] * 100, use_bin_type=True)
+
+assert({"zlib", "lzma"} <= compression.codecs())
+
+# Without a codec, blocks are stored as they are.
+assert(compression.compress(data, None) == data)
+assert(compression.decompress(data) == data)
+
+for codec in ("zlib", "lzma"):
+	compressed = compression.compress(data, codec)
+	assert(compressed[:len(compression.MAGIC)] == compression.MAGIC)
+	assert(len(compressed) < len(data))
+	assert(compression.decompress(compressed) == data)
+	assert(compression.decompress(memoryview(compressed)) == data)
+
+# Every block names its codec, so blocks of different codecs can be read together.
+blocks = [compression.compress(data, "zlib"), compression.compress(data, "lzma"), data]
+assert([compression.decompress(block) for block in blocks] == [data] * 3)
+
+# Compressed columnar parts can't be mistaken for uncompressed ones, and the other way around.
+part = columnar.encode(["channel"], [["imaqtpie"]])
+assert(not columnar.is_columnar(compression.compress(part, "zlib")))
+assert(compression.decompress(part) == part)
+
+compression.register("reversed", lambda data: data[::-1], lambda data: data[::-1])
+assert(compression.compress(b"abc", "reversed") == compression.MAGIC + b"\x08reversedcba")
+assert(compression.decompress(compression.compress(data, "reversed")) == data)
+
+try:
+	compression.decompress(compression.MAGIC + b"\x03xyz" + data)
+	assert(False)
+except ValueError:
+	pass
+
+print("OK")
@@ -0,0 +1,74 @@
+from .fakefs import FakeFS
+from .liststore import ListStore
+from .hashtable import HashTableType
+from .perfecthash import PerfectHashType
+from .parts import PartHeader
+from ..list_ir import Field, PartitionedListSchema
+from .._types import Tuple, Text
+import random
+import os
+
+class CountingFS(FakeFS):
+	"""FakeFS that keeps the number of bytes of every read."""
+
+	def __init__(self):
+		super().__init__()
+		self.reads = []
+
+	def get_cached(self, path):
+		data = super().get_cached(path)
+		self.reads.append(len(data))
+		return data
+
+	def get_head(self, path, length):
+		data, size = super().get_head(path, length)
+		self.reads.append(len(data))
+		return data, size
+
+PartID = Tuple(Text(40))
+tables = {"hashtable": HashTableType(PartID, PartHeader), "perfect": PerfectHashType(PartID, PartHeader)}
+
+for partindex, Table in tables.items():
+	for n in (0, 1, 3, 100, 5000):
+		items = [(("game%i" % i,), PartHeader(i, i + 1, i + 2)) for i in range(n)]
+		data = bytes(Table.build(items))
+
+		fs = CountingFS()
+		fs.put("t/by_viewers.partindex", data)
+		schema = PartitionedListSchema(PartID, None, [Field("viewers")], partindex=partindex)
+		download = ListStore(fs, "t", schema, partindex_lookup="download")
+		ranged = ListStore(fs, "t", schema, partindex_lookup="ranged")
+
+		# Both find the same parts, and neither finds missing ones.
+		for part_id, header in random.Random(n).sample(items, min(n, 50)):
+			urls = [store._urls(part_id, "viewers") for store in (download, ranged)]
+			assert(urls[0].sortindex == urls[1].sortindex and urls[0].data == urls[1].data)
+			assert(urls[1].data.range == (header.data_start, header.data_end))
+
+		for part_id in [("missing%i" % i,) for i in range(20)]:
+			for store in (download, ranged):
+				try:
+					store._urls(part_id, "viewers")
+					assert(False)
+				except KeyError:
+					pass
+
+		if not n:
+			continue
+
+		# A ranged lookup reads the head, and then only what it probes.
+		fs.reads = []
+		ranged._urls(items[-1][0], "viewers")
+		if partindex == "perfect":
+			assert(len(fs.reads) == 3) # head, seed, row
+		else:
+			assert(2 <= len(fs.reads) <= 3)
+		assert(sum(fs.reads) < 1000)
+
+# Stores look up parts as REDFLOOD_PARTINDEX_LOOKUP says.
+os.environ["REDFLOOD_PARTINDEX_LOOKUP"] = "ranged"
+assert(ListStore(FakeFS(), "t", schema)._partindex_lookup == "ranged")
+del os.environ["REDFLOOD_PARTINDEX_LOOKUP"]
+assert(ListStore(FakeFS(), "t", schema)._partindex_lookup == "download")
+
+print("OK")
@@ -0,0 +1,55 @@
+from .perfecthash import PerfectHashType, is_perfect_hash, MAGIC, HEADER_SIZE, DIRECT
+from .hashtable import HashTableType
+from .parts import PartHeader
+from .._types import Tuple, Text
+import random
+
+PerfectHash = PerfectHashType(Tuple(Text(40)), PartHeader)
+
+for n in (1, 2, 3, 5, 17, 100, 1000):
+	items = [(("game%i" % i,), PartHeader(i, i + 1, i + 2)) for i in random.Random(n).sample(range(10**6), n)]
+	table = PerfectHash.from_bytes(bytes(PerfectHash.build(items)))
+
+	# n keys in n rows, after the header and a seed per bucket.
+	assert(table.size == n)
+	assert(len(bytes(table)) == HEADER_SIZE + 4 * table.buckets + PerfectHash.ROW.itemsize * n)
+
+	for key, val in items:
+		assert(table[key] == val)
+	assert(table.get_many([key for key, val in items]) == [val for key, val in items])
+
+	# Missing keys are told apart by their fingerprints.
+	assert(table.get_many([("missing%i" % i,) for i in range(100)]) == [None] * 100)
+
+	# Every row is taken by exactly one key.
+	assert(sorted(table.rows["val"][:, 0].tolist()) == sorted(val[0] for key, val in items))
+
+# Buckets of a single key point straight at its row.
+table = PerfectHash.build([(("LoL",), PartHeader(0, 10, 20))])
+assert(table.seeds[0] & DIRECT)
+assert(table[("LoL",)] == (0, 10, 20))
+
+# Later values of the same key replace earlier ones.
+table = PerfectHash.build([(("LoL",), PartHeader(0, 10, 20)), (("LoL",), PartHeader(20, 30, 40))])
+assert(table.size == 1 and table[("LoL",)] == (20, 30, 40))
+
+# Empty tables.
+table = PerfectHash.from_bytes(bytes(PerfectHash.build([])))
+assert(table.size == 0)
+try:
+	table[("LoL",)]
+	assert(False)
+except KeyError:
+	pass
+
+# An empty key type, like the part ids of parts not partitioned by anything.
+table = PerfectHashType(Tuple(), PartHeader).build([((), PartHeader(1, 2, 3))])
+assert(table[()] == (1, 2, 3))
+
+# Perfect hash tables and hash tables are told apart by the magic.
+assert(is_perfect_hash(bytes(PerfectHash.build([]))))
+hashtable = HashTableType(Tuple(Text(40)), PartHeader).build([(("\xc1",), PartHeader(0, 10, 20))])
+assert(not is_perfect_hash(bytes(hashtable)))
+assert(MAGIC[0] == 0xc1)
+
+print("OK")
@@ -32,3 +32,18 @@ class FS:
 	@functools.lru_cache(maxsize=1000)
 	def get_cached(self, path):
 		return self.get(path).read()
+
+	@functools.lru_cache(maxsize=1000)
+	def get_head(self, path, length):
+		"""The first length bytes of a file, and its size."""
+		headers = {'Authorization': self._auth, 'Range': "bytes=0-{}".format(length - 1)}
+		resp = requests.get(self._url(path.path), headers=headers)
+		if resp.status_code == 416: # Range Not Satisfiable - the file is empty
+			return b"", 0
+		resp.raise_for_status()
+
+		if resp.status_code == 206:
+			size = int(resp.headers["Content-Range"].rsplit("/", 1)[1])
+		else:
+			size = len(resp.content)
+		return resp.content[:length], size
@@ -16,9 +16,12 @@ class Field:
 		return "{} ({})".format(self.name, self.type)
 
 class PartitionedListSchema:
-	__slots__ = ("PartID", "Row", "sort_by")
+	__slots__ = ("PartID", "Row", "sort_by", "format", "compression", "partindex")
 
-	def __init__(self, PartID, Row, sort_by):
+	# format is how parts are stored: "rows" (msgpack) or "columnar".
+	# compression is the codec of fs.compression they're compressed with, or None.
+	# partindex is how parts are found: "hashtable" or "perfect" (minimal perfect hash).
+	def __init__(self, PartID, Row, sort_by, format="rows", compression=None, partindex="hashtable"):
 		# Duck Type my ass
 		assert(is_type(PartID))
 		assert(isinstance(sort_by, list))
@@ -29,6 +32,13 @@ class PartitionedListSchema:
 		self.Row = Row
 		self.sort_by = sort_by
 
+		assert(format in ("rows", "columnar"))
+		self.format = format
+		self.compression = compression
+
+		assert(partindex in ("hashtable", "perfect"))
+		self.partindex = partindex
+
 """
 PartitionedList = [
 	(PartID(), [
@@ -12,6 +12,9 @@ def to_datetime(s):
 		pass
 
 	if isinstance(s, str):
+		if "." in s:
+			# Times of extrema aren't whole seconds.
+			return datetime.strptime(s, "%Y-%m-%dT%H:%M:%S.%fZ")
 		return datetime.strptime(s, "%Y-%m-%dT%H:%M:%SZ")
 
 class Period:
@@ -1 +1,2 @@
 from .engine import QueryEngine
+from .live import LiveSeries
@@ -1,45 +1,265 @@
-from itertools import islice
 from collections import namedtuple
-from scipy import interpolate
+from datetime import datetime, timedelta
+import numpy as np
+import operator
+import math
+from .piecewise import Piecewise
+from .spline_cache import fit as fit_spline
 from ..timestamped_value import TimestampedValue
 from ..duration import Duration
 from ..period import Period
 from ..window import Window, max_window
 
-def split_into_continuous(raw_data, window):
-	# TODO do we want to handle assymetrical windows?
-	max_duration_without_data = max(window.prev, window.next)
+EPOCH = datetime(1970, 1, 1)
+
+SAMPLING_FREQUENCY = timedelta(minutes=1)
+
+def to_epoch_us(time):
+	"""Convert a naive UTC datetime into int64 microseconds since the epoch."""
+	return int(np.datetime64(time, 'us').astype(np.int64))
+
+def from_epoch_us(us):
+	return EPOCH + timedelta(microseconds=int(us))
+
+def _duration_us(duration):
+	return duration // timedelta(microseconds=1)
+
+class RawSeries:
+	"""Columnar view of the raw rows of a single series.
+
+	Times are kept as a sorted int64 array of epoch microseconds. Values are
+	converted into one array per field on first use, and slices of the series
+	are views into the arrays of the series they were cut from.
 
-	series = []
-	serie = []
-	for row in raw_data:
-		if not serie:
-			serie.append(row)
-			continue
+	Rows can be appended to a series that isn't a slice. Arrays grow in place,
+	with spare capacity, so that slices taken before stay valid.
 
-		if row.time > serie[-1].time + max_duration_without_data:
-			series.append(serie)
-			serie = []
+	key identifies the series (e.g. table name and tags) in spline_cache."""
 
-		serie.append(row)
+	def __init__(self, rows, key=None, spline_cache=None, _parent=None, _start=0, _stop=None):
+		self.rows = rows if rows is None or isinstance(rows, list) else list(rows)
+		self.key = key
+		self.spline_cache = spline_cache
+		self._parent = _parent
+		self._start = _start
+		self._columns = {}
+		self._buffers = {}
+
+		if _parent is None:
+			self.times = [row.time for row in self.rows]
+			self.time = np.array(self.times, dtype='datetime64[us]').astype(np.int64)
+		else:
+			self.times = _parent.times[_start:_stop]
+			self.time = _parent.time[_start:_stop]
+
+	@classmethod
+	def from_columns(cls, time, columns, key=None, spline_cache=None):
+		"""Series of time (epoch microseconds) and the given field arrays, e.g. unpacked from columns()."""
+		self = cls([], key, spline_cache)
+		self.rows = None
+		self.time = np.asarray(time, dtype=np.int64)
+		self.times = [from_epoch_us(t) for t in self.time.tolist()]
+		self._columns = dict(columns)
+		return self
+
+	def columns(self, fields):
+		"""(time, {field: array}) - a compact form of the series, cheap to pickle."""
+		return self.time, {field: self.column(field) for field in fields}
+
+	def __len__(self):
+		return len(self.time)
+
+	def column(self, field):
+		try:
+			return self._columns[field]
+		except KeyError:
+			pass
+
+		if self._parent is not None:
+			column = self._parent.column(field)[self._start:self._start + len(self)]
+		elif self.rows is None:
+			raise KeyError("Series made from columns has no column " + field)
+		else:
+			column = _column_array([getattr(row, field) for row in self.rows])
+
+		self._columns[field] = column
+		return column
+
+	def slice(self, start, stop):
+		if self._parent is not None:
+			return self._parent.slice(self._start + start, self._start + stop)
+
+		rows = self.rows[start:stop] if self.rows is not None else None
+		return RawSeries(rows, self.key, self.spline_cache, _parent=self, _start=start, _stop=stop)
+
+	def append(self, rows):
+		"""Append rows later than all the rows already in the series."""
+		if self._parent is not None:
+			raise TypeError("Can't append to a slice of a series.")
+
+		rows = list(rows)
+		if not rows:
+			return
+
+		times = [row.time for row in rows]
+		time = np.array(times, dtype='datetime64[us]').astype(np.int64)
+		if (len(self.time) and time[0] <= self.time[-1]) or np.any(np.diff(time) <= 0):
+			raise ValueError("Appended rows have to be later than the rows in the series.")
+
+		# A series made from columns can't build other columns later, so it only keeps the ones it has.
+		if self.rows is not None:
+			self.rows.extend(rows)
+		self.times.extend(times)
+		self.time = self._grow("time", self.time, time)
+		for field, column in list(self._columns.items()):
+			self._columns[field] = self._grow(field, column, _column_array([getattr(row, field) for row in rows]))
+
+	def _grow(self, name, array, new):
+		n = len(array)
+		buffer = self._buffers.get(name)
+
+		if n == 0:
+			dtype = new.dtype
+		elif array.dtype == object or new.dtype == object:
+			dtype = np.dtype(object)
+		else:
+			dtype = np.result_type(array.dtype, new.dtype)
+
+		if buffer is None or buffer.dtype != dtype or len(buffer) < n + len(new):
+			buffer = np.empty(max(2 * (n + len(new)), 64), dtype=dtype)
+			buffer[:n] = array
+			self._buffers[name] = buffer
+
+		buffer[n:n + len(new)] = new
+		return buffer[:n + len(new)]
+
+	def bounds(self, period):
+		"""Indexes [start, stop) of the rows with time in period."""
+		start = int(np.searchsorted(self.time, to_epoch_us(period.start), 'left'))
+		stop = int(np.searchsorted(self.time, to_epoch_us(period.end), 'right'))
+		return start, max(start, stop)
+
+	def index(self, time):
+		t = to_epoch_us(time)
+		i = int(np.searchsorted(self.time, t, 'left'))
+		if i < len(self.time) and self.time[i] == t:
+			return i
+		return None
+
+def _column_array(values):
+	column = np.array(values)
+	if column.dtype.kind not in 'biuf':
+		column = np.array(values, dtype=object)
+	return column
+
+class Timeline:
+	"""Subperiods evaluated together, with their bounds as epoch microseconds."""
+
+	def __init__(self, periods):
+		self._periods = list(periods)
+		self.starts = np.array([to_epoch_us(p.start) for p in self._periods], dtype=np.int64)
+		self.ends = np.array([to_epoch_us(p.end) for p in self._periods], dtype=np.int64)
+
+	@classmethod
+	def from_bounds(cls, starts, ends):
+		"""Timeline of [starts[i], ends[i]] epoch microseconds. Period objects are only made if needed."""
+		self = cls.__new__(cls)
+		self._periods = None
+		self.starts = np.asarray(starts, dtype=np.int64)
+		self.ends = np.asarray(ends, dtype=np.int64)
+		return self
+
+	@property
+	def periods(self):
+		if self._periods is None:
+			self._periods = [Period(from_epoch_us(s), from_epoch_us(e)) for s, e in zip(self.starts.tolist(), self.ends.tolist())]
+		return self._periods
 
-	if serie:
-		series.append(serie)
+	def __len__(self):
+		return len(self.starts)
 
-	return series
+	def __iter__(self):
+		return iter(self.periods)
+
+	def sample(self, step):
+		"""(times, counts) - times every step from start to end of each subperiod, concatenated, and their count per subperiod."""
+		step = _duration_us(step)
+		counts = np.maximum((self.ends - self.starts) // step + 1, 0)
+		offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+		return np.repeat(self.starts, counts) + offsets * step, counts
+
+def each(value, op, timeline):
+	"""Evaluate value's op (or value itself for an empty op) on every subperiod of timeline.
+
+	Functions may provide an `<op>_each(timeline)` method (`call_each` for the
+	empty op) computing the whole timeline at once. Otherwise, op is called
+	for every subperiod."""
+	try:
+		op_each = getattr(value, (op or "call") + "_each")
+	except AttributeError:
+		func = getattr(value, op) if op else value
+		return [func(p) for p in timeline]
+
+	return op_each(timeline)
+
+def values_at(func, times):
+	"""Values of func at the sorted epoch microsecond times, NaN where it's undefined.
+
+	Uses func._values_at(times) if func can evaluate many times at once."""
+	try:
+		values_at = func._values_at
+	except AttributeError:
+		return np.array([np.nan if v is None else v for v in (func(from_epoch_us(t)) for t in times.tolist())])
+
+	return values_at(times)
+
+def _none_if_nan(values):
+	return [None if v != v else v for v in values.tolist()]
+
+def _durations(seconds):
+	return [Duration(seconds=s) for s in seconds.tolist()]
+
+def _averages(integrals, durations):
+	return [i / d if d else None for i, d in zip(integrals, durations)]
+
+def split_into_continuous(raw_data, window):
+	# TODO do we want to handle assymetrical windows?
+	max_duration_without_data = max(window.prev, window.next)
+
+	if len(raw_data) == 0:
+		return []
+
+	gaps = np.flatnonzero(np.diff(raw_data.time) > _duration_us(max_duration_without_data)) + 1
+	bounds = [0] + gaps.tolist() + [len(raw_data)]
+	return [raw_data.slice(start, stop) for start, stop in zip(bounds, bounds[1:])]
 
 class RawColumn:
 	def __init__(self, data, field, window=None):
+		if not isinstance(data, RawSeries):
+			data = RawSeries(data)
+
 		self.data = data
 		self.field = field
 		self.window = window
 
-	def __call__(self, time):
-		for row in self.data:
-			if row.time == time:
-				return row
+	def __len__(self):
+		return len(self.data)
 
-		return None
+	@property
+	def values(self):
+		return self.data.column(self.field)
+
+	def _value(self, i):
+		return self.values[i:i+1].tolist()[0]
+
+	def _timestamped(self, i):
+		return TimestampedValue(self._value(i), self.data.times[i])
+
+	def __call__(self, time):
+		i = self.data.index(time)
+		if i is None:
+			return None
+		return self._timestamped(i)
 
 	def over(self, window):
 		return RawColumn(self.data, self.field, window)
@@ -56,22 +276,19 @@ class RawColumn:
 		#return InterpolatedFunction(self, k=k, s=s)
 
 	def iter(self, period):
-		return (TimestampedValue(getattr(row, self.field), row.time) for row in self.data if (row.time in period))
+		start, stop = self.data.bounds(period)
+		return (self._timestamped(i) for i in range(start, stop))
 
 	def reversed(self, period):
-		return (TimestampedValue(getattr(row, self.field), row.time) for row in reversed(self.data) if row.time in period)
+		start, stop = self.data.bounds(period)
+		return (self._timestamped(i) for i in reversed(range(start, stop)))
 
 	def getitem(self, period, index):
-		if index < 0:
-			index = -index - 1
-			it = self.reversed(period)
-		else:
-			it = self.iter(period)
-
-		try:
-			return next(islice(it, index, index+1))
-		except StopIteration:
+		start, stop = self.data.bounds(period)
+		i = (stop if index < 0 else start) + index
+		if not start <= i < stop:
 			return None
+		return self._timestamped(i)
 
 	def earliest(self, period):
 		return self.getitem(period, 0)
@@ -79,20 +296,52 @@ class RawColumn:
 	def latest(self, period):
 		return self.getitem(period, -1)
 
+	def _bounds_each(self, timeline):
+		starts = np.searchsorted(self.data.time, timeline.starts, 'left')
+		stops = np.maximum(np.searchsorted(self.data.time, timeline.ends, 'right'), starts)
+		return zip(starts.tolist(), stops.tolist())
+
+	def getitem_each(self, timeline, index):
+		results = []
+		for start, stop in self._bounds_each(timeline):
+			i = (stop if index < 0 else start) + index
+			results.append(self._timestamped(i) if start <= i < stop else None)
+		return results
+
+	def earliest_each(self, timeline):
+		return self.getitem_each(timeline, 0)
+
+	def latest_each(self, timeline):
+		return self.getitem_each(timeline, -1)
+
+	def _select(self, start, stop, argselect, select):
+		if start == stop:
+			return None
+
+		values = self.values[start:stop]
+		if values.dtype == object:
+			return select((self._timestamped(i) for i in range(start, stop)), key=lambda v: v.value)
+		return self._timestamped(start + int(argselect(values)))
+
 	def min(self, period):
-		return min(self.iter(period), key=lambda v: v.value)
+		return self._select(*self.data.bounds(period), np.argmin, min)
 
 	def max(self, period):
-		try:
-			return max(self.iter(period), key=lambda v: v.value)
-		except ValueError:
-			return None
+		return self._select(*self.data.bounds(period), np.argmax, max)
+
+	def min_each(self, timeline):
+		return [self._select(start, stop, np.argmin, min) for start, stop in self._bounds_each(timeline)]
+
+	def max_each(self, timeline):
+		return [self._select(start, stop, np.argmax, max) for start, stop in self._bounds_each(timeline)]
 
 	def sum(self, period): # Usually a bad idea.
-		return sum(self.iter(period))
+		start, stop = self.data.bounds(period)
+		return self.values[start:stop].sum().item()
 
 	def len(self, period): # Usually a bad idea.
-		return len(self.iter(period))
+		start, stop = self.data.bounds(period)
+		return stop - start
 
 	def avg(self, period): # Usually a bad idea.
 		return self.sum(period) / self.len(period)
@@ -110,15 +359,21 @@ class RawColumn:
 		return (RawColumn(rf, self.field) for rf in raw_fragments)
 
 	def union(self, period):
-		U = set()
-		for tv in self.iter(period):
-			U.add(tv.value)
-		return U
+		start, stop = self.data.bounds(period)
+		return set(self.values[start:stop].tolist())
+
+	def union_each(self, timeline):
+		values = self.values
+		return [set(values[start:stop].tolist()) for start, stop in self._bounds_each(timeline)]
 
 class ExistsFunction:
 	def __init__(self, func):
 		self.func = func
 
+		# Exact only if func knows where it's defined.
+		if hasattr(func, "_domains"):
+			self._piecewise = self._piecewise_domains
+
 	def existing_period(self, period):
 		return period
 
@@ -147,26 +402,50 @@ class ExistsFunction:
 	def latest(self, period):
 		return self.at_end(period)
 
+	def integrate_dt_each(self, timeline):
+		return each(self.func, "integrate_exists_dt", timeline)
+
+	def integrate_exists_dt_each(self, timeline):
+		return [p.duration for p in timeline]
+
+	def at_start_each(self, timeline):
+		return [0 if v is None else 1 for v in each(self.func, "at_start", timeline)]
+
+	def at_end_each(self, timeline):
+		return [0 if v is None else 1 for v in each(self.func, "at_end", timeline)]
+
+	earliest_each = at_start_each
+	latest_each = at_end_each
+
+	def _values_at(self, times):
+		return (~np.isnan(values_at(self.func, times))).astype(np.int64)
+
+	def _piecewise_domains(self):
+		return Piecewise.sum(Piecewise.constant(start, end, 1) for start, end in self.func._domains())
+
 class InterpolatedFragment:
 	def __init__(self, raw, k, s, nonnegative):
 		self.raw = raw
 
-		self.period = Period(raw.data[0].time, raw.data[-1].time)
+		self.period = Period(raw.data.times[0], raw.data.times[-1])
 
-		x = [int(row.time.timestamp()) for row in raw.data]
-		y = [getattr(row, raw.field) for row in raw.data]
-		self.spline = interpolate.UnivariateSpline(x, y, k=k, s=s, ext=2)
+		x = raw.data.time // 1000000
+		y = raw.values
+		if raw.data.spline_cache is not None:
+			self.spline = raw.data.spline_cache.spline(raw.data.key, raw.field, x, y, k, s)
+		else:
+			self.spline = fit_spline(x, y, k, s)
+		self._x = (int(x[0]), int(x[-1]))
 
 		self.nonnegative = nonnegative
 
 	def __call__(self, time):
-		try:
-			v = float(self.spline(int(time.timestamp())))
-			if self.nonnegative and v <= 0:
-				return 0.0
-			return v
-		except ValueError:
+		v = float(self.spline(to_epoch_us(time) // 1000000))
+		if math.isnan(v):
 			return None
+		if self.nonnegative and v <= 0:
+			return 0.0
+		return v
 
 	def exists(self):
 		return ExistsFunction(self)
@@ -193,7 +472,7 @@ class InterpolatedFragment:
 		ep = self.existing_period(period)
 		if ep is None:
 			return Duration(seconds=0)
-		integral = self.spline.integral(int(ep.start.timestamp()), int(ep.end.timestamp()))
+		integral = float(self.spline.integrate(to_epoch_us(ep.start) // 1000000, to_epoch_us(ep.end) // 1000000))
 		if self.nonnegative and integral <= 0:
 			return Duration(seconds=0)
 		return Duration(seconds=integral)
@@ -222,12 +501,119 @@ class InterpolatedFragment:
 		except ZeroDivisionError:
 			return None
 
+	def _fill_values(self, times, values):
+		# Writes the values at the sorted times inside of self.period.
+		start = np.searchsorted(times, self.raw.data.time[0], 'left')
+		stop = np.searchsorted(times, self.raw.data.time[-1], 'right')
+		if start < stop:
+			v = self.spline(times[start:stop] // 1000000)
+			if self.nonnegative:
+				v = np.where(v <= 0, 0.0, v)
+			values[start:stop] = v
+
+	def _values_at(self, times):
+		"""Values at the sorted epoch microsecond times, NaN outside of self.period."""
+		values = np.full(len(times), np.nan)
+		self._fill_values(times, values)
+		return values
+
+	def _piecewise(self):
+		return Piecewise.from_spline(self.spline, self.nonnegative)
+
+	def _negative(self):
+		"""Whether the spline is negative anywhere in the fragment."""
+		# A spline lies within the convex hull of its coefficients.
+		if (self.spline.c >= 0).all():
+			return False
+		times, values, sides = Piecewise.from_spline(self.spline).candidates
+		return bool((values < 0).any())
+
+	def _antiderivative(self):
+		try:
+			return self._antiderivative_spline
+		except AttributeError:
+			self._antiderivative_spline = self.spline.antiderivative()
+			return self._antiderivative_spline
+
+	def _second_antiderivative(self):
+		try:
+			return self._second_antiderivative_spline
+		except AttributeError:
+			self._second_antiderivative_spline = self._antiderivative().antiderivative()
+			return self._second_antiderivative_spline
+
+	def _integrals(self, timeline):
+		"""integrate_dt of each subperiod, in seconds."""
+		lo, hi = self._x
+		antiderivative = self._antiderivative()
+		starts = np.clip(timeline.starts // 1000000, lo, hi)
+		ends = np.clip(timeline.ends // 1000000, lo, hi)
+		integrals = antiderivative(ends) - antiderivative(starts)
+		if self.nonnegative:
+			integrals = np.where(integrals <= 0, 0.0, integrals)
+		return integrals
+
+	def _exists(self, timeline):
+		"""integrate_exists_dt of each subperiod, in microseconds."""
+		starts = np.maximum(timeline.starts, self.raw.data.time[0])
+		ends = np.minimum(timeline.ends, self.raw.data.time[-1])
+		return np.maximum(ends - starts, 0)
+
+	def earliest_each(self, timeline):
+		return self.raw.earliest_each(timeline)
+
+	def latest_each(self, timeline):
+		return self.raw.latest_each(timeline)
+
+	def min_each(self, timeline):
+		return self.raw.min_each(timeline)
+
+	def max_each(self, timeline):
+		return self.raw.max_each(timeline)
+
+	def at_start_each(self, timeline):
+		return _none_if_nan(self._values_at(timeline.starts))
+
+	def at_end_each(self, timeline):
+		return _none_if_nan(self._values_at(timeline.ends))
+
+	def integrate_dt_each(self, timeline):
+		return _durations(self._integrals(timeline))
+
+	def integrate_exists_dt_each(self, timeline):
+		return [Duration(timedelta(microseconds=us)) for us in self._exists(timeline).tolist()]
+
+	def avg_each(self, timeline):
+		return _averages(self.integrate_dt_each(timeline), self.integrate_exists_dt_each(timeline))
+
 class InterpolatedFunction:
 	def __init__(self, raw, k, s, nonnegative=False):
-		raw_fragments = raw._continuous_fragments
-
-		# We drop fragments shorter than 3 minutes, as it's impossible to interpolate over them.
-		self.fragments = [InterpolatedFragment(rf, k, s, nonnegative) for rf in raw_fragments if len(rf.data) > 3]
+		self.raw = raw
+		self._args = (k, s, nonnegative)
+
+		self.fragments = []
+		self._tail = 0 # Start of the last raw fragment.
+		self._tail_fitted = False
+		self._fit(raw._continuous_fragments)
+
+	def _fit(self, raw_fragments):
+		for rf in raw_fragments:
+			self._tail = rf.data._start
+			# We drop fragments shorter than 3 minutes, as it's impossible to interpolate over them.
+			self._tail_fitted = len(rf) > 3
+			if self._tail_fitted:
+				self.fragments.append(InterpolatedFragment(rf, *self._args))
+
+	def extended(self):
+		"""Refit the last fragment, after rows were appended to the series. The earlier fragments can't change."""
+		if self._tail_fitted:
+			self.fragments.pop()
+		self.__dict__.pop("_prefix_integrals", None)
+		self.__dict__.pop("_double_prefix_integrals", None)
+		self.__dict__.pop("_clamping", None)
+
+		tail = RawColumn(self.raw.data.slice(self._tail, len(self.raw.data)), self.raw.field, self.raw.window)
+		self._fit(tail._continuous_fragments)
 
 	def __call__(self, time):
 		for fragment in self.fragments:
@@ -266,7 +652,7 @@ class InterpolatedFunction:
 		if not self.fragments:
 			return None
 
-		return min(fragment.min(period) for fragment in self.fragments)
+		return min((fragment.min(period) for fragment in self.fragments), key=lambda x: x.value if x is not None else float('inf'))
 
 	def max(self, period):
 		if not self.fragments:
@@ -294,6 +680,162 @@ class InterpolatedFunction:
 		except ZeroDivisionError:
 			return None
 
+	def _values_at(self, times):
+		values = np.full(len(times), np.nan)
+		for fragment in self.fragments: # Fragments never overlap.
+			fragment._fill_values(times, values)
+		return values
+
+	def _domains(self):
+		"""Closed periods in which the function is defined, in epoch seconds."""
+		return [fragment._x for fragment in self.fragments]
+
+	def _piecewise(self):
+		return Piecewise.sum(fragment._piecewise() for fragment in self.fragments)
+
+	def _first_each(self, timeline, fragments, op):
+		results = [None] * len(timeline)
+		for fragment in fragments:
+			results = [r if r is not None else x for r, x in zip(results, getattr(fragment, op)(timeline))]
+		return results
+
+	def earliest_each(self, timeline):
+		return self._first_each(timeline, self.fragments, "earliest_each")
+
+	def latest_each(self, timeline):
+		return self._first_each(timeline, reversed(self.fragments), "latest_each")
+
+	def _select_each(self, timeline, op, better):
+		results = [None] * len(timeline)
+		for fragment in self.fragments:
+			results = [x if r is None or (x is not None and better(x.value, r.value)) else r for r, x in zip(results, getattr(fragment, op)(timeline))]
+		return results
+
+	def min_each(self, timeline):
+		return self._select_each(timeline, "min_each", operator.lt)
+
+	def max_each(self, timeline):
+		return self._select_each(timeline, "max_each", operator.gt)
+
+	def at_start_each(self, timeline):
+		return _none_if_nan(self._values_at(timeline.starts))
+
+	def at_end_each(self, timeline):
+		return _none_if_nan(self._values_at(timeline.ends))
+
+	def _prefix(self):
+		"""(lo, hi, totals, prefix) - bounds of the fragments in seconds, their integrals, and the sums of (clamped) integrals of the fragments before each one."""
+		try:
+			return self._prefix_integrals
+		except AttributeError:
+			pass
+
+		lo = np.array([f._x[0] for f in self.fragments], dtype=np.int64)
+		hi = np.array([f._x[1] for f in self.fragments], dtype=np.int64)
+		totals = np.array([f._antiderivative()(f._x[1]) - f._antiderivative()(f._x[0]) for f in self.fragments], dtype=np.float64)
+		prefix = np.concatenate(([0.0], np.cumsum(self._clamp(totals))))
+		self._prefix_integrals = (lo, hi, totals, prefix)
+		return self._prefix_integrals
+
+	def _clamp(self, integrals):
+		nonnegative = self._args[2]
+		return np.where(integrals <= 0, 0.0, integrals) if nonnegative else integrals
+
+	def _clamps(self):
+		"""Whether _clamp() can change any integral - only if the function is nonnegative, and a fragment's spline isn't."""
+		try:
+			return self._clamping
+		except AttributeError:
+			pass
+
+		nonnegative = self._args[2]
+		self._clamping = nonnegative and any(f._negative() for f in self.fragments)
+		return self._clamping
+
+	def _partial(self, fragment, seconds):
+		"""Integral from the start of fragment[i] to seconds[i] (clipped to that fragment), 0 where fragment[i] is -1."""
+		values = np.zeros(len(seconds))
+		for i in np.unique(fragment[fragment >= 0]).tolist():
+			mask = fragment == i
+			f = self.fragments[i]
+			antiderivative = f._antiderivative()
+			values[mask] = antiderivative(np.clip(seconds[mask], *f._x)) - antiderivative(f._x[0])
+		return values
+
+	def _partial_double(self, fragment, seconds):
+		"""Integral of _partial() from the start of fragment[i] to seconds[i] (at most the end of that fragment), 0 where fragment[i] is -1."""
+		values = np.zeros(len(seconds))
+		for i in np.unique(fragment[fragment >= 0]).tolist():
+			mask = fragment == i
+			f = self.fragments[i]
+			lo = f._x[0]
+			x = np.clip(seconds[mask], *f._x)
+			values[mask] = f._second_antiderivative()(x) - f._second_antiderivative()(lo) - f._antiderivative()(lo) * (x - lo)
+		return values
+
+	def _double_prefix(self):
+		"""Integrals of the cumulative integral from the start of the first fragment to the start of each one."""
+		try:
+			return self._double_prefix_integrals
+		except AttributeError:
+			pass
+
+		lo, hi, totals, prefix = self._prefix()
+		fragment = np.arange(len(lo))
+		following = np.append(lo[1:], hi[-1:])
+		segments = prefix[:-1] * (following - lo) + self._partial_double(fragment, hi.astype(np.float64)) + totals * (following - hi)
+		self._double_prefix_integrals = np.concatenate(([0.0], np.cumsum(segments)[:-1]))
+		return self._double_prefix_integrals
+
+	def _double_integrals(self, seconds):
+		"""Integrals of the cumulative integral from the start of the first fragment to every seconds[i].
+
+		The cumulative integral at t is the prefix sum of the fragments before t
+		plus the integral of the fragment containing t up to t, so differences of
+		these give integrals of sliding window integrals - see Integral.avg_each().
+		Pieces of fragments aren't clamped, so they're only those of _integrals_between() if not _clamps()."""
+		if not self.fragments:
+			return np.zeros(len(seconds))
+
+		lo, hi, totals, prefix = self._prefix()
+		double_prefix = self._double_prefix()
+		fragment = np.searchsorted(lo, seconds, 'right') - 1
+		i = np.maximum(fragment, 0)
+		values = double_prefix[i] + prefix[i] * (seconds - lo[i]) + self._partial_double(fragment, seconds) + totals[i] * np.maximum(seconds - hi[i], 0)
+		return np.where(fragment >= 0, values, 0.0)
+
+	def _integrals_between(self, starts, ends):
+		"""integrate_dt of every [starts[i], ends[i]] (epoch microseconds), in seconds.
+
+		Fragments covered as a whole come from prefix sums, so a window costs the same no matter how long it is.
+		Like integrate_dt(), a nonnegative function clamps the integral of every fragment over the part of it in
+		the window, whether that's the whole fragment or a piece of it."""
+		if not self.fragments:
+			return np.zeros(len(starts))
+
+		lo, hi, totals, prefix = self._prefix()
+		starts = starts // 1000000
+		ends = ends // 1000000
+		first = np.searchsorted(lo, starts, 'right') - 1
+		last = np.searchsorted(lo, ends, 'right') - 1
+		at_start = self._partial(first, starts)
+		at_end = self._partial(last, ends)
+
+		within = np.where(first >= 0, self._clamp(at_end - at_start), 0.0)
+		head = np.where(first >= 0, self._clamp(totals[np.maximum(first, 0)] - at_start), 0.0)
+		middle = prefix[np.maximum(last, 0)] - prefix[np.minimum(first + 1, len(lo))]
+		return np.where(first == last, within, head + middle + self._clamp(at_end))
+
+	def integrate_dt_each(self, timeline):
+		return _durations(self._integrals_between(timeline.starts, timeline.ends))
+
+	def integrate_exists_dt_each(self, timeline):
+		exists = sum((fragment._exists(timeline) for fragment in self.fragments), np.zeros(len(timeline), dtype=np.int64))
+		return [Duration(timedelta(microseconds=us)) for us in exists.tolist()]
+
+	def avg_each(self, timeline):
+		return _averages(self.integrate_dt_each(timeline), self.integrate_exists_dt_each(timeline))
+
 class Differential:
 	def __call__(self, time):
 		if isinstance(time, Period):
@@ -306,9 +848,34 @@ class Differential:
 	def at_end(self, period):
 		return 0
 
+	def call_each(self, timeline):
+		return self.integrate_each(timeline)
+
+	def at_start_each(self, timeline):
+		return [0] * len(timeline)
+
+	at_end_each = at_start_each
+
+	def _values_at(self, times):
+		return np.zeros(len(times), dtype=np.int64)
+
+	def _piecewise(self):
+		return Piecewise.zero()
+
 	def over(self, window):
 		return Integral(self, window)
 
+	def _window_values(self, timeline):
+		"""(values, convert) - integrals over the subperiods of timeline as a float array (NaN if undefined), and
+		a function converting them into values like integrate() returns."""
+		values = self.integrate_each(timeline)
+		return np.array([np.nan if v is None else v for v in values], dtype=np.float64), _number_like(values)
+
+	def _window_averages(self, timeline, prev, next):
+		"""(values, convert) - averages over the subperiods of timeline of the integrals over [t - prev, t + next]
+		(microseconds), like _window_values(), or None if they can't be computed exactly."""
+		return None
+
 class DTDifferential(Differential):
 	def __init__(self, func):
 		self.func = func
@@ -316,6 +883,32 @@ class DTDifferential(Differential):
 	def integrate(self, period):
 		return self.func.integrate_dt(period)
 
+	def integrate_each(self, timeline):
+		return each(self.func, "integrate_dt", timeline)
+
+	def _window_values(self, timeline):
+		try:
+			seconds = self.func._integrals_between(timeline.starts, timeline.ends)
+		except AttributeError:
+			seconds = np.array([d.total_seconds() for d in self.integrate_each(timeline)])
+		return seconds, _duration_from_seconds
+
+	def _window_averages(self, timeline, prev, next):
+		if not hasattr(self.func, "_double_integrals") or self.func._clamps():
+			return None
+
+		def double_integrals(shift):
+			return self.func._double_integrals((timeline.ends + shift) / 1e6) - self.func._double_integrals((timeline.starts + shift) / 1e6)
+
+		seconds = (timeline.ends - timeline.starts) / 1e6
+		with np.errstate(divide='ignore', invalid='ignore'):
+			averages = (double_integrals(next) - double_integrals(-prev)) / seconds
+		# The average over an instant is the value at that instant.
+		instant = seconds == 0
+		if instant.any():
+			averages[instant] = self.func._integrals_between(timeline.starts[instant] - prev, timeline.starts[instant] + next)
+		return averages, _duration_from_seconds
+
 class DFieldDifferential(Differential):
 	def __init__(self, var):
 		self.var = var
@@ -327,13 +920,65 @@ class DFieldDifferential(Differential):
 			return None
 		return l.value - f.value
 
+	def integrate_each(self, timeline):
+		latest = each(self.var, "latest", timeline)
+		earliest = each(self.var, "earliest", timeline)
+		return [None if l is None or f is None else l.value - f.value for l, f in zip(latest, earliest)]
+
+def _duration_from_seconds(seconds):
+	return Duration(seconds=seconds)
+
+def _number_like(values):
+	if all(isinstance(v, int) for v in values if v is not None):
+		return lambda x: int(round(x))
+	return float
+
 class Integral:
+	"""Integral of a differential over a window sliding along the time axis, e.g. new followers in the hour around each moment.
+
+	Values at many times come from differences of cumulative integrals where
+	the differential has them (see InterpolatedFunction._integrals_between),
+	and so do averages over a period, unless clamping the integrals of a
+	nonnegative function changes some of them. min and max over a period, and
+	other averages, are taken from values every SAMPLING_FREQUENCY."""
+
 	def __init__(self, differential, window):
 		self.differential = differential
 		self.window = window
 
+		self._prev = _duration_us(window.prev or timedelta(0))
+		self._next = _duration_us(window.next or timedelta(0))
+
 	def __call__(self, time):
-		return self.differential.integrate(window.period_at(time))
+		return self.differential.integrate(self.window.period_at(time))
+
+	def _windows(self, times):
+		return Timeline.from_bounds(times - self._prev, times + self._next)
+
+	def _values_at(self, times):
+		return self.differential._window_values(self._windows(times))[0]
+
+	def _at_each(self, times):
+		values, convert = self.differential._window_values(self._windows(times))
+		return [None if np.isnan(v) else convert(v) for v in values.tolist()]
+
+	def _samples_each(self, timeline):
+		times, counts = timeline.sample(SAMPLING_FREQUENCY)
+		values, convert = self.differential._window_values(self._windows(times))
+		splits = np.cumsum(counts[:-1])
+		return zip(np.split(times, splits), np.split(values, splits)), convert
+
+	def _select_each(self, timeline, select):
+		samples, convert = self._samples_each(timeline)
+		results = []
+		for times, values in samples:
+			defined = np.flatnonzero(~np.isnan(values))
+			if not len(defined):
+				results.append(None)
+				continue
+			i = defined[select(values[defined])]
+			results.append(TimestampedValue(convert(values[i]), from_epoch_us(times[i])))
+		return results
 
 	def at_start(self, period):
 		return self(period.start)
@@ -341,4 +986,43 @@ class Integral:
 	def at_end(self, period):
 		return self(period.end)
 
-	# TODO min, max, avg
+	def at_start_each(self, timeline):
+		return self._at_each(timeline.starts)
+
+	def at_end_each(self, timeline):
+		return self._at_each(timeline.ends)
+
+	def min_each(self, timeline):
+		# Ties are resolved like min() of TimestampedValues - the earliest one wins.
+		return self._select_each(timeline, np.argmin)
+
+	def max_each(self, timeline):
+		# Ties are resolved like max() of TimestampedValues - the latest one wins.
+		return self._select_each(timeline, lambda values: len(values) - 1 - np.argmax(values[::-1]))
+
+	def avg_each(self, timeline):
+		exact = self.differential._window_averages(timeline, self._prev, self._next)
+		if exact is not None:
+			averages, convert = exact
+			return [convert(v) for v in averages.tolist()]
+
+		samples, convert = self._samples_each(timeline)
+		results = []
+		for times, values in samples:
+			values = values[~np.isnan(values)]
+			if not len(values):
+				results.append(None)
+			elif convert is _duration_from_seconds:
+				results.append(convert(values.mean()))
+			else:
+				results.append(float(values.mean()))
+		return results
+
+	def min(self, period):
+		return self.min_each(Timeline([period]))[0]
+
+	def max(self, period):
+		return self.max_each(Timeline([period]))[0]
+
+	def avg(self, period):
+		return self.avg_each(Timeline([period]))[0]
@@ -1,94 +1,207 @@
 from itertools import groupby, chain
 from ..period import Period
 from ..window import max_window
-from .expr import parse_expr, CallExpr, OverExpr, NameExpr, DifferentialExpr, ConstExpr
-from .column import RawColumn, DTDifferential, DFieldDifferential
+from datetime import timedelta
+from .column import RawSeries, RawColumn, Timeline, each
+from .plan import Plan, refers_to_field
+from .live import LiveSeries
 from .multiple import MultipleFunctions
+from ..average import Average
 from collections import OrderedDict, namedtuple
 import warnings
 import logging
 
+_missing = object()
+
 def partitioned(data, key):
 	return [(x, list(y)) for x, y in groupby(sorted(data, key=key), key=key)]
 
 class FieldsBase:
+	"""Fields of a series, or of a group of series.
+
+	Every field is built when it's first accessed, so only the fields that the
+	requested aggregated fields depend on get fitted."""
+
+	def __init__(self, get_source_field):
+		self._get_source_field = get_source_field
+		self._values = [_missing] * len(type(self).plan.nodes)
+
 	@classmethod
 	def transform(Fields, get_source_field):
-		result = OrderedDict()
+		return Fields(get_source_field)
+
+	def __getattr__(self, name):
+		try:
+			node = type(self).plan.fields[name]
+		except KeyError:
+			raise AttributeError(name) from None
+
+		value = self._node(node)
+		setattr(self, name, value)
+		return value
+
+	def extended(self):
+		"""Update the fields that were already built, after rows were appended to the source series."""
+		for value in self._values:
+			try:
+				update = value.extended
+			except AttributeError:
+				continue
+			update()
+
+	def _node(self, i):
+		value = self._values[i]
+		if value is _missing:
+			node = type(self).plan.nodes[i]
+			value = self._values[i] = node.evaluate(self._get_source_field, *(self._node(arg) for arg in node.args))
+		return value
 
-		def _eval(expr):
-			if isinstance(expr, NameExpr):
-				if expr.name in result:
-					return result[expr.name]
-				else:
-					return get_source_field(expr.name)
+	@classmethod
+	def selected(Fields, aggregated_fields=None):
+		"""[(index, field, op)] of the given aggregated fields, or of all of them if None."""
+		if aggregated_fields is None:
+			return [(i, name, op) for i, (name, op) in enumerate(Fields.columns)]
 
-			elif isinstance(expr, OverExpr):
-				return _eval(expr.expr).over(expr.over)
+		names = Fields.AggregatedFields._fields
+		unknown = set(aggregated_fields) - set(names)
+		if unknown:
+			raise ValueError("Unknown aggregated fields: " + ", ".join(sorted(unknown)))
 
-			elif isinstance(expr, CallExpr):
-				args = (_eval(arg) for arg in expr.args)
-				return getattr(next(args), expr.name)(*args)
+		return [(i, name, op) for i, (name, op) in enumerate(Fields.columns) if names[i] in aggregated_fields]
 
-			elif isinstance(expr, DifferentialExpr):
-				if expr.variable == NameExpr("t"):
-					return DTDifferential(_eval(expr.func))
+	@classmethod
+	def dependencies(Fields, aggregated_fields=None):
+		"""(fields, source fields) needed to compute the given aggregated fields."""
+		return Fields.closure(name for i, name, op in Fields.selected(aggregated_fields))
+
+	@classmethod
+	def closure(Fields, names):
+		"""(fields, source fields) needed to compute the given fields."""
+		fields = set()
+		sources = set()
+
+		todo = list(names)
+		while todo:
+			spec = Fields.specs[todo.pop()]
+			if spec.name in fields:
+				continue
+			fields.add(spec.name)
+
+			for name in spec.expr.names:
+				if refers_to_field(Fields.specs, name, spec):
+					todo.append(name)
 				else:
-					assert(expr.func == ConstExpr(1))
-					return DFieldDifferential(_eval(expr.variable))
-			else:
-				raise TypeError("Unsupported expression: " + type(expr).__name__)
+					sources.add(name)
 
-		for field in Fields.specs.values():
-			result[field.name] = _eval(field.expr)
+		return fields, sources
 
-		return Fields(*result.values())
+	def __call__(self, period, granularity = None, fields = None):
+		"""Aggregate data from the given period.
 
-	def __call__(self, period, granularity = None):
-		"""Aggregate data from the given period"""
+		If fields (names of aggregated fields) are given, only these are computed, and the rest is None."""
 		if not isinstance(period, Period):
 			raise TypeError("period has to be of Period type")
 
+		Fields = type(self)
+		selected = Fields.selected(fields)
+
 		if granularity:
-			return [(p, self(p)) for p in period.subperiods(granularity)]
+			timeline = Timeline(period.subperiods(granularity))
+			columns = [[None] * len(timeline) for column in Fields.columns]
 
-		Fields = type(self)
+			for i, name, op in selected:
+				columns[i] = each(getattr(self, name), op, timeline)
+				if i in Fields.averages:
+					columns[i] = _covered(getattr(self, name), columns[i], timeline)
 
-		aggregated_fields = []
+			return [(p, Fields.AggregatedFields(*row)) for p, row in zip(timeline, zip(*columns))]
 
-		for fieldspec in Fields.specs.values():
-			value = getattr(self, fieldspec.name)
+		aggregated_fields = [None] * len(Fields.columns)
 
-			for op in fieldspec.ops.values():
-				if op:
-					aggregated_fields.append(getattr(value, op)(period))
-				else:
-					aggregated_fields.append(value(period))
+		for i, name, op in selected:
+			value = getattr(self, name)
+
+			if op:
+				aggregated_fields[i] = getattr(value, op)(period)
+			else:
+				aggregated_fields[i] = value(period)
+
+			if i in Fields.averages:
+				aggregated_fields[i], = _covered(value, [aggregated_fields[i]], Timeline([period]))
 
 		return Fields.AggregatedFields(*aggregated_fields)
 
+def _covered(func, averages, timeline):
+	"""averages of func in every subperiod of timeline, as Averages over the duration func is defined in it.
+
+	Left as they are if func doesn't know where it's defined, or they aren't numbers."""
+	try:
+		covered = each(func, "integrate_exists_dt", timeline)
+	except AttributeError:
+		return averages
+	return [Average(avg, dt.total_seconds()) if type(avg) is float else avg for avg, dt in zip(averages, covered)]
+
 def FieldsType(specs_, AggregatedFields_):
-	class Fields(namedtuple("FieldsData", tuple(field.name for field in specs_.values())), FieldsBase):
+	class Fields(FieldsBase):
 		specs = specs_
 		AggregatedFields = AggregatedFields_
+		columns = [(field.name, op) for field in specs_.values() for op in field.ops.values()]
+		plan = Plan(specs_)
+
+		# Indexes of the averages that are rolled up weighted by the duration they cover - see Average.
+		averages = set(i for i, (name, op) in enumerate(columns) if op == "avg" and not list(AggregatedFields_.specs.values())[i].expr)
 	return Fields
 
 class QueryEngine:
-	def __init__(self, schema):
+	def __init__(self, schema, name=None, spline_cache=None):
 		self.schema = schema
+		self.name = name
+		self.spline_cache = spline_cache
 
 		self.largest_window = max_window([field.expr.max_window for field in self.schema.fields.values()])
 
 		self.Fields = FieldsType(self.schema.fields, self.schema.AggregatedFields)
 		self.GFields = FieldsType(self.schema.group.fields, self.schema.group.AggregatedFields)
 
-	def required_period(self, requested_period):
-		return Period(requested_period.start - self.largest_window.prev, requested_period.end + self.largest_window.next)
+	@property
+	def plan(self):
+		"""Evaluation plan of the fields of a series."""
+		return self.Fields.plan
 
-	def transform_datapoints(self, raw):
-		raw = list(raw)
+	@property
+	def group_plan(self):
+		"""Evaluation plan of the fields of a group of series."""
+		return self.GFields.plan
+
+	def dependencies(self, aggregated_fields=None, group=False):
+		"""(fields, raw fields) of a series needed to compute the given aggregated fields of a series, or of a group."""
+		if group:
+			_, series_fields = self.GFields.dependencies(aggregated_fields)
+			return self.Fields.closure(series_fields)
+		return self.Fields.dependencies(aggregated_fields)
+
+	def required_period(self, requested_period, aggregated_fields=None, group=False):
+		window = self.largest_window
+		if aggregated_fields is not None:
+			fields, _ = self.dependencies(aggregated_fields, group)
+			window = max_window([self.schema.fields[name].expr.max_window for name in fields])
+
+		if window is None:
+			return requested_period
+
+		return Period(requested_period.start - (window.prev or timedelta(0)), requested_period.end + (window.next or timedelta(0)))
+
+	def series_key(self, tags):
+		return (self.name, tuple(tags) if tags is not None else None)
+
+	def transform_datapoints(self, raw, tags=None):
+		if not isinstance(raw, RawSeries):
+			raw = RawSeries(raw, self.series_key(tags), self.spline_cache)
 		return self.Fields.transform(lambda fname: RawColumn(raw, fname))
 
+	def live_series(self, rows=(), tags=None):
+		return LiveSeries(self, rows, tags)
+
 	def merge(self, series):
 		series = list(series)
 		return self.GFields.transform(lambda fname: MultipleFunctions(getattr(fields, fname) for tags, fields in series))
@@ -16,6 +16,10 @@ class ConstExpr(Expr):
 	def max_window(self):
 		return None
 
+	@property
+	def names(self):
+		return set()
+
 	def __eq__(self, other):
 		return isinstance(other, ConstExpr) and self.value == other.value
 
@@ -30,6 +34,10 @@ class NameExpr(Expr):
 	def max_window(self):
 		return None
 
+	@property
+	def names(self):
+		return {self.name}
+
 	def __eq__(self, other):
 		return isinstance(other, NameExpr) and self.name == other.name
 
@@ -45,6 +53,10 @@ class CallExpr(Expr):
 	def max_window(self):
 		return max_window(a.max_window for a in self.args)
 
+	@property
+	def names(self):
+		return set().union(*(a.names for a in self.args))
+
 class OverExpr(Expr):
 	def __init__(self, expr, over):
 		self.expr = expr
@@ -57,6 +69,10 @@ class OverExpr(Expr):
 	def max_window(self):
 		return max_window((self.expr.max_window, self.over))
 
+	@property
+	def names(self):
+		return self.expr.names
+
 class DifferentialExpr(Expr):
 	def __init__(self, func, variable):
 		self.func = func
@@ -66,6 +82,12 @@ class DifferentialExpr(Expr):
 	def max_window(self):
 		return max_window((self.func.max_window, self.variable.max_window))
 
+	@property
+	def names(self):
+		if self.variable == NameExpr("t"):
+			return self.func.names
+		return self.func.names | self.variable.names
+
 delim = re.compile(r'([ ()])\s*')
 
 def _tokenize(expr):
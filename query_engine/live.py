@@ -0,0 +1,36 @@
+from .column import RawSeries, RawColumn
+
+class LiveSeries:
+	"""Fields of a series that keeps growing, e.g. of the last hour of a live channel.
+
+	Rows passed to append() are added to the columns in place, and every
+	interpolated field refits only its last continuous fragment, so the cost
+	of an update depends on the new data, and not on the whole series."""
+
+	def __init__(self, engine, rows=(), tags=None):
+		"""rows can also be a RawSeries, e.g. one made with RawSeries.from_columns()."""
+		self.tags = tags
+		if not isinstance(rows, RawSeries):
+			rows = RawSeries(rows, engine.series_key(tags), engine.spline_cache)
+		self.data = rows
+		self.fields = engine.Fields.transform(lambda fname: RawColumn(self.data, fname))
+
+	def __len__(self):
+		return len(self.data)
+
+	@property
+	def last_time(self):
+		return self.data.times[-1] if len(self.data) else None
+
+	def append(self, rows):
+		"""Append rows later than all the rows already in the series. Rows not later than last_time are skipped."""
+		last_time = self.last_time
+		rows = [row for row in rows if last_time is None or row.time > last_time]
+		if not rows:
+			return
+
+		self.data.append(rows)
+		self.fields.extended()
+
+	def __call__(self, period, granularity = None, fields = None):
+		return self.fields(period, granularity, fields)
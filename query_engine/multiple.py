@@ -3,7 +3,9 @@ import operator
 from datetime import timedelta
 from ..timestamped_value import TimestampedValue
 from ..period import Period
-from .column import ExistsFunction
+from .column import ExistsFunction, Timeline, each, values_at, from_epoch_us, SAMPLING_FREQUENCY
+from .piecewise import Piecewise
+import numpy as np
 
 """
     fields:
@@ -17,7 +19,6 @@ from .column import ExistsFunction
         new_views:     sum(new_views)
         new_followers: sum(new_followers)
 """
-SAMPLING_FREQUENCY = timedelta(minutes=1)
 
 class MultipleFunctions:
 	def __init__(self, functions):
@@ -37,20 +38,63 @@ class SummedFunctions:
 		if not self.functions:
 			raise ValueError
 
+		self._piecewise_sum = None
+
+		# Extrema are exact if all the functions are piecewise polynomials, and sampled otherwise.
+		self._exact = all(hasattr(f, "_piecewise") for f in self.functions)
+		if self._exact:
+			self._piecewise = self._piecewise_functions
+
 	def __call__(self, time):
 		return sum(f(time) or 0 for f in self.functions)
 
-	def _samples(self, period):
-		shift = SAMPLING_FREQUENCY/2
-		sampling_period = Period(period.start + shift, period.end - shift)
-		for time in period.iter(SAMPLING_FREQUENCY):
-			yield TimestampedValue(self(time), time)
+	def _values_at(self, times):
+		total = np.zeros(len(times), dtype=np.int64)
+		for f in self.functions:
+			total = total + np.nan_to_num(values_at(f, times), nan=0)
+		return total
+
+	def _samples_each(self, timeline):
+		"""Values sampled every SAMPLING_FREQUENCY from start to end of each subperiod."""
+		times, counts = timeline.sample(SAMPLING_FREQUENCY)
+		if not len(counts):
+			return []
+
+		return np.split(self._values_at(times), np.cumsum(counts[:-1]))
+
+	def _sample(self, period, samples, i):
+		return TimestampedValue(samples[i:i+1].tolist()[0], period.start + i * SAMPLING_FREQUENCY)
+
+	def _piecewise_functions(self):
+		"""Exact sum of the functions."""
+		if self._piecewise_sum is None:
+			self._piecewise_sum = Piecewise.sum(f._piecewise() for f in self.functions)
+		return self._piecewise_sum
+
+	def _extrema_each(self, op, timeline):
+		piecewise = self._piecewise()
+		extrema = getattr(piecewise, op)(timeline.starts / 1e6, timeline.ends / 1e6)
+		return [TimestampedValue(value, from_epoch_us(round(time * 1e6))) for value, time in extrema]
+
+	def min_each(self, timeline):
+		if self._exact:
+			return self._extrema_each("min_each", timeline)
+
+		# Ties are resolved like min() of TimestampedValues - the earliest one wins.
+		return [self._sample(p, samples, int(np.argmin(samples))) for p, samples in zip(timeline, self._samples_each(timeline))]
+
+	def max_each(self, timeline):
+		if self._exact:
+			return self._extrema_each("max_each", timeline)
+
+		# Ties are resolved like max() of TimestampedValues - the latest one wins.
+		return [self._sample(p, samples, len(samples) - 1 - int(np.argmax(samples[::-1]))) for p, samples in zip(timeline, self._samples_each(timeline))]
 
 	def min(self, period):
-		return min(self._samples(period))
+		return self.min_each(Timeline([period]))[0]
 
 	def max(self, period):
-		return max(self._samples(period))
+		return self.max_each(Timeline([period]))[0]
 
 	def integrate_dt(self, period):
 		return sum((f.integrate_dt(period) for f in self.functions), timedelta(0))
@@ -73,6 +117,30 @@ class SummedFunctions:
 		except ZeroDivisionError:
 			return None
 
+	def _sum_each(self, op, timeline, start=0):
+		results = [start] * len(timeline)
+		for f in self.functions:
+			results = [r + (x or start) for r, x in zip(results, each(f, op, timeline))]
+		return results
+
+	def call_each(self, timeline):
+		return self._sum_each("", timeline)
+
+	def at_start_each(self, timeline):
+		return self._values_at(timeline.starts).tolist()
+
+	def at_end_each(self, timeline):
+		return self._values_at(timeline.ends).tolist()
+
+	def integrate_dt_each(self, timeline):
+		return self._sum_each("integrate_dt", timeline, timedelta(0))
+
+	def integrate_exists_dt_each(self, timeline):
+		return [p.duration for p in timeline]
+
+	def avg_each(self, timeline):
+		return [i / d if d else None for i, d in zip(self.integrate_dt_each(timeline), self.integrate_exists_dt_each(timeline))]
+
 class UnionedFunctions:
 	def __init__(self, functions):
 		self.functions = list(functions)
@@ -87,3 +155,6 @@ class UnionedFunctions:
 
 	def union(self, period):
 		return reduce(operator.or_, (f.union(period) for f in self.functions))
+
+	def union_each(self, timeline):
+		return [reduce(operator.or_, sets) for sets in zip(*(each(f, "union", timeline) for f in self.functions))]
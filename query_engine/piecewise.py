@@ -0,0 +1,282 @@
+"""
+Exact piecewise polynomial representation of interpolated series.
+
+Sums are accumulated with difference arrays, so that merging thousands of
+series costs O(pieces + breakpoints). While accumulating, polynomials are
+expressed around the start of a fixed-size block of time, which keeps the
+coefficients well-conditioned; each interval is converted back to its own
+local basis afterwards.
+"""
+
+from scipy import interpolate
+from math import comb, factorial
+import numpy as np
+
+BLOCK = 600 # seconds
+
+def _shift(a, delta):
+	"""Coefficients around x - delta of polynomials given around x.
+
+	a[m, i] multiplies (t - x[i])**m. Returns b with b[n, i] multiplying (t - x[i] + delta[i])**n."""
+	k = a.shape[0] - 1
+	b = np.zeros(a.shape)
+	for m in range(k + 1):
+		for n in range(m + 1):
+			b[n] += a[m] * comb(m, n) * (-delta) ** (m - n)
+	return b
+
+def _horner(a, dt):
+	values = np.zeros(len(dt))
+	for coeffs in a[::-1]:
+		values = values * dt + coeffs
+	return values
+
+def _roots(a, h):
+	"""(i, dt) of every real root 0 < dt < h[i] of the polynomials a[:, i], which
+	aren't identically zero."""
+	k = a.shape[0] - 1
+	while k > 0 and not a[k].any():
+		k -= 1
+
+	if k == 0:
+		return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+	if k == 1:
+		i = np.flatnonzero(a[1])
+		dt = -a[0, i] / a[1, i]
+
+	elif k == 2:
+		c, b, a2 = a[0], a[1], a[2]
+		disc = b * b - 4 * a2 * c
+		i = np.flatnonzero(disc >= 0)
+		c, b, a2, disc = c[i], b[i], a2[i], disc[i]
+		q = -(b + np.copysign(np.sqrt(disc), b)) / 2
+		with np.errstate(divide='ignore', invalid='ignore'):
+			r1 = np.where(a2 != 0, q / a2, np.nan)
+			r2 = np.where(q != 0, c / q, np.nan)
+		i = np.concatenate((i, i))
+		dt = np.concatenate((r1, r2))
+
+	else:
+		# Only intervals whose Bernstein coefficients change sign can contain a root.
+		scaled = a[:k + 1] * h ** np.arange(k + 1)[:, None]
+		bernstein = np.array([
+			sum(comb(j, m) / comb(k, m) * scaled[m] for m in range(j + 1))
+			for j in range(k + 1)
+		])
+		suspect = ~((bernstein > 0).all(axis=0) | (bernstein < 0).all(axis=0))
+
+		# Lower degree polynomials are solved separately.
+		lower = np.flatnonzero(suspect & (a[k] == 0))
+		li, ldt = _roots(a[:k, lower], h[lower])
+
+		# Eigenvalues of the companion matrices of the rest.
+		full = np.flatnonzero(suspect & (a[k] != 0))
+		companion = np.zeros((len(full), k, k))
+		companion[:, 0, :] = -(a[k - 1::-1, full] / a[k, full]).T
+		companion[:, np.arange(1, k), np.arange(k - 1)] = 1
+		roots = np.linalg.eigvals(companion) if len(full) else np.zeros((0, k))
+		real = np.abs(roots.imag) <= 1e-9 * np.maximum(1, np.abs(roots.real))
+
+		i = np.concatenate((lower[li], np.repeat(full, k).reshape(-1, k)[real]))
+		dt = np.concatenate((ldt, roots.real[real]))
+
+	keep = np.isfinite(dt) & (dt > 0) & (dt < h[i])
+	return i[keep], dt[keep]
+
+class Piecewise:
+	"""A function that is a polynomial on every [x[i], x[i+1]), and 0 outside of [x[0], x[-1]].
+
+	a[m, i] multiplies (t - x[i])**m. At breakpoint x[i], the function takes the
+	limit from the left plus jump[i] - that's how functions defined on closed
+	periods keep their values at both ends when they're added together.
+	Times are in epoch seconds."""
+
+	def __init__(self, x, a, jump, integer=False, nonnegative=False):
+		self.x = np.asarray(x, dtype=np.float64)
+		self.a = np.asarray(a, dtype=np.float64)
+		self.a = self.a.reshape(len(self.a), max(len(self.x) - 1, 0))
+		self.jump = np.asarray(jump, dtype=np.float64)
+		self.integer = integer
+		self.nonnegative = nonnegative
+
+		self._candidates = None
+
+	@property
+	def k(self):
+		return self.a.shape[0] - 1
+
+	@classmethod
+	def zero(cls):
+		return cls([], np.zeros((1, 0)), [], integer=True, nonnegative=True)
+
+	@classmethod
+	def constant(cls, start, end, value):
+		"""value on [start, end]."""
+		if start == end:
+			return cls([start], np.zeros((1, 0)), [value], isinstance(value, int), value >= 0)
+		return cls([start, end], [[value]], [value, 0], isinstance(value, int), value >= 0)
+
+	@classmethod
+	def from_spline(cls, spline, nonnegative=False):
+		"""The spline on its domain, optionally clamped to nonnegative values."""
+		k = spline.k
+		pp = interpolate.PPoly.from_spline(spline)
+
+		nonempty = np.diff(pp.x) > 0
+		x = np.unique(pp.x)
+		coeffs = pp.c[:, nonempty]
+
+		if nonnegative:
+			pp = interpolate.PPoly(coeffs, x, extrapolate=False)
+			i, dt = _roots(coeffs[::-1], np.diff(x))
+			x = np.union1d(x, x[i] + dt)
+			a = np.array([pp(x[:-1], nu=m) / factorial(m) for m in range(k + 1)])
+			a[:, _horner(a, np.diff(x) / 2) < 0] = 0
+		else:
+			a = coeffs[::-1]
+
+		jump = np.zeros(len(x))
+		jump[0] = a[0, 0]
+		return cls(x, a, jump, nonnegative=nonnegative)
+
+	@classmethod
+	def sum(cls, functions):
+		functions = [f for f in functions if len(f.x)]
+		if not functions:
+			return cls.zero()
+
+		k = max(f.k for f in functions)
+		integer = all(f.integer for f in functions)
+		nonnegative = all(f.nonnegative for f in functions)
+
+		# Per-piece data of all functions.
+		starts = np.concatenate([f.x[:-1] for f in functions])
+		ends = np.concatenate([f.x[1:] for f in functions])
+		a = np.concatenate([np.pad(f.a, ((0, k - f.k), (0, 0))) for f in functions], axis=1)
+
+		lo = min(f.x[0] for f in functions)
+		hi = max(f.x[-1] for f in functions)
+		blocks = np.arange(np.floor(lo / BLOCK), np.ceil(hi / BLOCK) + 1) * BLOCK
+		x = np.unique(np.concatenate([f.x for f in functions] + [blocks[(blocks > lo) & (blocks < hi)]]))
+
+		# Cut the pieces at the block boundaries.
+		first_block = np.floor(starts / BLOCK)
+		last_block = np.ceil(ends / BLOCK) - 1
+		counts = (last_block - first_block + 1).astype(np.int64)
+		piece = np.repeat(np.arange(len(starts)), counts)
+		block = np.repeat(first_block, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+		anchor = block * BLOCK
+		seg_start = np.maximum(starts[piece], anchor)
+		seg_end = np.minimum(ends[piece], anchor + BLOCK)
+
+		# Accumulate polynomials around block anchors.
+		d = _shift(a[:, piece], starts[piece] - anchor)
+		seg_start = np.searchsorted(x, seg_start)
+		seg_end = np.searchsorted(x, seg_end)
+		diff = np.array([
+			np.bincount(seg_start, d[m], len(x)) - np.bincount(seg_end, d[m], len(x))
+			for m in range(k + 1)
+		])
+		anchored = np.cumsum(diff, axis=1)[:, :-1]
+
+		# Don't leave rounding errors where all functions are zero.
+		nonzero = a.any(axis=0)
+		active = np.bincount(np.searchsorted(x, starts[nonzero]), minlength=len(x)) - np.bincount(np.searchsorted(x, ends[nonzero]), minlength=len(x))
+		anchored[:, np.cumsum(active)[:-1] == 0] = 0
+
+		interval_anchor = np.floor(x[:-1] / BLOCK) * BLOCK
+		local = _shift(anchored, interval_anchor - x[:-1])
+
+		jump = np.bincount(np.searchsorted(x, np.concatenate([f.x for f in functions])), np.concatenate([f.jump for f in functions]), len(x))
+
+		return cls(x, local, jump, integer, nonnegative)
+
+	def _limits(self):
+		"""Values at the breakpoints, approached from the left and from the right."""
+		n = len(self.x)
+		left = np.zeros(n)
+		right = np.zeros(n)
+		if n > 1:
+			left[1:] = _horner(self.a, np.diff(self.x))
+			right[:-1] = self.a[0]
+		return left, right
+
+	def __call__(self, times):
+		"""Values at the epoch second times."""
+		times = np.asarray(times, dtype=np.float64)
+		values = np.zeros(len(times))
+		if not len(self.x):
+			return values
+
+		i = np.searchsorted(self.x, times, 'right') - 1
+		inside = (i >= 0) & (i < len(self.x) - 1)
+		values[inside] = _horner(self.a[:, i[inside]], times[inside] - self.x[i[inside]])
+
+		exact = (i >= 0) & (self.x[np.maximum(i, 0)] == times)
+		left, _ = self._limits()
+		values[exact] = (left + self.jump)[i[exact]]
+		return values
+
+	@property
+	def candidates(self):
+		"""(times, values, sides) of every possible extremum, sorted by time.
+
+		side is -1 for limits from the left, +1 for limits from the right, and 0 for values
+		attained at that time."""
+		if self._candidates is not None:
+			return self._candidates
+
+		left, right = self._limits()
+		times = [self.x, self.x[1:], self.x[:-1]]
+		values = [left + self.jump, left[1:], right[:-1]]
+		pieces = max(len(self.x) - 1, 0)
+		sides = [np.zeros(len(self.x)), -np.ones(pieces), np.ones(pieces)]
+
+		if self.k >= 2 and len(self.x) > 1:
+			derivative = self.a[1:] * np.arange(1, self.k + 1)[:, None]
+			# Roots at breakpoints are already covered by the limits there.
+			i, dt = _roots(derivative, np.diff(self.x))
+			times.append(self.x[i] + dt)
+			values.append(_horner(self.a[:, i], dt))
+			sides.append(np.zeros(len(i)))
+
+		times = np.concatenate(times)
+		values = np.concatenate(values)
+		sides = np.concatenate(sides)
+		order = np.lexsort((sides, times))
+		self._candidates = (times[order], values[order], sides[order])
+		return self._candidates
+
+	def _extremum_each(self, starts, ends, select):
+		ctimes, cvalues, csides = self.candidates
+		start_values = self(starts)
+		end_values = self(ends)
+
+		lo = np.searchsorted(ctimes, starts, 'left')
+		hi = np.searchsorted(ctimes, ends, 'right')
+
+		results = []
+		for s, e, sv, ev, l, h in zip(starts.tolist(), ends.tolist(), start_values.tolist(), end_values.tolist(), lo.tolist(), hi.tolist()):
+			t = ctimes[l:h]
+			side = csides[l:h]
+			# Limits approached from outside of [s, e] are not reachable inside of it.
+			keep = ~(((t == s) & (side < 0)) | ((t == e) & (side > 0)))
+			times = np.concatenate(([s], t[keep], [e]))
+			values = np.concatenate(([sv], cvalues[l:h][keep], [ev]))
+			if self.nonnegative:
+				values = np.maximum(values, 0)
+			i = select(values)
+			value = values[i].item()
+			if self.integer:
+				value = int(round(value))
+			results.append((value, times[i].item()))
+		return results
+
+	def min_each(self, starts, ends):
+		"""(value, time) of the minimum on every [starts[i], ends[i]]. Ties go to the earliest time."""
+		return self._extremum_each(starts, ends, np.argmin)
+
+	def max_each(self, starts, ends):
+		"""(value, time) of the maximum on every [starts[i], ends[i]]. Ties go to the latest time."""
+		return self._extremum_each(starts, ends, lambda values: len(values) - 1 - np.argmax(values[::-1]))
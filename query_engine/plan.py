@@ -0,0 +1,116 @@
+"""
+Evaluation plans of field expressions.
+
+Expressions of all fields of a schema are compiled once into a DAG of nodes,
+in which equal subexpressions are a single node - so, for example, a spline
+used by two fields is fitted once per series. Nodes are stored in
+topological order, and str(plan) shows them, e.g.:
+
+	%0 = viewers
+	%1 = %0 over <-5m to +5m>
+	%2 = interpolate_nonnegative(%1)
+	%3 = %2 dt
+	viewers = %2
+	time_watched = %3
+"""
+
+from collections import namedtuple
+from .expr import CallExpr, OverExpr, NameExpr, DifferentialExpr, ConstExpr
+from .column import DTDifferential, DFieldDifferential
+
+Node = namedtuple("Node", "key args evaluate")
+
+def refers_to_field(specs, name, spec):
+	"""Whether name used in spec's expression refers to a field (defined before spec), and not to a source field."""
+	try:
+		return specs[name].col < spec.col
+	except KeyError:
+		return False
+
+def _call(name):
+	def evaluate(get_source_field, first, *rest):
+		return getattr(first, name)(*rest)
+	return evaluate
+
+def _over(window):
+	def evaluate(get_source_field, value):
+		return value.over(window)
+	return evaluate
+
+def _source(name):
+	def evaluate(get_source_field):
+		return get_source_field(name)
+	return evaluate
+
+def _dt(get_source_field, func):
+	return DTDifferential(func)
+
+def _dfield(get_source_field, variable):
+	return DFieldDifferential(variable)
+
+class Plan:
+	def __init__(self, specs):
+		self.nodes = []
+		self.fields = {}
+		self._ids = {}
+
+		for spec in specs.values():
+			self.fields[spec.name] = self._compile(spec.expr, specs, spec)
+
+		del self._ids
+
+	def _node(self, key, args, evaluate):
+		try:
+			return self._ids[key]
+		except KeyError:
+			i = self._ids[key] = len(self.nodes)
+			self.nodes.append(Node(key, args, evaluate))
+			return i
+
+	def _compile(self, expr, specs, spec):
+		if isinstance(expr, NameExpr):
+			if refers_to_field(specs, expr.name, spec):
+				return self.fields[expr.name]
+			else:
+				return self._node(("source", expr.name), (), _source(expr.name))
+
+		elif isinstance(expr, OverExpr):
+			arg = self._compile(expr.expr, specs, spec)
+			return self._node(("over", arg, expr.over.prev, expr.over.next), (arg,), _over(expr.over))
+
+		elif isinstance(expr, CallExpr):
+			args = tuple(self._compile(arg, specs, spec) for arg in expr.args)
+			return self._node(("call", expr.name) + args, args, _call(expr.name))
+
+		elif isinstance(expr, DifferentialExpr):
+			if expr.variable == NameExpr("t"):
+				arg = self._compile(expr.func, specs, spec)
+				return self._node(("dt", arg), (arg,), _dt)
+			else:
+				assert(expr.func == ConstExpr(1))
+				arg = self._compile(expr.variable, specs, spec)
+				return self._node(("d", arg), (arg,), _dfield)
+		else:
+			raise TypeError("Unsupported expression: " + type(expr).__name__)
+
+	def _describe(self, node):
+		kind = node.key[0]
+		args = ["%{}".format(arg) for arg in node.args]
+		if kind == "source":
+			return node.key[1]
+		elif kind == "over":
+			return "{} over <-{} to +{}>".format(args[0], node.key[2], node.key[3])
+		elif kind == "call":
+			return "{}({})".format(node.key[1], ", ".join(args))
+		elif kind == "dt":
+			return "{} dt".format(args[0])
+		else:
+			return "d {}".format(args[0])
+
+	def __str__(self):
+		lines = ["%{} = {}".format(i, self._describe(node)) for i, node in enumerate(self.nodes)]
+		lines += ["{} = %{}".format(name, i) for name, i in self.fields.items()]
+		return "\n".join(lines)
+
+	def __repr__(self):
+		return "<Plan of {} fields, {} nodes>".format(len(self.fields), len(self.nodes))
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from threading import Lock
+from scipy import interpolate
+import numpy as np
+import hashlib
+import logging
+import os
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+def _digest(x, y):
+	h = hashlib.blake2b(digest_size=16)
+	h.update(np.ascontiguousarray(x, dtype=np.int64).tobytes())
+	h.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+	return h.hexdigest()
+
+def fit(x, y, k, s):
+	"""UnivariateSpline(x, y, k=k, s=s) as a BSpline, which is NaN outside of [x[0], x[-1]].
+
+	The knots of FITPACK splines are repeated k + 1 times at both ends, but
+	get_knots() returns them once."""
+	spline = interpolate.UnivariateSpline(x, y, k=k, s=s)
+	knots = spline.get_knots()
+	t = np.concatenate(([knots[0]] * k, knots, [knots[-1]] * k))
+	return interpolate.BSpline(t, spline.get_coeffs(), k, extrapolate=False)
+
+def _tck_size(tck):
+	t, c, k = tck
+	return t.nbytes + c.nbytes
+
+class SplineCache:
+	"""Fitted splines, keyed by (table, tags, field, fragment start, fragment end, k, s, content digest).
+
+	Keeps the knots and coefficients of the most recently used splines in
+	memory, up to max_bytes. If directory is given, fitted splines are also
+	stored there, so they survive restarts and can be shared between workers."""
+
+	def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None):
+		self.max_bytes = max_bytes
+		self.directory = directory
+
+		self._splines = OrderedDict()
+		self._bytes = 0
+		self._lock = Lock()
+
+		self.hits = 0
+		self.misses = 0
+
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+
+	@classmethod
+	def from_env(cls):
+		max_bytes = int(os.getenv("REDFLOOD_SPLINE_CACHE_SIZE", DEFAULT_MAX_BYTES))
+		directory = os.getenv("REDFLOOD_SPLINE_CACHE_DIR") or None
+		if max_bytes <= 0 and not directory:
+			return None
+		return cls(max_bytes, directory)
+
+	def __len__(self):
+		return len(self._splines)
+
+	@property
+	def size(self):
+		return self._bytes
+
+	def spline(self, series_key, field, x, y, k, s):
+		"""fit(x, y, k, s), fitted only if not cached yet."""
+		key = (series_key, field, int(x[0]), int(x[-1]), k, s, _digest(x, y))
+
+		tck = self._get(key)
+		if tck is None:
+			spline = fit(x, y, k, s)
+			self._put(key, spline.tck, store=True)
+			return spline
+
+		t, c, k = tck
+		return interpolate.BSpline(t, c, k, extrapolate=False)
+
+	def _get(self, key):
+		with self._lock:
+			try:
+				tck = self._splines[key]
+			except KeyError:
+				pass
+			else:
+				self._splines.move_to_end(key)
+				self.hits += 1
+				return tck
+
+		tck = self._load(key)
+		with self._lock:
+			if tck is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+
+		if tck is not None:
+			self._put(key, tck, store=False)
+		return tck
+
+	def _put(self, key, tck, store):
+		size = _tck_size(tck)
+
+		with self._lock:
+			if key not in self._splines and size <= self.max_bytes:
+				self._splines[key] = tck
+				self._bytes += size
+
+			while self._bytes > self.max_bytes:
+				_, old = self._splines.popitem(last=False)
+				self._bytes -= _tck_size(old)
+
+		if store:
+			self._store(key, tck)
+
+	def _path(self, key):
+		return os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + ".npz")
+
+	def _load(self, key):
+		if not self.directory:
+			return None
+
+		try:
+			with np.load(self._path(key)) as f:
+				return (f["t"], f["c"], int(f["k"]))
+		except FileNotFoundError:
+			return None
+		except Exception:
+			logging.getLogger(__name__).warning("Ignoring unreadable spline cache entry %s", self._path(key), exc_info=True)
+			return None
+
+	def _store(self, key, tck):
+		if not self.directory:
+			return
+
+		path = self._path(key)
+		tmp = "{}.{}.tmp".format(path, os.getpid())
+		t, c, k = tck
+		try:
+			with open(tmp, "wb") as f:
+				np.savez(f, t=t, c=c, k=k)
+			os.replace(tmp, path)
+		except OSError:
+			logging.getLogger(__name__).warning("Cannot store spline cache entry %s", path, exc_info=True)
@@ -0,0 +1,117 @@
+import random
+from collections import namedtuple
+from datetime import timedelta
+from . import QueryEngine
+from .column import RawSeries
+from .. import Period, Duration, to_datetime
+from ..schema import parse_table_schema, load_yaml
+
+schema_yaml = """
+since: 2016-01-01T00:00:00Z
+raw_table_name: raw_channels
+kind: channel
+
+tags:
+	channel: text
+
+raw_fields:
+	viewers:     bigint
+	total_views: bigint
+
+fields:
+	viewers:      [interpolate_nonnegative(viewers over 10m), [avg, max]]
+	total_views:  [smooth(total_views over 1h), [earliest, latest]]
+	is_streaming: [exists(viewers), [at_start, at_end]]
+
+	time_streamed: is_streaming dt
+	time_watched:  viewers dt
+	new_views:     d total_views
+
+aggregated_fields:
+	viewers_avg: double
+	viewers_max: timestamped bigint
+	total_views_earliest: timestamped bigint
+	total_views_latest: timestamped bigint
+	is_streaming_at_start: int
+	is_streaming_at_end: int
+	time_streamed: duration
+	time_watched: duration
+	new_views: bigint
+
+group:
+	by: []
+	fields:
+		viewers: [sum(viewers), [avg, max]]
+	aggregated_fields:
+		viewers_avg: double
+		viewers_max: timestamped bigint
+
+partition_by: []
+sort_by: [viewers_max]
+default_sort_by: viewers_max
+charts: {}
+leaderboards: {}
+rollups: {}
+"""
+
+desc = load_yaml(schema_yaml)
+desc["since"] = to_datetime(desc["since"])
+engine = QueryEngine(parse_table_schema(desc))
+
+RawRow = namedtuple("RawRow", "channel time viewers total_views")
+
+def generate(seed, start, n, gaps=()):
+	r = random.Random(seed)
+	time = to_datetime(start)
+	viewers, total_views = r.randint(10, 5000), r.randint(1000, 100000)
+	rows = []
+	for i in range(n):
+		time += timedelta(seconds=r.randint(50, 70)) + (timedelta(minutes=30) if i in gaps else timedelta(0))
+		viewers = max(0, viewers + r.randint(-300, 300))
+		total_views += r.randint(0, 100)
+		rows.append(RawRow("a", time, viewers, total_views))
+	return rows
+
+def close(a, b):
+	if isinstance(a, float) or isinstance(b, float):
+		return a is not None and b is not None and abs(a - b) <= 1e-6 * max(1, abs(a), abs(b))
+	if isinstance(a, timedelta):
+		return abs((a - b).total_seconds()) <= 1e-3
+	if isinstance(a, tuple):
+		return len(a) == len(b) and all(close(x, y) for x, y in zip(a, b))
+	return a == b
+
+def results(fields):
+	return [tuple(fields(period)) for period in periods] + [tuple(data) for _, data in fields(periods[0], Duration("15m"))]
+
+rows = generate(1, "2016-05-16T09:40:00Z", 300, gaps=(50, 51, 180))
+periods = [Period("2016-05-16T10:00:00Z", "2016-05-16T14:00:00Z"), Period("2016-05-16T10:17:00Z", "2016-05-16T10:47:00Z")]
+
+expected = results(engine.transform_datapoints(rows))
+
+# Appended in chunks, querying in between so that the fields are built and then extended.
+live = engine.live_series()
+for start in range(0, len(rows), 37):
+	live.append(rows[start:start + 37])
+	results(live.fields)
+assert(len(live) == len(rows))
+assert(close(tuple(results(live.fields)), tuple(expected)))
+
+# Rows not later than the last one are skipped.
+live.append(rows[-10:])
+assert(len(live) == len(rows))
+
+# A live series can start from columns, which only have the fields they were made with.
+time, columns = RawSeries(rows[:100]).columns(["viewers", "total_views"])
+live = engine.live_series(RawSeries.from_columns(time, columns))
+results(live.fields)
+live.append(rows[100:])
+assert(close(tuple(results(live.fields)), tuple(expected)))
+
+try:
+	live.data.column("channel")
+	assert(False)
+except KeyError:
+	pass
+
+print("OK")
@@ -0,0 +1,19 @@
+from .piecewise import Piecewise
+import numpy as np
+
+starts, ends = np.array([0.0, 4.0]), np.array([5.0, 5.0])
+
+# Sums of no defined function, or of functions defined at a single time.
+zero = Piecewise.sum([Piecewise.zero(), Piecewise.zero()])
+assert(zero.max_each(starts, ends) == [(0, 5.0), (0, 5.0)])
+assert(zero.min_each(starts, ends) == [(0, 0.0), (0, 4.0)])
+
+point = Piecewise.sum([Piecewise.constant(3, 3, 2)])
+assert(point.max_each(starts, ends) == [(2, 3.0), (0, 5.0)])
+assert(list(point([2, 3, 4])) == [0, 2, 0])
+
+both = Piecewise.sum([Piecewise.constant(3, 3, 2), Piecewise.constant(1, 6, 1)])
+assert(both.max_each(starts, ends) == [(3, 3.0), (1, 5.0)])
+assert(list(both([0, 2, 3, 4])) == [0, 1, 3, 1])
+
+print("OK")
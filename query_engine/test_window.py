@@ -0,0 +1,77 @@
+from collections import namedtuple
+from datetime import timedelta
+from . import QueryEngine
+from .column import Integral, Timeline, SAMPLING_FREQUENCY
+from .. import Period, to_datetime
+from ..window import Window
+from ..schema import parse_table_schema, load_yaml
+import math
+
+schema_yaml = """
+since: 2016-01-01T00:00:00Z
+raw_table_name: raw_channels
+kind: channel
+
+tags:
+	channel: text
+
+raw_fields:
+	viewers: bigint
+
+fields:
+	viewers:      [interpolate_nonnegative(viewers over 10m), [avg, max]]
+	time_watched: viewers dt
+
+aggregated_fields:
+	viewers_avg: double
+	viewers_max: timestamped bigint
+	time_watched: duration
+
+group:
+	by: []
+	fields: {}
+	aggregated_fields: {}
+
+partition_by: []
+sort_by: [viewers_max]
+default_sort_by: viewers_max
+charts: {}
+leaderboards: {}
+rollups: {}
+"""
+
+desc = load_yaml(schema_yaml)
+desc["since"] = to_datetime(desc["since"])
+engine = QueryEngine(parse_table_schema(desc))
+
+RawRow = namedtuple("RawRow", "channel time viewers")
+start = to_datetime("2016-05-16T10:00:00Z")
+periods = [Period("2016-05-16T10:20:00Z", "2016-05-16T11:10:00Z"), Period("2016-05-16T10:25:00Z", "2016-05-16T10:40:00Z")]
+
+def sampled_average(differential, window, period, step=SAMPLING_FREQUENCY):
+	"""Average of the integrals over window at every step of period, one integrate() at a time."""
+	values = []
+	time = period.start
+	while time <= period.end:
+		values.append(differential.integrate(window.period_at(time)).total_seconds())
+		time += step
+	return sum(values) / len(values)
+
+# Viewers drop to 0 for half an hour, so the spline dips below 0 there. Windows over the dip clamp the
+# integral of the piece of the fragment in them, like integrate() does, and so does their average.
+series = engine.transform_datapoints([RawRow("a", start + timedelta(minutes=i), 0 if 30 <= i < 60 else 1000) for i in range(120)])
+assert(series.time_watched.func._clamps())
+for window in (Window("10m"), Window("1h"), Window(timedelta(0), timedelta(minutes=20))):
+	averages = Integral(series.time_watched, window).avg_each(Timeline(periods))
+	for period, average in zip(periods, averages):
+		assert(math.isclose(average.total_seconds(), sampled_average(series.time_watched, window, period), rel_tol=1e-9))
+
+# Otherwise, averages are exact - the sampled ones tend to them.
+series = engine.transform_datapoints([RawRow("a", start + timedelta(minutes=i), 1000 + 500 * math.sin(i / 10)) for i in range(120)])
+assert(not series.time_watched.func._clamps())
+for window in (Window("10m"), Window("1h"), Window(timedelta(0), timedelta(minutes=20))):
+	averages = Integral(series.time_watched, window).avg_each(Timeline(periods))
+	for period, average in zip(periods, averages):
+		assert(math.isclose(average.total_seconds(), sampled_average(series.time_watched, window, period, timedelta(seconds=5)), rel_tol=1e-3))
+
+print("OK")
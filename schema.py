@@ -4,14 +4,22 @@ import yaml
 from . import _types as types
 from .list_ir import Field as LowLevelField
 from ._aggregated_row import AggregatedRowForKind
+from .fs import compression
 
 TagSpec = namedtuple("TagSpec", "col name type")
 RawFieldSpec = namedtuple("RawFieldSpec", "col name type")
 FieldSpec = namedtuple("FieldSpec", "col name expr ops")
 AggregatedFieldSpec = namedtuple("AggregatedFieldSpec", "col name type expr")
 
-RawTableSchema = namedtuple("RawSchema", "since raw_table_name raw_fields kind tags fields aggregated_fields group partition_by sort_by default_sort_by charts leaderboards rollups")
-TableSchema = namedtuple("Schema", "kinds since raw_table_name raw_fields kind tags Tags fields AggregatedFields group partition_by sort_by default_sort_by rollups")
+RawTableSchema = namedtuple("RawSchema", "since raw_table_name raw_fields kind tags fields aggregated_fields group partition_by sort_by default_sort_by charts leaderboards rollups storage", defaults=(None,))
+TableSchema = namedtuple("Schema", "kinds since raw_table_name raw_fields kind tags Tags fields AggregatedFields group partition_by sort_by default_sort_by rollups storage")
+
+# How aggregated data is stored - e.g. storage: {parts: columnar}.
+DEFAULT_STORAGE = OrderedDict([
+	("parts", "rows"),
+	("compression", None), # zlib, lzma, or any other codec of fs.compression
+	("partindex", "hashtable"), # or perfect
+])
 
 RawGroupSchema = namedtuple("RawGroupSchema", "by fields aggregated_fields")
 GroupSchema = namedtuple("GroupSchema", "by fields AggregatedFields sort_by")
@@ -100,8 +108,22 @@ def parse_table_schema(schema):
 		sort_by = sort_by,
 		default_sort_by = schema.default_sort_by,
 		rollups = schema.rollups,
+		storage = parse_storage(schema.storage),
 	)
 
+def parse_storage(storage):
+	storage = OrderedDict(DEFAULT_STORAGE, **(storage or {}))
+	unknown = set(storage) - set(DEFAULT_STORAGE)
+	if unknown:
+		raise ValueError("Unknown storage options: " + ", ".join(sorted(unknown)))
+	if storage["parts"] not in ("rows", "columnar"):
+		raise ValueError("Unknown parts format: " + storage["parts"])
+	if storage["compression"] is not None and storage["compression"] not in compression.codecs():
+		raise ValueError("Unknown compression: " + storage["compression"])
+	if storage["partindex"] not in ("hashtable", "perfect"):
+		raise ValueError("Unknown partindex format: " + storage["partindex"])
+	return storage
+
 def load_yaml(stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict):
 	stream = stream.replace("\t", "    ")
 
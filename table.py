@@ -5,7 +5,10 @@ from .duration import Duration
 from .period import Period
 from .range import Range
 from .query_engine import QueryEngine
-from collections import namedtuple
+from .query_engine.column import RawSeries
+from ._parallel import evaluate_chunk, chunked
+from ._live import LiveQuery
+from collections import namedtuple, OrderedDict
 from functools import reduce
 from datetime import datetime
 import operator
@@ -24,11 +27,12 @@ class Table:
 		self.name = name
 
 		self.schema = parse_table_schema(RawTableSchema(**kwargs))
+		self._desc = kwargs
 
 		self.rollups = {Duration(freq): set(Duration(gran) for gran in grans) for freq, grans in self.schema.rollups.items()}
 		self.granularities = reduce(operator.or_, (grans for grans in self.rollups.values()))
 
-		self.query_engine = QueryEngine(self.schema)
+		self.query_engine = QueryEngine(self.schema, self.name, db.spline_cache)
 
 		self.Tags = namedtuple("Tags", self.schema.tags.keys())
 		self._tags_func = lambda row: self.Tags(*(getattr(row, tag) for tag in self.schema.tags.keys()))
@@ -98,20 +102,27 @@ class Table:
 		# Needs a lower priority than all the automatically scheduled rollups.
 		self.db()._autorollup_status_db.execute("INSERT INTO rollups (what, start, end, status, priority) VALUES (%s, %s, %s, 'todo', %s)", self.name, period.start, period.end, -10*365*24*3600)
 
-	def get(self, where, period, granularity = None):
+	def _kind_of(self, where):
 		kind = None
 		for kindspec in self.schema.kinds.values():
 			if (set(where.keys()) == set(kindspec.Tags._fields)):
 				kind = kindspec.name
 
 		assert(kind)
+		return kind
+
+	def get(self, where, period, granularity = None, fields = None):
+		"""Aggregated rows of a single series or group, for every subperiod of period.
+
+		If fields (names of aggregated fields) are given, only these are computed, and the rest is None."""
+		kind = self._kind_of(where)
 
 		if granularity is None:
 			granularity = period.duration
 
 		logger = logging.getLogger(__name__)
 		logger.info("Calling query_raw()")
-		results = self.query_raw(period, where, kind = kind)
+		results = self.query_raw(period, where, kind = kind, fields = fields)
 		try:
 			part_id, part_data = next(results)
 			rtags, result = next(part_data)
@@ -120,20 +131,28 @@ class Table:
 			result = self.query_engine.empty_result
 
 		logger.info("Iterating over subperiods")
-		for subperiod, fields in result(period, granularity):
-			yield subperiod, self.schema.kinds[kind].AggregatedRow(rtags, fields)
+		for subperiod, data in result(period, granularity, fields):
+			yield subperiod, self.schema.kinds[kind].AggregatedRow(rtags, data)
 		logger.info("Iteration done")
 
+	def live(self, where, since, fields = None):
+		"""Like get(), for data that's still being collected since the given time. Call update() to fetch new rows."""
+		return LiveQuery(self, where, since, fields)
+
 	def aggregate_results(self, results):
 		return aggregate_results(results)
 
 	def list(self, period, partition, kind, sort, range=None):
 		return self.aggregated_data.list(period, partition, kind, sort, Range.cast(range) if range is not None else None)
 
+	def columns(self, period, partition, kind, sort, names=None):
+		"""Like list(), but as {column: numpy array} of only the given columns."""
+		return self.aggregated_data.columns(period, partition, kind, sort, names)
+
 	def _transform_series(self, data):
 		for tags, datapoints in itertools.groupby(data, key=self._tags_func):
 			#try:
-			result = self.query_engine.transform_datapoints(datapoints)
+			result = self.query_engine.transform_datapoints(datapoints, tags)
 			#except ValueError:
 			#	continue
 			yield tags, result
@@ -142,13 +161,14 @@ class Table:
 		for tags, subseries_data in itertools.groupby(data, key=merge_by_func):
 			yield tags, self.query_engine.merge(self._transform_series(subseries_data))
 
-	def query_raw(self, period, where = {}, partition_by = (), kind = None):
+	def _query_partitions(self, period, where, partition_by, kind, fields):
+		"""(merge_by_func, [(part_id, rows)]) - raw rows sorted by partition, merge group and series."""
 		if not kind:
 			kind = self.schema.kind
 
 		merge_by = kind if kind != self.schema.kind else None
 
-		period = self.query_engine.required_period(period)
+		period = self.query_engine.required_period(period, fields, group = bool(merge_by))
 
 		res = self.raw_data.query(period, where)
 
@@ -157,21 +177,197 @@ class Table:
 
 		res = sorted(res, key=sort_by_func)
 
-		series_func = self._transform_series
+		merge_by_func = None
 		if merge_by:
-			series_func = functools.partial(self._merge_series, lambda row: self.schema.kinds[merge_by].Tags(getattr(row, merge_by)))
+			merge_by_func = lambda row: self.schema.kinds[merge_by].Tags(getattr(row, merge_by))
 
 		if partition_by:
 			partition_by_func = lambda row: tuple(getattr(row, field) for field in partition_by)
 		else:
 			partition_by_func = lambda row: ()
 
+		return merge_by_func, itertools.groupby(res, key=partition_by_func)
+
+	def query_raw(self, period, where = {}, partition_by = (), kind = None, fields = None):
+		"""Series (or groups of series) of every partition, as (tags, functions to aggregate).
+
+		If fields (names of aggregated fields) are given, only the data needed for them is guaranteed to be there."""
+		merge_by_func, partitions = self._query_partitions(period, where, partition_by, kind, fields)
+
+		series_func = self._transform_series
+		if merge_by_func:
+			series_func = functools.partial(self._merge_series, merge_by_func)
+
 		with warnings.catch_warnings():
 			warnings.simplefilter("ignore", UserWarning) # Ignore scipy.interpolate warning about not good-enough interpolation.
 
-			for part_id, rows in itertools.groupby(res, key=partition_by_func):
+			for part_id, rows in partitions:
 				yield part_id, series_func(rows)
 
+	def query_fields(self, period, where = {}, partition_by = (), kind = None, granularity = None, fields = None):
+		"""Like query_raw(), but yields the aggregated fields from period (or its subperiods) instead of the series.
+
+		If the database has workers, the series are transformed in its process pool."""
+		pool = self.db().process_pool
+		if pool is None:
+			for part_id, series in self.query_raw(period, where, partition_by, kind, fields):
+				yield part_id, ((tags, result(period, granularity, fields)) for tags, result in series)
+			return
+
+		merge_by_func, partitions = self._query_partitions(period, where, partition_by, kind, fields)
+		Fields = self.query_engine.GFields if merge_by_func else self.query_engine.Fields
+		raw_fields = self._raw_fields(fields, bool(merge_by_func))
+
+		def pack(rows):
+			for tags, datapoints in itertools.groupby(rows, key=self._tags_func):
+				yield tags, self._pack(tags, datapoints, raw_fields)
+
+		# Submit everything first, so that the workers are kept busy across partitions.
+		submitted = []
+		for part_id, rows in partitions:
+			if merge_by_func:
+				units = [(tags, [series for _, series in pack(subseries)]) for tags, subseries in itertools.groupby(rows, key=merge_by_func)]
+			else:
+				units = list(pack(rows))
+
+			futures = self._submit(pool, bool(merge_by_func), period, granularity, fields, [unit for _, unit in units])
+			submitted.append((part_id, [tags for tags, _ in units], futures))
+
+		for part_id, tags, futures in submitted:
+			results = itertools.chain.from_iterable(future.result() for future in futures)
+			yield part_id, ((t, self._unpack(Fields, result)) for t, result in zip(tags, results))
+
+	def query_fields_all(self, period, sinks, where = {}, granularity = None, fields = None):
+		"""query_fields() of every (partition_by, kind) in sinks at once, as [((partition_by, kind), [(part_id, [(tags, result)])])].
+
+		The raw data is fetched once. A series is split only by the tags that
+		change within it, so it's transformed once for all the sinks that don't
+		split it, and series and groups of series that are the same in several
+		sinks are evaluated once."""
+		required = [self.query_engine.required_period(period, fields, group = group) for group in set(kind != self.schema.kind for _, kind in sinks)]
+		required = Period(min(p.start for p in required), max(p.end for p in required))
+
+		res = sorted(self.raw_data.query(required, where), key=self._tags_func)
+		series = []
+		for tags, rows in itertools.groupby(res, key=self._tags_func):
+			rows = list(rows)
+			varying = set(tag for tag in self.schema.group.by if len(set(getattr(row, tag) for row in rows)) > 1)
+			series.append((tags, rows, varying))
+
+		subsets = {} # (tags, values of the varying tags): (tags, rows)
+		layouts = []
+		for part_keys, kind in sinks:
+			merge_by = kind if kind != self.schema.kind else None
+			split_by = tuple(part_keys) + ((merge_by,) if merge_by else ())
+
+			parts = {}
+			for tags, rows, varying in series:
+				for values, subrows in self._split(rows, split_by, varying):
+					key = (tags, tuple((tag, value) for tag, value in zip(split_by, values) if tag in varying))
+					subsets.setdefault(key, (tags, subrows))
+
+					part_id = values[:len(part_keys)]
+					if merge_by:
+						parts.setdefault(part_id, {}).setdefault(values[-1], []).append(key)
+					else:
+						parts.setdefault(part_id, []).append((tags, (False, key)))
+
+			if merge_by:
+				Tags = self.schema.kinds[merge_by].Tags
+				parts = {part_id: [(Tags(value), (True, tuple(keys))) for value, keys in sorted(groups.items())] for part_id, groups in parts.items()}
+
+			layouts.append(((part_keys, kind), sorted(parts.items())))
+
+		units = list(OrderedDict.fromkeys(unit for _, parts in layouts for _, rows in parts for _, unit in rows))
+		results = self._evaluate_units(units, subsets, period, granularity, fields)
+
+		return [(sink, [(part_id, [(tags, results[unit]) for tags, unit in rows]) for part_id, rows in parts]) for sink, parts in layouts]
+
+	@staticmethod
+	def _split(rows, split_by, varying):
+		"""[(values of split_by, rows)] - rows split by the values of the tags in split_by."""
+		if not varying.intersection(split_by):
+			return [(tuple(getattr(rows[0], tag) for tag in split_by), rows)]
+
+		split = OrderedDict()
+		for row in rows:
+			split.setdefault(tuple(getattr(row, tag) for tag in split_by), []).append(row)
+		return list(split.items())
+
+	def _evaluate_units(self, units, subsets, period, granularity, fields):
+		"""{unit: result} - a unit is (False, series key) or (True, series keys of a group)."""
+		pool = self.db().process_pool
+		if pool is None:
+			transformed = {}
+			def series(key):
+				try:
+					return transformed[key]
+				except KeyError:
+					tags, rows = subsets[key]
+					result = transformed[key] = self.query_engine.transform_datapoints(rows, tags)
+					return result
+
+			with warnings.catch_warnings():
+				warnings.simplefilter("ignore", UserWarning) # Ignore scipy.interpolate warning about not good-enough interpolation.
+
+				results = {}
+				for unit in units:
+					merged, keys = unit
+					if merged:
+						result = self.query_engine.merge((subsets[key][0], series(key)) for key in keys)
+					else:
+						result = series(keys)
+					results[unit] = result(period, granularity, fields)
+				return results
+
+		raw_fields = self._raw_fields(fields, *set(merged for merged, _ in units))
+		packed = {}
+		def pack(key):
+			try:
+				return packed[key]
+			except KeyError:
+				tags, rows = subsets[key]
+				result = packed[key] = self._pack(tags, rows, raw_fields)
+				return result
+
+		submitted = []
+		for merged in (False, True):
+			selected = [unit for unit in units if unit[0] == merged]
+			chunk = [[pack(key) for key in keys] if merged else pack(keys) for merged, keys in selected]
+			submitted.append((merged, selected, self._submit(pool, merged, period, granularity, fields, chunk)))
+
+		results = {}
+		for merged, selected, futures in submitted:
+			Fields = self.query_engine.GFields if merged else self.query_engine.Fields
+			values = itertools.chain.from_iterable(future.result() for future in futures)
+			for unit, result in zip(selected, values):
+				results[unit] = self._unpack(Fields, result)
+		return results
+
+	def _raw_fields(self, fields, *groups):
+		"""Raw fields needed to compute the given aggregated fields of series and/or groups (group = True)."""
+		sources = set()
+		for group in groups:
+			sources |= self.query_engine.dependencies(fields, group = group)[1]
+		return tuple(name for name in self.schema.raw_fields.keys() if name in sources)
+
+	@staticmethod
+	def _pack(tags, rows, raw_fields):
+		return (tuple(tags),) + RawSeries(rows).columns(raw_fields)
+
+	@staticmethod
+	def _unpack(Fields, result):
+		if isinstance(result, list):
+			return [(subperiod, Fields.AggregatedFields(*values)) for subperiod, values in result]
+		return Fields.AggregatedFields(*result)
+
+	def _submit(self, pool, merged, period, granularity, fields, units):
+		size = len if merged else (lambda unit: 1)
+		return [
+			pool.submit(evaluate_chunk, self.name, self._desc, merged, period, granularity, fields, chunk)
+			for chunk in chunked(units, self.db().chunk_size, size)
+		]
+
 	# TODO Delete this code
 	def cql_raw_setup(self, drop_first=False):
 		yield from self.raw_data.cql_setup(drop_first=drop_first)
@@ -0,0 +1,61 @@
+from ._aggregated_data_store import AggregatedDataStore
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+import threading
+
+class Table:
+	name = "t"
+	schema = None
+
+class SlowStore(AggregatedDataStore):
+	"""Takes 50ms to upload, and keeps what happens in events."""
+
+	def __init__(self):
+		super().__init__(None, Table)
+		self.events = []
+		self.lock = threading.Lock()
+
+	def event(self, *event):
+		with self.lock:
+			self.events.append(event)
+
+	def save_single(self, period, part_keys, kind, partitions):
+		self.event("upload", part_keys)
+		sleep(0.05)
+		self.event("uploaded", part_keys)
+
+def data(store, n):
+	"""n (part_keys, kind), each taking 50ms to compute."""
+	for i in range(n):
+		def partitions(i=i):
+			store.event("compute", i)
+			sleep(0.05)
+			yield ((), [[i]])
+			store.event("computed", i)
+		yield (i, "channel"), partitions()
+
+for io_threads in (1, 3):
+	store = SlowStore()
+	with ThreadPoolExecutor(io_threads) as executor:
+		store.save(None, data(store, 10), executor, io_threads)
+
+	# Everything is uploaded.
+	assert(sorted(i for event, i in store.events if event == "uploaded") == list(range(10)))
+
+	# At most io_threads are uploaded, and one more computed, at a time.
+	computed = set()
+	uploaded = set()
+	overlapped = 0
+	for event, i in store.events:
+		if event == "compute":
+			assert(len(computed - uploaded) <= io_threads)
+			overlapped += len(computed - uploaded) > 0
+		elif event == "computed":
+			computed.add(i)
+		elif event == "uploaded":
+			uploaded.add(i)
+
+	# The next one is computed while the previous ones are uploaded.
+	assert(overlapped >= 8)
+
+print("OK")
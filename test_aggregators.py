@@ -0,0 +1,55 @@
+from .fakedb import FakeDatabase, channels
+from ._aggregators import RawAggregator, ReAggregator
+from .aggregation_engine import aggregate_results
+from . import Period, Duration
+import random
+
+start = Period("2016-05-16T00:00:00Z", "2016-05-16T01:00:00Z").start
+hours = list(Period("2016-05-16T00:00:00Z", "2016-05-16T04:00:00Z").subperiods(Duration("1h")))
+
+db = FakeDatabase({"channels": channels(1, 12, start, Duration("4h"), offline=[hours[2]])})
+table = db["channels"]
+
+# Every hour is saved with its parts in a different order.
+r = random.Random(1)
+saved = {}
+for hour in hours:
+	data = []
+	for sink, partitions in RawAggregator(table, hour):
+		partitions = [(tuple(part_id), list(rows)) for part_id, rows in partitions]
+		partitions = [(part_id, rows) for part_id, rows in partitions if rows] # Empty parts aren't stored.
+		r.shuffle(partitions)
+		data.append((sink, partitions))
+	saved[hour] = dict(data)
+	table.aggregated_data.save(hour, data)
+
+# They're stored sorted by part id.
+for hour in hours:
+	for (part_keys, kind), partitions in saved[hour].items():
+		part_ids = [tuple(part_id) for part_id, rows in table.aggregated_data.list_all_parts(hour, part_keys, kind, "viewers_max")]
+		assert(part_ids == sorted(part_id for part_id, rows in partitions))
+
+def plain(rows):
+	return [(tuple(row.tags), tuple(row.fields)) for row in rows]
+
+# Re-aggregated part by part, in part id order, with the rows of every part in time order.
+sinks = 0
+for (part_keys, kind), partitions in ReAggregator(table, hours):
+	partitions = [(tuple(part_id), plain(rows)) for part_id, rows in partitions]
+
+	expected = {}
+	for hour in hours:
+		for part_id, rows in saved[hour][(part_keys, kind)]:
+			expected.setdefault(part_id, []).extend((hour, row) for row in rows)
+	expected = sorted((part_id, plain(aggregate_results(rows))) for part_id, rows in expected.items())
+
+	assert(partitions == expected)
+	sinks += 1
+
+assert(sinks == 8)
+
+# Some parts are missing in some hours.
+assert(any(len(partitions) < 3 for partitions in saved[hours[0]].values()))
+assert(all(not partitions for (part_keys, kind), partitions in saved[hours[2]].items() if kind == "channel"))
+
+print("OK")
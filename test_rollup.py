@@ -0,0 +1,77 @@
+from .fakedb import FakeDatabase, SCHEMA, channels
+from . import _rollup
+from ._rollup import rollup
+from . import Period, Duration
+
+day = Period("2016-05-16T00:00:00Z", "2016-05-17T00:00:00Z")
+hours = list(day.subperiods(Duration("1h")))
+quarters = list(day.subperiods(Duration("6h")))
+rows = {"channels": channels(3, 4, day.start, day.duration)}
+schema = SCHEMA.replace("rollups: {1h: [1h], 1d: [1d]}", "rollups: {1h: [1h], 6h: [6h], 1d: [1d]}")
+
+def keys(db, period):
+	"""Stored files of period, and their contents."""
+	prefix = "channels/{p.end:%Y/%m/%d/%H/%M}/prev-{p.duration}/".format(p=period)
+	return {k: v for k, v in db.fs.data.items() if k.startswith(prefix)}
+
+def periods(ps):
+	return [(p.start, p.end) for p in ps]
+
+def database(done):
+	"""Database where the periods in done are rolled up on their own."""
+	db = FakeDatabase(rows, schema)
+	for p in done:
+		assert(rollup(db["channels"], p) == [p])
+	return db
+
+# The periods of the cached source periods when each period is rolled up.
+aggregator = _rollup._aggregator
+cached_keys = []
+def recording(table, period, logger, cached=None):
+	cached_keys.append(((period.start, period.end), sorted(cached or {})))
+	return aggregator(table, period, logger, cached)
+_rollup._aggregator = recording
+
+# The day rolled up on its own, after its quarters.
+expected = database(hours + quarters + [day])
+assert(keys(expected, day) and all(keys(expected, p) for p in hours + quarters))
+
+# The last hour cascades to its quarter and then to the day, once all_done says the others are done.
+asked = []
+def all_done(ps):
+	asked.append(periods(ps))
+	return True
+
+db = database(hours[:-1] + quarters[:-1])
+cached_keys = []
+assert(periods(rollup(db["channels"], hours[-1], cascade=True, all_done=all_done)) == periods([hours[-1], quarters[-1], day]))
+assert(asked == [periods(hours[18:23]), periods(quarters[:3])])
+# The hour is read from memory by its quarter, and dropped before the day, which reads the quarter from memory.
+assert(cached_keys == [
+	(periods(hours)[-1], []),
+	(periods(quarters)[-1], [periods(hours)[-1]]),
+	((day.start, day.end), [periods(quarters)[-1]]),
+])
+assert(keys(db, day) == keys(expected, day))
+assert(keys(db, quarters[-1]) == keys(expected, quarters[-1]))
+db.close()
+
+# Without all_done, or when it says the others aren't done, longer periods are left to the queue.
+for all_done in (None, lambda ps: False):
+	db = database(hours[:-1] + quarters[:-1])
+	assert(periods(rollup(db["channels"], hours[-1], cascade=True, all_done=all_done)) == periods([hours[-1]]))
+	assert(not keys(db, quarters[-1]) and not keys(db, day))
+	db.close()
+
+# A day with a missing hour is left to the queue, which knows that one of its quarters isn't rolled up.
+missing = hours[5]
+db = database([h for h in hours[:-1] if h != missing] + quarters[1:-1])
+stored = lambda ps: all(keys(db, p) for p in ps)
+assert(periods(rollup(db["channels"], hours[-1], cascade=True, all_done=stored)) == periods([hours[-1], quarters[-1]]))
+assert(keys(db, quarters[-1]) == keys(expected, quarters[-1]))
+assert(not keys(db, missing) and not keys(db, quarters[0]) and not keys(db, day))
+db.close()
+
+_rollup._aggregator = aggregator
+
+print("OK")
@@ -0,0 +1,47 @@
+from .fakedb import FakeDatabase, channels
+from ._aggregators import powerset
+from . import Period, Duration
+from datetime import timedelta
+import itertools
+
+period = Period("2016-05-16T01:00:00Z", "2016-05-16T03:00:00Z")
+rows = channels(2, 15, period.start - timedelta(hours=1), Duration("4h"))
+
+# Some channels switch games.
+games = {}
+for row in rows:
+	games.setdefault(row.channel, set()).add(row.game)
+assert(any(len(g) > 1 for g in games.values()) and any(len(g) == 1 for g in games.values()))
+
+def close(a, b):
+	if isinstance(a, float) or isinstance(b, float):
+		return a is not None and b is not None and abs(a - b) <= 1e-9 * max(1, abs(a), abs(b))
+	if isinstance(a, timedelta):
+		return abs((a - b).total_seconds()) <= 1e-6
+	if isinstance(a, Period):
+		return (a.start, a.end) == (b.start, b.end)
+	if isinstance(a, (tuple, list)):
+		return len(a) == len(b) and all(close(x, y) for x, y in zip(a, b))
+	return a == b
+
+def plain(partitions):
+	return [(tuple(part_id), [(tuple(tags), result) for tags, result in results]) for part_id, results in partitions]
+
+# query_fields_all() gives the same as query_fields() for every (partition_by, kind), in the same order.
+for workers in (0, 2):
+	db = FakeDatabase({"channels": rows}, workers=workers, chunk_size=4)
+	table = db["channels"]
+	sinks = [(part_keys, kind) for part_keys in powerset(table.schema.group.by) for kind in table.schema.kinds if kind not in part_keys]
+
+	for granularity, fields in [(None, None), (Duration("30m"), None), (None, ["viewers_avg", "time_streamed"])]:
+		all_sinks = table.query_fields_all(period, sinks, granularity=granularity, fields=fields)
+		assert([sink for sink, partitions in all_sinks] == sinks)
+
+		for (part_keys, kind), partitions in all_sinks:
+			expected = plain(table.query_fields(period, {}, part_keys, kind, granularity, fields))
+			assert(expected)
+			assert(close(plain(partitions), expected))
+
+	db.close()
+
+print("OK")